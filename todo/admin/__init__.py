@@ -37,22 +37,46 @@
 
 from django.contrib import admin
 
+from todo.db import EstimatedCountQuerySet
 from todo.models import *
 from todo.admin.proto import (ProtoTrackerAdmin, ProtoTaskAdmin,
                               ProtoStepAdmin)
 
-class ActionAdmin(admin.ModelAdmin):
+class EstimatedCountMixin(object):
+    """Don't count all the rows of big tables on the changelists.
+
+    See todo.db.EstimatedCountQuerySet.  The changelists of unfiltered big 
+    tables show an approximate number of objects and pages.
+
+    """
+    def queryset(self, request):
+        qs = super(EstimatedCountMixin, self).queryset(request)
+        return qs._clone(klass=EstimatedCountQuerySet)
+
+class ActionAdmin(EstimatedCountMixin, admin.ModelAdmin):
     list_display_links = ('timestamp',)
     list_display = ('id', 'timestamp', 'user', 'subject_repr', 'flag')
+    list_select_related = True
+    list_filter = ('flag',)
+    date_hierarchy = 'timestamp'
+    raw_id_fields = ('user',)
 
 class TaskInProjectInline(admin.TabularInline):
     model = TaskInProject
     verbose_name_plural = 'Projects'
     extra = 1
 
-class TaskAdmin(admin.ModelAdmin):
+class TrackerInProjectInline(admin.TabularInline):
+    model = TrackerInProject
+    verbose_name_plural = 'Projects'
+    extra = 1
+
+class TaskAdmin(EstimatedCountMixin, admin.ModelAdmin):
     list_display_links = ('summary',)
-    list_display = ('id', 'summary', 'locale',)
+    # the cached repr is displayed instead of the locale
+    list_display = ('id', 'summary', 'locale_repr',)
+    search_fields = ('^summary', '^alias')
+    raw_id_fields = ('prototype', 'parent')
     inlines = [TaskInProjectInline]
     fieldsets = (
             (None, {'fields': ('summary', 'alias', 'bugid')}),
@@ -67,14 +91,73 @@ class TaskAdmin(admin.ModelAdmin):
             }),
     )
 
+class TrackerAdmin(EstimatedCountMixin, admin.ModelAdmin):
+    list_display_links = ('summary',)
+    # a foreign key in list_display would make the changelist call 
+    # `select_related()`, which doesn't follow the nullable `locale`
+    list_display = ('id', 'summary', 'locale_code', 'alias')
+    search_fields = ('^summary', '^alias')
+    raw_id_fields = ('prototype', 'parent')
+    inlines = [TrackerInProjectInline]
+
+    def queryset(self, request):
+        qs = super(TrackerAdmin, self).queryset(request)
+        return qs.select_related('locale')
+
+    def locale_code(self, tracker):
+        return tracker.locale.code if tracker.locale else ''
+    locale_code.short_description = 'locale'
+
+class StepAdmin(EstimatedCountMixin, admin.ModelAdmin):
+    list_display_links = ('summary',)
+    # the cached reprs are displayed instead of the related objects
+    list_display = ('id', 'summary', 'task_repr', 'owner_repr', 'status')
+    list_filter = ('status', 'is_review')
+    search_fields = ('^task__summary',)
+    raw_id_fields = ('prototype', 'parent', 'task', 'owner')
+
+    def queryset(self, request):
+        qs = super(StepAdmin, self).queryset(request)
+        return qs.select_related('task')
+
+    def task_repr(self, step):
+        return step.task._repr
+    task_repr.short_description = 'task'
+
+class TaskInProjectAdmin(EstimatedCountMixin, admin.ModelAdmin):
+    list_display = ('id', 'task_repr', 'project', 'status', 'resolution')
+    list_select_related = True
+    list_filter = ('status', 'project')
+    search_fields = ('^task__summary',)
+    raw_id_fields = ('task',)
+
+    def task_repr(self, status):
+        return status.task._repr
+    task_repr.short_description = 'task'
+
+class TrackerInProjectAdmin(EstimatedCountMixin, admin.ModelAdmin):
+    list_display = ('id', 'tracker_repr', 'project', 'status', 'resolution')
+    list_select_related = True
+    list_filter = ('status', 'project')
+    search_fields = ('^tracker__summary',)
+    raw_id_fields = ('tracker',)
+
+    def tracker_repr(self, status):
+        return status.tracker._repr
+    tracker_repr.short_description = 'tracker'
+
+class ActorAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'slug')
+    search_fields = ('^slug',)
+
 admin.site.register(Action, ActionAdmin)
 admin.site.register(Project)
-admin.site.register(Actor)
-admin.site.register(Tracker)
+admin.site.register(Actor, ActorAdmin)
+admin.site.register(Tracker, TrackerAdmin)
 admin.site.register(Task, TaskAdmin)
-admin.site.register(Step)
-admin.site.register(TaskInProject)
-admin.site.register(TrackerInProject)
+admin.site.register(Step, StepAdmin)
+admin.site.register(TaskInProject, TaskInProjectAdmin)
+admin.site.register(TrackerInProject, TrackerInProjectAdmin)
 admin.site.register(ProtoTracker, ProtoTrackerAdmin)
 admin.site.register(ProtoTask, ProtoTaskAdmin)
 admin.site.register(ProtoStep, ProtoStepAdmin)
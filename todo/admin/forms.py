@@ -36,54 +36,175 @@
 # ***** END LICENSE BLOCK *****
 
 from django import forms 
+from django.db.models import Q
+from django.forms.formsets import DELETION_FIELD_NAME
 from django.forms.models import BaseInlineFormSet, inlineformset_factory
 
+from todo.db import bulk_insert, bulk_update
 from todo.models import Proto, Nesting
+from todo.models.proto import TRACKER_TYPE, TASK_TYPE, STEP_TYPE
+
+def get_nestings(proto):
+    """Get all Nesting objects where the prototype is the parent or the child.
+
+    The nestings are retrieved with one query, together with the prototypes 
+    on both sides, and cached on the prototype, so that all inline formsets of 
+    an admin page share them.
+
+    """
+    if not hasattr(proto, '_nestings'):
+        if proto.pk is None:
+            proto._nestings = []
+        else:
+            nestings = Nesting.objects.filter(Q(parent=proto) | Q(child=proto))
+            proto._nestings = list(nestings.select_related('parent', 'child'))
+    return proto._nestings
+
+def get_protos(proto, type=None):
+    """Get the prototypes (of the given type) to choose from in the nesting 
+    formsets of a prototype's admin page.
+
+    The prototypes are retrieved once per type and cached on the prototype.  
+    Returns a tuple of a dict mapping their IDs to the prototypes and a list of 
+    choices.
+
+    """
+    cache = proto.__dict__.setdefault('_protos', {})
+    if type not in cache:
+        protos = Proto.objects.all()
+        if type is not None:
+            protos = protos.filter(type=type)
+        protos = list(protos)
+        choices = [('', '---------')]
+        choices.extend((p.pk, unicode(p)) for p in protos)
+        cache[type] = (dict((p.pk, p) for p in protos), choices)
+    return cache[type]
+
+class ProtoChoiceField(forms.ChoiceField):
+    """A field for choosing a prototype from a list cached by the formset.
+
+    Unlike ModelChoiceField, neither rendering nor validating it queries the 
+    database.  The formset sets the prototypes with `set_protos`.
+
+    """
+    def __init__(self, *args, **kwargs):
+        super(ProtoChoiceField, self).__init__(*args, **kwargs)
+        self.protos = {}
+
+    def set_protos(self, protos, choices):
+        self.protos = protos
+        self.choices = choices
+
+    def clean(self, value):
+        value = super(ProtoChoiceField, self).clean(value)
+        if not value:
+            return None
+        return self.protos[int(value)]
+
+class BaseNestingSet(BaseInlineFormSet):
+    """A formset of the nestings of a prototype.
+
+    The nestings are taken from `get_nestings` and the prototypes to choose 
+    from from `get_protos`, so that the formsets of an admin page run only 
+    a couple of queries, no matter how many rows they have.  All changes are 
+    saved in bulk.
+
+    """
+    # the type of the prototypes on the other side of the nestings, or None 
+    # for prototypes of any type
+    proto_type = None
 
-class BaseProtoTrackerSet(BaseInlineFormSet):
     def __init__(self, *args, **kwargs):
-        kwargs['queryset'] = Nesting.objects.filter(child=kwargs['instance'],
-                                                    parent__type=1)
-        super(BaseProtoTrackerSet, self).__init__(*args, **kwargs)
+        # the forms are constructed in __init__ already
+        self.other = 'parent' if self.fk.name == 'child' else 'child'
+        super(BaseNestingSet, self).__init__(*args, **kwargs)
+
+    def get_queryset(self):
+        if not hasattr(self, '_queryset'):
+            pk = self.instance.pk
+            nestings = [n for n in get_nestings(self.instance)
+                        if getattr(n, self.fk.get_attname()) == pk and
+                           (self.proto_type is None or 
+                            getattr(n, self.other).type == self.proto_type)]
+            nestings.sort(key=lambda n: (n.parent_id, n.order))
+            self._queryset = nestings
+        return self._queryset
+
+    def add_fields(self, form, index):
+        super(BaseNestingSet, self).add_fields(form, index)
+        protos, choices = get_protos(self.instance, self.proto_type)
+        form.fields[self.other].set_protos(protos, choices)
+
+    def save(self, commit=True):
+        if not commit or self.save_as_new:
+            return super(BaseNestingSet, self).save(commit)
+        self.new_objects = []
+        self.changed_objects = []
+        self.deleted_objects = []
+        for form in self.initial_forms:
+            if (self.can_delete and 
+                form.cleaned_data.get(DELETION_FIELD_NAME, False)):
+                self.deleted_objects.append(form.instance)
+            elif form.has_changed():
+                self.changed_objects.append((form.save(commit=False),
+                                             form.changed_data))
+        for form in self.extra_forms:
+            if not form.has_changed():
+                continue
+            if (self.can_delete and
+                form.cleaned_data.get(DELETION_FIELD_NAME, False)):
+                continue
+            obj = form.save(commit=False)
+            setattr(obj, self.fk.get_attname(), self.instance.pk)
+            self.new_objects.append(obj)
+        if self.deleted_objects:
+            Nesting.objects.filter(pk__in=[obj.pk for obj in 
+                                           self.deleted_objects]).delete()
+        fields = [f.name for f in Nesting._meta.fields if not f.primary_key]
+        bulk_update(Nesting, [obj for obj, changed in self.changed_objects],
+                    fields)
+        bulk_insert(Nesting, self.new_objects)
+        return ([obj for obj, changed in self.changed_objects] + 
+                self.new_objects)
+
+class BaseProtoTrackerSet(BaseNestingSet):
+    proto_type = TRACKER_TYPE
 
 ProtoTrackerSet = inlineformset_factory(Proto,
                                         Nesting,
                                         fk_name="child",
                                         formset=BaseProtoTrackerSet)
 
-class BaseProtoTaskSet(BaseInlineFormSet):
-    def __init__(self, *args, **kwargs):
-        kwargs['queryset'] = Nesting.objects.filter(child=kwargs['instance'],
-                                                    parent__type=2)
-        super(BaseProtoTaskSet, self).__init__(*args, **kwargs)
+class BaseProtoTaskSet(BaseNestingSet):
+    proto_type = TASK_TYPE
 
 ProtoTaskSet = inlineformset_factory(Proto,
                                      Nesting,
                                      fk_name="child",
                                      formset=BaseProtoTaskSet)
 
-class BaseProtoStepSet(BaseInlineFormSet):
-    def __init__(self, *args, **kwargs):
-        kwargs['queryset'] = Nesting.objects.filter(child=kwargs['instance'],
-                                                    parent__type=3)
-        super(BaseProtoStepSet, self).__init__(*args, **kwargs)
+class BaseProtoStepSet(BaseNestingSet):
+    proto_type = STEP_TYPE
 
 ProtoStepSet = inlineformset_factory(Proto,
                                      Nesting,
                                      fk_name="child",
                                      formset=BaseProtoStepSet)
 
+ChildSet = inlineformset_factory(Proto,
+                                 Nesting,
+                                 fk_name="parent",
+                                 formset=BaseNestingSet)
+
 class ProtoTrackerForm(forms.ModelForm):
-    parent = forms.ModelChoiceField(Proto.objects.filter(type=1),
-                                   label='Proto tracker')
+    parent = ProtoChoiceField(label='Proto tracker')
 
     class Meta:
         model = Nesting
         fields = ['parent']
 
 class ProtoTaskForm(forms.ModelForm):
-    parent = forms.ModelChoiceField(Proto.objects.filter(type=2),
-                                   label='Proto task')
+    parent = ProtoChoiceField(label='Proto task')
     order = forms.IntegerField(label='Order', required=True)
 
     class Meta:
@@ -91,5 +212,11 @@ class ProtoTaskForm(forms.ModelForm):
         fields = ['parent', 'order', 'is_auto_activated']
 
 class ProtoStepForm(ProtoTaskForm):
-    parent = forms.ModelChoiceField(Proto.objects.filter(type=3),
-                                   label='Proto step')
+    parent = ProtoChoiceField(label='Proto step')
+
+class ChildForm(forms.ModelForm):
+    child = ProtoChoiceField(label='Child')
+
+    class Meta:
+        model = Nesting
+        fields = ['child', 'order', 'is_auto_activated']
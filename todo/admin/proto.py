@@ -40,7 +40,8 @@ from django.contrib import admin
 from todo.models import *
 from todo.admin.forms import (ProtoTrackerSet, ProtoTrackerForm,
                               ProtoTaskSet, ProtoTaskForm,
-                              ProtoStepSet, ProtoStepForm)
+                              ProtoStepSet, ProtoStepForm,
+                              ChildSet, ChildForm)
 
 class TrackerNestingInline(admin.TabularInline):
     model = Nesting
@@ -69,6 +70,8 @@ class StepNestingInline(admin.TabularInline):
 class NestingInline(admin.TabularInline):
     model = Nesting
     fk_name = 'parent'
+    formset = ChildSet
+    form = ChildForm
     verbose_name_plural = 'Children'
     extra = 0
 
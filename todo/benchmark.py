@@ -0,0 +1,321 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Mozilla todo app.
+#
+# The Initial Developer of the Original Code is
+# Mozilla Foundation.
+# Portions created by the Initial Developer are Copyright (C) 2010
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#   Stas Malolepszy <stas@mozilla.com>
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+"""Synthetic data and benchmarks of the hot paths of todo.
+
+`generate_data` creates locales, projects, a graph of prototypes and trees of
+todo objects spawned from it, at a configurable scale.  `run_benchmarks` times
+the most frequently used snippets and workflows on that data and counts their
+queries.  See the `generatetododata` and `benchmarktodo` management commands.
+
+"""
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.http import HttpRequest
+
+from todo.workflow import NEXT, RESOLVED
+
+import random
+import time
+
+# the prefix of the labels, codes and summaries of the generated objects
+PREFIX = 'bench'
+
+class CountingCursor(object):
+    "A cursor wrapper recording the SQL of the executed queries."
+    def __init__(self, cursor, queries):
+        self.cursor = cursor
+        self.queries = queries
+
+    def execute(self, sql, params=()):
+        self.queries.append(sql)
+        return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.queries.append(sql)
+        return self.cursor.executemany(sql, param_list)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+def count_queries(func, *args, **kwargs):
+    """Call the function and record the queries it runs.
+
+    Unlike `connection.queries`, this doesn't depend on settings.DEBUG and
+    isn't cleared by `reset_queries` (which `Proto.spawn_per_locale` calls).
+
+    Returns a tuple of the result of the function and the list of the SQL
+    statements of the queries (with placeholders instead of parameters).
+
+    """
+    queries = []
+    cursor = type(connection).cursor
+    connection.cursor = lambda: CountingCursor(cursor(connection), queries)
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        del connection.cursor
+    return result, queries
+
+def rolled_back(func, *args, **kwargs):
+    "Call the function in a transaction which is rolled back afterwards."
+    transaction.enter_transaction_management()
+    transaction.managed(True)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        transaction.rollback()
+        transaction.leave_transaction_management()
+
+def get_request(user):
+    "Get a minimal GET request of the given user for the snippets."
+    request = HttpRequest()
+    request.method = 'GET'
+    request.user = user
+    return request
+
+def _make_proto_tree(model_protos, depth, fanout, steps, owner, path=()):
+    """Create a ProtoTracker with `depth` levels of child ProtoTrackers, each 
+    with `fanout` children, and `fanout` ProtoTasks with `steps` ProtoSteps 
+    each on the last level."""
+    ProtoTracker, ProtoTask, ProtoStep, Nesting = model_protos
+    name = '-'.join([PREFIX] + [str(i) for i in path]) 
+    proto = ProtoTracker.objects.create(summary='%s tracker' % name,
+                                        suffix=str(path[-1]) if path else PREFIX)
+    for i in range(fanout):
+        if depth > 1:
+            child = _make_proto_tree(model_protos, depth - 1, fanout, steps,
+                                     owner, path + (i,))
+        else:
+            child = ProtoTask.objects.create(summary='%s-%d task' % (name, i),
+                                             suffix='t%d' % i)
+            for order in range(1, steps + 1):
+                step = ProtoStep.objects.create(
+                    summary='%s-%d step %d' % (name, i, order), owner=owner,
+                    is_review=(order == steps))
+                Nesting.objects.create(parent=child, child=step, order=order)
+        Nesting.objects.create(parent=proto, child=child, order=i + 1)
+    return proto
+
+@transaction.commit_on_success
+def generate_data(locales=10, projects=5, depth=2, fanout=3, steps=3,
+                  trees=2, resolved=0.5, seed=0, verbose=False):
+    """Generate synthetic todo data.
+
+    Arguments:
+        locales -- the number of locales
+        projects -- the number of projects
+        depth -- the number of levels of trackers in the prototype graph
+        fanout -- the number of children of every prototype tracker
+        steps -- the number of steps of every prototype task
+        trees -- the number of trees spawned per locale; each is related to 
+                 one or two random projects
+        resolved -- the ratio of the spawned tasks to resolve
+        seed -- the seed of the random choices
+
+    Returns a dict with the numbers of the created objects.
+
+    """
+    from life.models import Locale
+    from todo.models import (Actor, Project, ProtoTracker, ProtoTask, 
+                             ProtoStep, Nesting, Task)
+    rand = random.Random(seed)
+    user, created = User.objects.get_or_create(username='%s-user' % PREFIX)
+    owner, created = Actor.objects.get_or_create(
+        slug='%s-owner' % PREFIX, defaults={'name': '%s owner' % PREFIX})
+    all_locales = []
+    for i in range(locales):
+        locale, created = Locale.objects.get_or_create(
+            code='%s%d' % (PREFIX, i), 
+            defaults={'name': '%s locale %d' % (PREFIX, i)})
+        all_locales.append(locale)
+    model_ct_id = ContentType.objects.get_for_model(Project).pk
+    all_projects = []
+    for i in range(projects):
+        project, created = Project.objects.get_or_create(
+            label='%s-%d' % (PREFIX, i), model_ct_id=model_ct_id)
+        all_projects.append(project)
+    if verbose:
+        print 'Created %d locales and %d projects.' % (locales, projects)
+
+    proto = _make_proto_tree((ProtoTracker, ProtoTask, ProtoStep, Nesting),
+                             depth, fanout, steps, owner)
+    spawned = []
+    for i in range(trees):
+        chosen = rand.sample(all_projects, min(len(all_projects), 
+                                               rand.randint(1, 2)))
+        spawned.extend(proto.spawn_per_locale(user, locales=all_locales,
+                                              projects=chosen,
+                                              suffix='%s%d' % (PREFIX, i)))
+        if verbose:
+            print 'Spawned tree %d of %d.' % (i + 1, trees)
+
+    tasks = list(Task.objects.filter(prototype__summary__startswith=PREFIX,
+                                     statuses__status__lt=RESOLVED)
+                             .distinct())
+    to_resolve = rand.sample(tasks, int(len(tasks) * resolved))
+    for task in to_resolve:
+        for status in task.statuses.all():
+            task.resolve(user, status.project)
+    if verbose:
+        print 'Resolved %d of %d tasks.' % (len(to_resolve), len(tasks))
+    return {
+        'locales': locales,
+        'projects': projects,
+        'trees': len(spawned),
+        'tasks': len(tasks),
+        'resolved': len(to_resolve),
+    }
+
+def get_data():
+    "Get the generated objects used by the benchmarks."
+    from life.models import Locale
+    from todo.models import Project, ProtoTracker, Tracker, Task, Step
+    user = User.objects.get(username='%s-user' % PREFIX)
+    proto = (ProtoTracker.objects.filter(summary='%s tracker' % PREFIX)
+                                 .order_by('-pk')[0])
+    tracker = Tracker.objects.filter(prototype=proto).order_by('pk')[0]
+    locales = list(Locale.objects.filter(code__startswith=PREFIX))
+    projects = list(Project.objects.filter(label__startswith=PREFIX))
+    # a task with steps to resolve one by one
+    step = Step.objects.filter(task__prototype__summary__startswith=PREFIX,
+                               status=NEXT, parent=None)[0]
+    task = step.task
+    project = task.statuses.all()[0].project
+    return {
+        'user': user,
+        'proto': proto,
+        'tracker': tracker,
+        'task': task,
+        'locale': task.locale,
+        'locales': locales,
+        'project': project,
+        'projects': projects,
+    }
+
+def resolve_task_steps(data):
+    "Resolve the steps of the task one by one, bubbling up to the top."
+    from todo.models import Step
+    steps = Step.objects.filter(task=data['task'])
+    # every round resolves at least one step
+    for i in range(steps.count()):
+        next_steps = list(steps.filter(status=NEXT))
+        if not next_steps:
+            break
+        for step in next_steps:
+            step.resolve(data['user'])
+
+def _task_counts(data):
+    for project in data['projects']:
+        for locale in data['locales']:
+            project.task_count(locale)
+
+def _snippets():
+    # imported here to avoid circular imports with todo.views
+    from todo.views import snippets
+    return snippets
+
+# The benchmarks: names mapped to functions taking the data from `get_data`.
+BENCHMARKS = (
+    ('spawn_per_locale', lambda data: list(data['proto'].spawn_per_locale(
+        data['user'], locales=data['locales'], projects=[data['project']]))),
+    ('snippets.tree', lambda data: _snippets().tree(
+        get_request(data['user']), tracker=data['tracker'])),
+    ('snippets.showcase', lambda data: _snippets().showcase(
+        get_request(data['user']), data['project'], data['locale'])),
+    ('snippets.task', lambda data: _snippets().task(
+        get_request(data['user']), data['task'])),
+    ('step.resolve', resolve_task_steps),
+    ('project.task_count', _task_counts),
+)
+
+def run_benchmarks(names=None, repeat=5):
+    """Run the benchmarks on the generated data.
+
+    Every benchmark is run `repeat` times, each time in a transaction which is 
+    rolled back afterwards, so that the runs are independent.
+
+    Returns a dict mapping the names of the benchmarks to dicts with the 
+    number of queries and the minimal and median times in milliseconds.
+
+    """
+    results = {}
+    for name, func in BENCHMARKS:
+        if names and name not in names:
+            continue
+        times = []
+        queries = None
+        for i in range(repeat):
+            def run():
+                # the objects might be modified by the benchmark
+                data = get_data()
+                start = time.time()
+                result, run_queries = count_queries(func, data)
+                return time.time() - start, run_queries
+            elapsed, run_queries = rolled_back(run)
+            times.append(elapsed * 1000)
+            if queries is None:
+                queries = len(run_queries)
+        times.sort()
+        results[name] = {
+            'queries': queries,
+            'min_ms': round(times[0], 2),
+            'median_ms': round(times[len(times) // 2], 2),
+        }
+    return results
+
+def compare(results, baseline):
+    """Compare the results with a baseline.
+
+    Returns a list of tuples of the name of the benchmark, the number of 
+    queries in the baseline and now, and the ratio of the median times.
+
+    """
+    rows = []
+    for name, result in sorted(results.iteritems()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = (result['median_ms'] / base['median_ms'] 
+                 if base['median_ms'] else None)
+        rows.append((name, base['queries'], result['queries'], ratio))
+    return rows
@@ -0,0 +1,266 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Mozilla todo app.
+#
+# The Initial Developer of the Original Code is
+# Mozilla Foundation.
+# Portions created by the Initial Developer are Copyright (C) 2010
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#   Stas Malolepszy <stas@mozilla.com>
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+"""A client for the Bugzilla REST API (BzAPI).
+
+The client fetches the data of many bugs in one request, keeps the HTTP
+connection open between requests and caches the results for all instances
+in the process and, optionally, on disk.  The following settings are used:
+
+    TODO_BZAPI_URL -- the base URL of the API (the default is the public
+                      BzAPI instance); point it to a local server in tests
+    TODO_BZAPI_CACHE_TIMEOUT -- the number of seconds the results are cached
+                                for (the default is 300)
+    TODO_BZAPI_CACHE_DIR -- a directory in which the results are cached in
+                            addition to the process memory, so that they're
+                            shared between processes (optional)
+    TODO_BZAPI_HTTP_TIMEOUT -- the timeout of the HTTP requests in seconds
+                               (the default is 10)
+
+"""
+
+from django.conf import settings
+from django.core.cache import get_cache
+
+import httplib
+import socket
+import threading
+import time
+import urllib
+import urlparse
+from datetime import datetime
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+BZAPI_URL = getattr(settings, 'TODO_BZAPI_URL',
+                    'https://api-dev.bugzilla.mozilla.org/latest/')
+CACHE_TIMEOUT = getattr(settings, 'TODO_BZAPI_CACHE_TIMEOUT', 300)
+CACHE_DIR = getattr(settings, 'TODO_BZAPI_CACHE_DIR', None)
+HTTP_TIMEOUT = getattr(settings, 'TODO_BZAPI_HTTP_TIMEOUT', 10)
+# the number of bugs requested at once; keeps the URLs reasonably short
+BATCH_SIZE = 100
+
+class BzAPIError(Exception):
+    pass
+
+class TTLCache(object):
+    """A cache of bug data kept in the process memory and, if `path` is given,
+    in files in that directory.
+
+    """
+    def __init__(self, timeout, path=None):
+        self.timeout = timeout
+        self._data = {}
+        self._lock = threading.Lock()
+        self._disk = None
+        if path:
+            self._disk = get_cache('file://%s?timeout=%d' % (path, timeout))
+
+    def _disk_key(self, key):
+        return 'todo-bzapi-%s' % urllib.quote(unicode(key).encode('utf-8'))
+
+    def get_many(self, keys):
+        "Get a dict with the values found in the cache."
+        now = time.time()
+        found = {}
+        self._lock.acquire()
+        try:
+            for key in keys:
+                if key in self._data:
+                    expires, value = self._data[key]
+                    if expires > now:
+                        found[key] = value
+                    else:
+                        del self._data[key]
+        finally:
+            self._lock.release()
+        if self._disk is not None:
+            for key in keys:
+                if key in found:
+                    continue
+                value = self._disk.get(self._disk_key(key))
+                if value is not None:
+                    found[key] = value
+                    self._set_local(key, value, now)
+        return found
+
+    def _set_local(self, key, value, now):
+        self._lock.acquire()
+        try:
+            self._data[key] = (now + self.timeout, value)
+        finally:
+            self._lock.release()
+
+    def set_many(self, values):
+        now = time.time()
+        for key, value in values.iteritems():
+            self._set_local(key, value, now)
+            if self._disk is not None:
+                self._disk.set(self._disk_key(key), value, self.timeout)
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._data.clear()
+        finally:
+            self._lock.release()
+
+# shared by all clients using the default settings
+_cache = TTLCache(CACHE_TIMEOUT, CACHE_DIR)
+
+class BzAPI(object):
+    """A client for BzAPI.
+
+    Arguments:
+        base_url -- the base URL of the API; TODO_BZAPI_URL by default
+        cache -- a TTLCache to keep the results in; the cache shared by all
+                 clients in the process by default
+        timeout -- the timeout of the HTTP requests in seconds
+
+    """
+    time_format = r'%Y-%m-%dT%H:%M:%SZ'
+
+    def __init__(self, base_url=None, cache=None, timeout=HTTP_TIMEOUT):
+        self.base_url = base_url or BZAPI_URL
+        if not self.base_url.endswith('/'):
+            self.base_url += '/'
+        url = urlparse.urlsplit(self.base_url)
+        self._scheme = url[0]
+        self._netloc = url[1]
+        self._path = url[2]
+        self.cache = cache if cache is not None else _cache
+        self.timeout = timeout
+        self._conn = None
+
+    def _connect(self):
+        if self._scheme == 'https':
+            conn_class = httplib.HTTPSConnection
+        else:
+            conn_class = httplib.HTTPConnection
+        try:
+            return conn_class(self._netloc, timeout=self.timeout)
+        except TypeError:
+            # Python 2.5 doesn't support timeouts
+            return conn_class(self._netloc)
+
+    def get(self, path, **params):
+        """Make a GET request to the API and return the decoded response.
+
+        The connection is reused by subsequent requests.  If the server has
+        closed it in the meantime, the request is retried once on a new
+        connection.
+
+        """
+        url = '%s%s' % (self._path, path)
+        if params:
+            url = '%s?%s' % (url, urllib.urlencode(params))
+        for attempt in (1, 2):
+            if self._conn is None:
+                self._conn = self._connect()
+            try:
+                self._conn.request('GET', url,
+                                   headers={'Accept': 'application/json'})
+                response = self._conn.getresponse()
+                body = response.read()
+                break
+            except (httplib.HTTPException, socket.error):
+                self.close()
+                if attempt == 2:
+                    raise
+        if response.getheader('connection', '').lower() == 'close':
+            self.close()
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise BzAPIError('Invalid response (HTTP %d)' % response.status)
+        if isinstance(data, dict) and data.get('error'):
+            raise BzAPIError(data.get('message', 'Unknown error'))
+        return data
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def last_modified_many(self, bugids):
+        """Get the times of the last changes of many bugs.
+
+        The bugs which aren't cached are fetched in batches of BATCH_SIZE.
+        Returns a dict mapping the bug IDs (or aliases, as passed) to
+        datetimes; bugs that don't exist are omitted.
+
+        """
+        bugids = [unicode(bugid) for bugid in bugids]
+        found = self.cache.get_many(bugids)
+        missing = [bugid for bugid in bugids if bugid not in found]
+        for i in xrange(0, len(missing), BATCH_SIZE):
+            batch = missing[i:i + BATCH_SIZE]
+            fetched = {}
+            for bug in self.fetch_bugs(batch):
+                # the bugs can be requested by their aliases
+                for key in (bug.get('id'), bug.get('alias')):
+                    if key is not None and unicode(key) in batch:
+                        fetched[unicode(key)] = bug['last_change_time']
+            self.cache.set_many(fetched)
+            found.update(fetched)
+        return found
+
+    def fetch_bugs(self, bugids, fields=('id', 'alias', 'last_change_time')):
+        """Fetch the bugs with one request, bypassing the cache.
+
+        Returns a list of dicts with the requested fields.  The value of
+        last_change_time is converted to a datetime.  Don't pass more than
+        BATCH_SIZE IDs or aliases.
+
+        """
+        data = self.get('bug', id=','.join([unicode(b) for b in bugids]),
+                        include_fields=','.join(fields))
+        bugs = data.get('bugs', [])
+        for bug in bugs:
+            if 'last_change_time' in bug:
+                bug['last_change_time'] = datetime.strptime(
+                    bug['last_change_time'], self.time_format)
+        return bugs
+
+    def last_modified(self, bugid):
+        "Get the time of the last change of the bug."
+        try:
+            return self.last_modified_many([bugid])[unicode(bugid)]
+        except KeyError:
+            raise BzAPIError('Bug %s not found' % bugid)
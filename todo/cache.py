@@ -0,0 +1,238 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Mozilla todo app.
+#
+# The Initial Developer of the Original Code is
+# Mozilla Foundation.
+# Portions created by the Initial Developer are Copyright (C) 2010
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#   Stas Malolepszy <stas@mozilla.com>
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.hashcompat import md5_constructor
+
+import time
+
+# Number of seconds the rendered tracker trees are cached for.  The cache is
+# disabled if the setting is 0 or None (default).  Use a cache backend shared
+# by all processes (e.g. memcached), since the invalidation only affects the
+# backend it's run against.
+TREE_CACHE_TIMEOUT = getattr(settings, 'TODO_TREE_CACHE_TIMEOUT', None)
+# Number of seconds the completion matrix (see `todo.views.api.matrix`) is
+# cached for.  Disabled if 0 or None (default).
+MATRIX_CACHE_TIMEOUT = getattr(settings, 'TODO_MATRIX_CACHE_TIMEOUT', None)
+# Number of seconds the resolved choices of the create-new wizard are kept for
+# (see todo.forms.new.CreateNewWizard).
+WIZARD_STATE_TIMEOUT = getattr(settings, 'TODO_WIZARD_STATE_TIMEOUT', 60 * 60)
+# generations are kept for a long time; if one gets evicted anyway, a new
+# unique value is used (see `get_generation`)
+GENERATION_TIMEOUT = 60 * 60 * 24 * 30
+# permissions that change the markup of the tracker tree
+TREE_PERMS = ('todo.change_tracker', 'todo.change_task')
+
+def _new_generation():
+    # a value which is different from any generation used before, even if the
+    # original generation key has been evicted from the cache
+    return int(time.time() * 1000)
+
+def get_generation(scope):
+    """Get the current generation of a scope of cached data.
+
+    Every key of cached data includes the generation of the scope it belongs
+    to.  Invalidating all keys in a scope is thus as simple as bumping its
+    generation (see `bump_generation`); the old keys will never be used again
+    and will expire on their own.
+
+    """
+    key = 'todo:gen:%s' % scope
+    generation = cache.get(key)
+    if generation is None:
+        generation = _new_generation()
+        cache.add(key, generation, GENERATION_TIMEOUT)
+        # another process might have added it in the meantime
+        generation = cache.get(key, generation)
+    return generation
+
+def bump_generation(scope):
+    "Invalidate all cached data stored in the scope."
+    key = 'todo:gen:%s' % scope
+    try:
+        cache.incr(key)
+    except ValueError:
+        # the key doesn't exist
+        cache.set(key, _new_generation(), GENERATION_TIMEOUT)
+
+def _incr_counter(name):
+    key = 'todo:counter:%s' % name
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, GENERATION_TIMEOUT):
+            cache.incr(key)
+
+def get_counters(*names):
+    "Get the values of the named counters as a dict."
+    return dict((name, cache.get('todo:counter:%s' % name, 0))
+                for name in names)
+
+def _get_scopes(obj):
+    """Get the names of the tree scopes which the todo object is displayed in.
+
+    These are the trees of all trackers above (and including) the object, as
+    well as the project/locale trees of the object's projects and locale.
+
+    """
+    from todo.models import (Tracker, Task, Step, TaskInProject,
+                             TrackerInProject)
+    from todo.models.tracker import get_tracker_chains
+
+    if isinstance(obj, (TaskInProject, Step)):
+        obj = obj.task
+    elif isinstance(obj, TrackerInProject):
+        obj = obj.tracker
+
+    if isinstance(obj, Tracker):
+        chain = get_tracker_chains([obj.pk])[obj.pk]
+        project_ids = obj.statuses.values_list('project', flat=True)
+    elif isinstance(obj, Task):
+        chain = []
+        if obj.parent_id is not None:
+            chain = get_tracker_chains([obj.parent_id])[obj.parent_id]
+        project_ids = obj.statuses.values_list('project', flat=True)
+    else:
+        return []
+
+    scopes = ['tracker:%d' % tracker.pk for tracker in chain]
+    for project_id in list(project_ids) + [None]:
+        for locale_id in set((obj.locale_id, None)):
+            scopes.append('tree:%s:%s' % (project_id or '', locale_id or ''))
+    return scopes
+
+class TreeCache(object):
+    """A cache of the rendered tracker trees.
+
+    See `todo.views.snippets.tree` for how it's used.  The trees are keyed by
+    their scope (a tracker or a project/locale pair), the views used to
+    create the links and the permissions of the user.
+
+    """
+    def get_key(self, request, tracker, project, locale, *options):
+        """Get the key of a tree.
+
+        Arguments:
+            request -- the current request object
+            tracker, project, locale -- the scope of the tree
+            options -- other arguments which change the markup of the tree,
+                       e.g. the names of the views used for the links
+
+        """
+        if tracker is not None:
+            scope = 'tracker:%d' % tracker.pk
+        else:
+            scope = 'tree:%s:%s' % (project.pk if project else '',
+                                    locale.pk if locale else '')
+        perms = [perm for perm in TREE_PERMS
+                 if request.user.has_perm(perm)]
+        key = '%s:%s:%s:%s' % (scope, get_generation(scope),
+                               ','.join(perms),
+                               ':'.join([unicode(o) for o in options]))
+        return 'todo:tree:%s' % md5_constructor(key.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        value = cache.get(key)
+        _incr_counter('tree_hits' if value is not None else 'tree_misses')
+        return value
+
+    def set(self, key, value):
+        cache.set(key, value, TREE_CACHE_TIMEOUT)
+
+    def invalidate(self, obj):
+        "Invalidate all trees which the todo object is displayed in."
+        for scope in _get_scopes(obj):
+            bump_generation(scope)
+
+    def stats(self):
+        return get_counters('tree_hits', 'tree_misses')
+
+tree_cache = TreeCache()
+
+class MatrixCache(object):
+    """A cache of the project/locale completion matrices.
+
+    All cached matrices are stored in one scope, which is invalidated when
+    the status of any task changes.
+
+    """
+    def get_key(self, projects, locales):
+        "Get the key of a matrix limited to the given project and locale IDs."
+        def _ids(ids):
+            if ids is None:
+                return 'all'
+            return ','.join([unicode(i) for i in ids])
+        key = '%s:%s:%s' % (get_generation('matrix'), _ids(projects),
+                            _ids(locales))
+        return ('todo:matrix:%s' %
+                md5_constructor(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        value = cache.get(key)
+        _incr_counter('matrix_hits' if value is not None else 'matrix_misses')
+        return value
+
+    def set(self, key, value):
+        cache.set(key, value, MATRIX_CACHE_TIMEOUT)
+
+    def invalidate(self):
+        bump_generation('matrix')
+
+    def stats(self):
+        return get_counters('matrix_hits', 'matrix_misses')
+
+matrix_cache = MatrixCache()
+
+class WizardStateStore(object):
+    """A store of the choices made in the steps of the create-new wizard.
+
+    The states are keyed by the security hashes of the steps submitted so
+    far, which uniquely identify the data the user has entered.
+
+    """
+    def get_key(self, user, hashes):
+        key = '%s:%s' % (user.pk, ':'.join(hashes))
+        return 'todo:wizard:%s' % md5_constructor(key).hexdigest()
+
+    def get(self, key):
+        return cache.get(key)
+
+    def set(self, key, state):
+        cache.set(key, state, WIZARD_STATE_TIMEOUT)
+
+wizard_states = WizardStateStore()
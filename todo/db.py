@@ -0,0 +1,160 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Mozilla todo app.
+#
+# The Initial Developer of the Original Code is
+# Mozilla Foundation.
+# Portions created by the Initial Developer are Copyright (C) 2010
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#   Stas Malolepszy <stas@mozilla.com>
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import AutoField
+from django.db.models.query import QuerySet
+
+# Tables with more rows than that (according to the statistics of the
+# database) aren't counted exactly by EstimatedCountQuerySet.
+ESTIMATED_COUNT_THRESHOLD = getattr(settings, 'TODO_ESTIMATED_COUNT_THRESHOLD',
+                                    100000)
+
+def chunked(seq, size):
+    "Split a list into consecutive lists of at most `size` elements."
+    for i in xrange(0, len(seq), size):
+        yield seq[i:i + size]
+
+def bulk_insert(model, objs, batch_size=500):
+    """Insert a list of unsaved model instances using as few queries as
+    possible.
+
+    On Django 1.4+ this is a simple wrapper around `bulk_create`.  Older
+    versions of Django don't have it, so a multi-row INSERT is executed
+    directly with `executemany`.  In both cases, no signals are sent and the
+    primary keys of the objects are not set after the insert.
+
+    Arguments:
+        model -- the model class of the objects
+        objs -- a list of unsaved instances of `model`
+        batch_size -- the maximum number of rows inserted in a single query
+
+    """
+    objs = list(objs)
+    if not objs:
+        return
+    if hasattr(model.objects, 'bulk_create'):
+        model.objects.bulk_create(objs, batch_size=batch_size)
+        return
+    qn = connection.ops.quote_name
+    fields = [f for f in model._meta.fields if not isinstance(f, AutoField)]
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        qn(model._meta.db_table),
+        ', '.join([qn(f.column) for f in fields]),
+        ', '.join(['%s'] * len(fields)))
+    cursor = connection.cursor()
+    for batch in chunked(objs, batch_size):
+        cursor.executemany(sql, [[f.get_db_prep_save(f.pre_save(obj, True))
+                                  for f in fields] for obj in batch])
+    transaction.commit_unless_managed()
+
+def bulk_update(model, objs, fields, batch_size=500):
+    """Save the values of the given fields of many model instances using as
+    few queries as possible.
+
+    A single UPDATE statement is executed for every instance, but all of them
+    are sent with `executemany`.  No signals are sent and `save` is not
+    called.
+
+    Arguments:
+        model -- the model class of the objects
+        objs -- a list of saved instances of `model`
+        fields -- a list of names of the fields to update
+        batch_size -- the maximum number of rows updated in a single call
+
+    """
+    objs = list(objs)
+    if not objs:
+        return
+    qn = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in fields]
+    pk = model._meta.pk
+    sql = 'UPDATE %s SET %s WHERE %s = %%s' % (
+        qn(model._meta.db_table),
+        ', '.join(['%s = %%s' % qn(f.column) for f in fields]),
+        qn(pk.column))
+    cursor = connection.cursor()
+    for batch in chunked(objs, batch_size):
+        cursor.executemany(sql, [[f.get_db_prep_save(f.pre_save(obj, False))
+                                  for f in fields] + [obj.pk]
+                                 for obj in batch])
+    transaction.commit_unless_managed()
+
+def estimate_count(model):
+    """Get the estimated number of rows in the table of a model.
+
+    The estimate is taken from the statistics kept by PostgreSQL and MySQL,
+    without scanning the table.  Returns None for other databases.
+
+    """
+    engine = (getattr(connection, 'settings_dict', {}).get('ENGINE') or
+              settings.DATABASE_ENGINE)
+    table = model._meta.db_table
+    cursor = connection.cursor()
+    if 'postgresql' in engine:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s',
+                       [table])
+    elif 'mysql' in engine:
+        cursor.execute('SELECT table_rows FROM information_schema.tables '
+                       'WHERE table_schema = DATABASE() AND table_name = %s',
+                       [table])
+    else:
+        return None
+    row = cursor.fetchone()
+    if row is None or row[0] is None:
+        return None
+    return int(row[0])
+
+class EstimatedCountQuerySet(QuerySet):
+    """A QuerySet which doesn't count all the rows of big tables.
+
+    If the QuerySet isn't filtered and the table has more than
+    ESTIMATED_COUNT_THRESHOLD rows, `count` returns the estimate from
+    `estimate_count` instead of running COUNT(*).  Filtered QuerySets are
+    counted exactly.
+
+    """
+    def count(self):
+        query = self.query
+        if (self._result_cache is None and not query.where and
+            not getattr(query, 'extra_where', None) and not query.distinct and
+            not query.low_mark and query.high_mark is None):
+            estimate = estimate_count(self.model)
+            if estimate is not None and estimate > ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super(EstimatedCountQuerySet, self).count()
@@ -40,26 +40,87 @@ from django.core.urlresolvers import reverse
 from django.contrib.auth.decorators import permission_required
 from django import forms
 from django.contrib.formtools.wizard import FormWizard
+from django.utils.html import escape
+from django.utils.http import urlencode
+from django.utils.safestring import mark_safe
 from django.db import transaction
+from django.conf import settings
+from django.utils.hashcompat import md5_constructor
 
 from life.models import Locale
 from todo.models import Project, ProtoTask, ProtoTracker, Tracker
+from todo.cache import wizard_states
+
+import cPickle as pickle
 
 class LocaleMultipleChoiceField(forms.ModelMultipleChoiceField):
     def label_from_instance(self, locale):
         return "%s / %s" % (locale.code, locale.name)
 
-class ProtoChoiceField(forms.ModelChoiceField):
+def proto_label(proto):
+    "Get the label of a prototype displayed in the wizard."
+    if proto.suffix:
+        return "%s (%s)" % (proto.summary, proto.suffix)
+    return proto.summary
+
+def tracker_label(tracker):
+    "Get the label of a tracker displayed in the wizard."
+    if tracker.is_generic():
+        return "Generic %d: %s" % (tracker.pk, tracker.summary)
+    return "%d: %s" % (tracker.pk, tracker.summary)
+
+class AutocompleteInput(forms.HiddenInput):
+    """A widget for choosing an object with an autocomplete search box.
+
+    The ID of the chosen object is stored in a hidden input.  The search box 
+    queries the URL given in `url` (see todo.views.api.autocomplete_trackers 
+    and autocomplete_prototypes) and is handled by the script in 
+    todo/new.html.
+
+    """
+    is_hidden = False
+
+    def __init__(self, url='', attrs=None):
+        super(AutocompleteInput, self).__init__(attrs)
+        self.url = url
+
+    def get_label(self, value):
+        # `choices` is set by ModelChoiceField; it's never iterated here
+        field = self.choices.field
+        try:
+            return field.label_from_instance(field.queryset.get(pk=value))
+        except (ValueError, field.queryset.model.DoesNotExist):
+            return ''
+
+    def render(self, name, value, attrs=None):
+        hidden = super(AutocompleteInput, self).render(name, value, attrs)
+        label = self.get_label(value) if value else ''
+        return mark_safe(u'%s<input type="text" class="autocomplete" '
+                         u'data-url="%s" data-input="%s" value="%s" />' % (
+                         hidden, escape(self.url), escape(name), 
+                         escape(label)))
+
+class AutocompleteChoiceField(forms.ModelChoiceField):
+    """A ModelChoiceField rendered as an autocomplete search box.
+
+    Unlike a <select>, the widget doesn't list all the objects in the 
+    queryset; the chosen ID is validated with a single lookup in it.
+
+    """
+    widget = AutocompleteInput
+
+    def __init__(self, queryset, url='', *args, **kwargs):
+        super(AutocompleteChoiceField, self).__init__(queryset, *args, 
+                                                      **kwargs)
+        self.widget.url = url
+
+class ProtoChoiceField(AutocompleteChoiceField):
     def label_from_instance(self, proto):
-        if proto.suffix:
-            return "%s (%s)" % (proto.summary, proto.suffix)
-        return proto.summary
+        return proto_label(proto)
 
-class TrackerChoiceField(forms.ModelChoiceField):
+class TrackerChoiceField(AutocompleteChoiceField):
     def label_from_instance(self, tracker):
-        if tracker.is_generic():
-            return "Generic %d: %s" % (tracker.pk, tracker.summary)
-        return "%d: %s" % (tracker.pk, tracker.summary)
+        return tracker_label(tracker)
 
 class ChooseProjectFactory(object):
     """Factory class returning ChooseProjectForm instances.
@@ -125,6 +186,14 @@ class ChoosePrototypeForm(forms.Form):
                             help_text="Leave empty to use the prototype's "
                             "alias.")
 
+    def __init__(self, *args, **kwargs):
+        super(ChoosePrototypeForm, self).__init__(*args, **kwargs)
+        url = reverse('todo.views.api.autocomplete_prototypes')
+        for name, type in (('tracker_proto', 'tracker'), 
+                           ('task_proto', 'task')):
+            self.fields[name].widget.url = '%s?%s' % (url, 
+                                                      urlencode({'type': type}))
+
     def clean(self):
         clean = self.cleaned_data
         if ((clean['tracker_proto'] and clean['task_proto']) or
@@ -161,33 +230,19 @@ class ChooseParentForm(forms.Form):
 
         """
         super(ChooseParentForm, self).__init__(*args, **kwargs)
-        trackers = Tracker.objects.select_related('locale')
-        # always show the generic trackers, no matter what; `statuses=None` is 
-        # like `projects=None` but avoids an unnecessary JOIN
-        possible_parents = trackers.filter(locale=None, statuses=None)
-        # make sure they're displayed on top of the list (`statuses` will be 
-        # None for them)
-        possible_parents = possible_parents.order_by('statuses', 'pk')
+        # If the form is embedded in another application, the projects are 
+        # not instances of `todo.models.Project` and instead point to 
+        # instances of that other application's equivalent of a project.
+        projects = [getattr(p, 'todo', None) or p for p in projects]
+        query = [('project', p.pk) for p in projects]
         if len(locales) == 1:
-            # if there's only one locale selected, we also want to show regular 
-            # trackers related to this locale and to the exactly same set of 
-            # projects
-            (locale,) = locales
-            specific = trackers.filter(locale=locale)
-            for p in projects:
-                # If the form is embedded in another application, `p` is not an 
-                # instance of `todo.models.Project` and instead points to an 
-                # instance of that other application's equivalent of a project.
-                project = getattr(p, 'todo', None) or p
-                # Every project narrows down the list of possible parents; the 
-                # objective is to end with a list of trackers that are related 
-                # to all selected projects (IN would match any, not all).
-                specific = specific.filter(projects=project)
-            # concatenate generic and specific trackers into a single QuerySet
-            possible_parents = possible_parents | specific
+            query.append(('locale', locales[0].code))
+        url = '%s?%s' % (reverse('todo.views.api.autocomplete_trackers'),
+                         urlencode(query))
         parent = TrackerChoiceField(label='Existing parent tracker',
-                                    queryset=possible_parents,
-                                    required=False)
+                                    queryset=get_possible_parents(projects,
+                                                                  locales),
+                                    url=url, required=False)
         self.fields['parent_tracker'] = parent
 
     def clean(self):
@@ -197,6 +252,29 @@ class ChooseParentForm(forms.Form):
                                         'tracker or create a new one.')
         return clean
 
+def get_possible_parents(projects, locales):
+    """Get a QuerySet of trackers which can be parents of new todo objects 
+    related to the given projects and locales.  See ChooseParentForm.
+
+    """
+    trackers = Tracker.objects.select_related('locale')
+    # always show the generic trackers, no matter what; they aren't related 
+    # to any projects
+    possible_parents = trackers.filter(locale=None, statuses=None)
+    if len(locales) == 1:
+        # if there's only one locale selected, we also want to show regular 
+        # trackers related to this locale and to all selected projects
+        (locale,) = locales
+        # The project signatures are matched instead of JOINing the 
+        # projects once per project (IN would match any, not all).
+        specific = (Tracker.objects.for_projects(projects, exact=False)
+                                   .filter(locale=locale))
+        # concatenate generic and specific trackers into a single QuerySet
+        possible_parents = possible_parents | specific
+    # make sure the generic trackers are displayed on top of the list 
+    possible_parents = possible_parents.order_by('project_signature', 'pk')
+    return possible_parents
+
 class ChooseParentFactory(object):
     """Factory class returning ChooseParentForm instances.
 
@@ -234,6 +312,9 @@ class CreateNewWizard(FormWizard):
             ChoosePrototypeForm,
         ]
         super(CreateNewWizard, self).__init__(formlist)
+        # the cleaned data of the steps, either taken from the forms or 
+        # restored from the state store (see `process_step`)
+        self.cleaned = {}
         # save the rest of the config
         self.locale_filter = config.get('locale_filter', None)
         self.get_template = config.get('get_template', self.get_template)
@@ -259,6 +340,29 @@ class CreateNewWizard(FormWizard):
         """
         return 'todo/new_%d.html' % step
 
+    def security_hash(self, request, form):
+        """Calculate the security hash of a step's form.
+
+        Unlike the default implementation, the hash is calculated from the 
+        submitted data rather than from the cleaned values, so that checking 
+        the hashes of the previous steps doesn't validate their forms (and 
+        query the database) again.  The submitted data can't be tampered with 
+        all the same.
+
+        """
+        data = [(bf.name, bf.data or '') for bf in form]
+        data.append(settings.SECRET_KEY)
+        pickled = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+        return md5_constructor(pickled).hexdigest()
+
+    def get_state_key(self, request, form, step):
+        "Get the key of the state after the given step in the state store."
+        hashes = [request.POST.get('hash_%d' % i, '') for i in range(step)]
+        # the hash of the current step is not in the POST data yet
+        hashes.append(request.POST.get('hash_%d' % step) or
+                      self.security_hash(request, form))
+        return wizard_states.get_key(request.user, hashes)
+
     def process_step(self, request, form, step):
         """Process the previous or the current step.
 
@@ -269,6 +373,11 @@ class CreateNewWizard(FormWizard):
         possible to dynamically modify the FormWizard's state here, depending 
         on the choices made in previous steps.
 
+        The choices resolved in each step are stored in a server-side state 
+        store (see todo.cache.WizardStateStore), so that when the step is 
+        processed again as one of the previous steps, they are restored from 
+        there instead of validating the form and recomputing them.
+
         Arguments:
             request -- the current request object,
             form -- the form object to process,
@@ -276,11 +385,22 @@ class CreateNewWizard(FormWizard):
                     form_list.
 
         """
-        clean = {}
-        if form.is_valid():
-            clean = form.cleaned_data
-
-        if clean and step == 0:
+        if step > 2:
+            # the last step is only processed once, as the current step
+            return
+        key = self.get_state_key(request, form, step)
+        state = wizard_states.get(key)
+        if state is not None and self.restore_step(step, state):
+            return
+        if not form.is_valid():
+            return
+        wizard_states.set(key, self.resolve_step(step, form.cleaned_data))
+
+    def resolve_step(self, step, clean):
+        """Process the cleaned data of a step and return the resolved choices 
+        to be stored in the state store."""
+        self.cleaned[step] = clean
+        if step == 0:
             self.projects = clean['projects']
             # see what locales are available for those projects and set up the 
             # next step accordingly
@@ -291,8 +411,12 @@ class CreateNewWizard(FormWizard):
                 for p in self.projects:
                     # the QuerySets are AND-ed
                     locales = locales & self.locale_filter(p)
-            self.form_list[1] = ChooseLocaleFactory(locales)
-        if clean and step == 1:
+            locale_ids = list(locales.values_list('pk', flat=True))
+            self.form_list[1] = ChooseLocaleFactory(
+                self.default_locales.filter(pk__in=locale_ids))
+            return {'project_ids': [p.pk for p in self.projects],
+                    'locale_ids': locale_ids}
+        if step == 1:
             self.locales = clean['locales']
             # with projects and locales already chosen before, see which 
             # trackers could be potential parents for the whole batch
@@ -302,7 +426,8 @@ class CreateNewWizard(FormWizard):
                 'locale_code': (self.locales[0].code if len(self.locales) == 1
                                 else 'ab-CD'),
             })
-        if clean and step == 2:
+            return {'locale_ids': [l.pk for l in self.locales]}
+        if step == 2:
             # the data gathering is almost complete.  let the user see how the 
             # final outcome will look like based on the previous choices.
             parent_tracker = clean['parent_tracker']
@@ -313,6 +438,54 @@ class CreateNewWizard(FormWizard):
                 'parent_locale': (parent_tracker.locale if parent_tracker 
                                   else None),
             })
+            return {'parent_tracker_id': (parent_tracker.pk if parent_tracker
+                                          else None),
+                    'parent_summary': clean['parent_summary'],
+                    'parent_alias': parent_alias}
+
+    def restore_step(self, step, state):
+        """Restore the choices of a step from the state store.
+
+        Returns False if the state refers to objects which don't exist anymore,
+        in which case the step should be resolved from the form again.
+
+        """
+        if step == 0:
+            projects = self.form_list[0].projects
+            self.projects = list(projects.filter(pk__in=state['project_ids']))
+            self.form_list[1] = ChooseLocaleFactory(
+                self.default_locales.filter(pk__in=state['locale_ids']))
+            self.cleaned[0] = {'projects': self.projects}
+        elif step == 1:
+            self.locales = list(self.default_locales.filter(
+                pk__in=state['locale_ids']))
+            self.form_list[2] = ChooseParentFactory(self.projects,
+                                                    self.locales)
+            self.extra_context.update({
+                'locale_code': (self.locales[0].code if len(self.locales) == 1
+                                else 'ab-CD'),
+            })
+            self.cleaned[1] = {'locales': self.locales}
+        elif step == 2:
+            parent_tracker = None
+            if state['parent_tracker_id'] is not None:
+                trackers = Tracker.objects.select_related('locale')
+                try:
+                    parent_tracker = trackers.get(
+                        pk=state['parent_tracker_id'])
+                except Tracker.DoesNotExist:
+                    # the tracker has been deleted since the step was resolved
+                    return False
+            self.extra_context.update({
+                'parent_alias': (parent_tracker.alias if parent_tracker
+                                 else state['parent_alias']),
+                'parent_locale': (parent_tracker.locale if parent_tracker 
+                                  else None),
+            })
+            self.cleaned[2] = {'parent_tracker': parent_tracker,
+                               'parent_summary': state['parent_summary'],
+                               'parent_alias': state['parent_alias']}
+        return True
 
     def get_redirect_url(self, spawned_items, type_is_tracker, parent):
         """Return the URL to redirect to after a successful POST.
@@ -349,10 +522,13 @@ class CreateNewWizard(FormWizard):
     @permission_required('todo.create_task')
     @transaction.commit_on_success
     def done(self, request, form_list):
+        # the data of the previous steps has been processed already in 
+        # `process_step`; only the last form needs to be validated
         clean = {}
-        for form in form_list:
-            if form.is_valid():
-                clean.update(form.cleaned_data)
+        for step in sorted(self.cleaned):
+            clean.update(self.cleaned[step])
+        if form_list[-1].is_valid():
+            clean.update(form_list[-1].cleaned_data)
         parent = clean.pop('parent_tracker')
         if parent is None and clean['parent_summary']:
             # user wants to create a new generic tracker which will be the
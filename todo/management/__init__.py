@@ -0,0 +1,74 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Mozilla todo app.
+#
+# The Initial Developer of the Original Code is
+# Mozilla Foundation.
+# Portions created by the Initial Developer are Copyright (C) 2010
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#   Stas Malolepszy <stas@mozilla.com>
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+from django.db import transaction, DatabaseError
+from django.db.models.signals import post_syncdb
+
+import todo.models
+
+def backfill_project_signatures(sender, verbosity=1, **kwargs):
+    """Compute the project signatures of the trackers which are related to
+    projects but don't have a signature yet.
+
+    This happens when an existing database is upgraded: the signature columns
+    are added empty (see README.rst).  The signatures are filled in on the
+    next syncdb, so that `Tracker.objects.for_projects` finds these trackers
+    without having to run `refreshtodosignatures` by hand.
+
+    """
+    from todo.db import chunked
+    from todo.models import Tracker, update_project_signatures
+
+    unsigned = (Tracker.objects.filter(project_digest='')
+                               .exclude(statuses=None))
+    try:
+        tracker_ids = list(unsigned.values_list('pk', flat=True).distinct())
+    except DatabaseError:
+        # the columns haven't been added yet
+        transaction.rollback_unless_managed()
+        if verbosity >= 1:
+            print ('The project signature columns of todo trackers are '
+                   'missing; see README.rst.')
+        return
+    updated = 0
+    for batch in chunked(tracker_ids, 500):
+        updated += update_project_signatures(batch)
+    transaction.commit_unless_managed()
+    if updated and verbosity >= 1:
+        print 'Computed the project signatures of %d trackers.' % updated
+
+post_syncdb.connect(backfill_project_signatures, sender=todo.models)
@@ -0,0 +1,111 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Mozilla todo app.
+#
+# The Initial Developer of the Original Code is
+# Mozilla Foundation.
+# Portions created by the Initial Developer are Copyright (C) 2010
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#   Stas Malolepszy <stas@mozilla.com>
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+from django.core.management.base import BaseCommand, CommandError
+
+from optparse import make_option
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+class Command(BaseCommand):
+    args = '[BENCHMARK...]'
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '-r',
+            '--repeat',
+            action='store',
+            type='int',
+            dest='repeat',
+            default=5,
+            help="The number of runs of every benchmark. The default is 5."
+        ),
+        make_option(
+            '-o',
+            '--output',
+            action='store',
+            type='string',
+            dest='output',
+            help="The file to write the results to, as JSON."
+        ),
+        make_option(
+            '-b',
+            '--baseline',
+            action='store',
+            type='string',
+            dest='baseline',
+            help="A file with the results of a previous run to compare with."
+        ),
+    )
+
+    help = 'Times the hot paths of todo and counts their queries on the ' \
+           'data created by generatetododata.  Runs all benchmarks unless ' \
+           'BENCHMARKs are given.'
+
+    def handle(self, *names, **options):
+        from todo.benchmark import BENCHMARKS, run_benchmarks, compare
+
+        known = [name for name, func in BENCHMARKS]
+        for name in names:
+            if name not in known:
+                raise CommandError('Unknown benchmark: %s. Choose from: %s.' 
+                                   % (name, ', '.join(known)))
+        repeat = options.get('repeat')
+        if repeat < 1:
+            raise CommandError('--repeat must be a positive integer.')
+
+        results = run_benchmarks(names, repeat)
+        for name in known:
+            if name in results:
+                print '%-20s %5d queries %10.2f ms (median) %10.2f ms (min)' % (
+                    name, results[name]['queries'], 
+                    results[name]['median_ms'], results[name]['min_ms'])
+
+        if options.get('baseline'):
+            baseline = json.load(open(options['baseline']))
+            print '\nCompared with %s:' % options['baseline']
+            for name, before, after, ratio in compare(results, baseline):
+                print '%-20s %5d -> %5d queries %8s time' % (
+                    name, before, after, 
+                    '%.2fx' % ratio if ratio is not None else '-')
+
+        if options.get('output'):
+            output = open(options['output'], 'w')
+            json.dump(results, output, indent=2, sort_keys=True)
+            output.close()
+            print 'Results written to %s.' % options['output']
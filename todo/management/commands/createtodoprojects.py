@@ -37,6 +37,7 @@
 
 from django.core.management.base import BaseCommand, CommandError
 from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
 
 import sys
 from optparse import make_option
@@ -59,6 +60,25 @@ class Command(BaseCommand):
                  "'unicode(project)'. The label will be truncated to first 50 "
                  "characters."
         ),
+        make_option(
+            '--bulk',
+            action='store_true',
+            dest='bulk',
+            default=False,
+            help="Create the missing todoprojects and set up the foreign keys "
+                 "with batched queries instead of one by one. Useful for "
+                 "models with many instances."
+        ),
+        make_option(
+            '-b',
+            '--batch-size',
+            action='store',
+            type='int',
+            dest='batch_size',
+            default=500,
+            help="The number of rows inserted or updated at once in the bulk "
+                 "mode. The default is 500."
+        ),
     )
 
     help = 'Creates todo.Project objects for each instance of MODEL which ' \
@@ -70,6 +90,9 @@ class Command(BaseCommand):
         from todo.models import Project as TodoProject
 
         label_stmt = options.get('label_stmt', None)
+        batch_size = options.get('batch_size')
+        if batch_size < 1:
+            raise CommandError('The batch size must be a positive integer.')
 
         if not model_paths:
             raise CommandError('Specify at least one model for which to '
@@ -86,6 +109,10 @@ class Command(BaseCommand):
                 raise CommandError("Unknown model: %s.%s"
                                    % (app_label, model_label))
 
+            if options.get('bulk'):
+                self.handle_bulk(model, label_stmt, batch_size)
+                continue
+
             for project in model.objects.all():
                 label = eval(label_stmt) if label_stmt else unicode(project)
                 if not isinstance(label, basestring):
@@ -106,3 +133,56 @@ class Command(BaseCommand):
                 project.todo = todo
                 project.save()
                 print 'done.\n'
+
+    @transaction.commit_on_success
+    def handle_bulk(self, model, label_stmt, batch_size):
+        """Set up the todoprojects for all instances of the model at once.
+
+        The label statement is compiled and the ContentType is looked up 
+        once.  The existing todoprojects are retrieved with one query, the 
+        missing ones are created with batched INSERTs (and their IDs read 
+        back in batches) and the foreign keys which need to change are set 
+        with batched UPDATEs.
+
+        """
+        from django.contrib.contenttypes.models import ContentType
+        from todo.db import bulk_insert, bulk_update, chunked
+        from todo.models import Project as TodoProject
+
+        code = compile(label_stmt, '<label>', 'eval') if label_stmt else None
+        model_ct_id = ContentType.objects.get_for_model(model).pk
+        todoprojects = TodoProject.objects.filter(model_ct_id=model_ct_id)
+        todo_ids = dict(todoprojects.values_list('label', 'pk'))
+
+        labels = []
+        projects = list(model.objects.all())
+        for project in projects:
+            label = (eval(code, globals(), {'project': project}) if code
+                     else unicode(project))
+            if not isinstance(label, basestring):
+                raise CommandError('The label statement must evaluate to '
+                                   'a string.')
+            labels.append(label[:50])
+
+        missing = sorted(set(label for label in labels 
+                             if label not in todo_ids))
+        bulk_insert(TodoProject, [TodoProject(label=label, 
+                                              model_ct_id=model_ct_id)
+                                  for label in missing], batch_size)
+        # bulk_insert doesn't set the primary keys; read them in batches to 
+        # stay below the limit of query parameters of the database
+        for batch in chunked(missing, batch_size):
+            todo_ids.update(todoprojects.filter(label__in=batch)
+                                        .values_list('label', 'pk'))
+        print 'Created %d todoprojects for %s.' % (len(missing),
+                                                   model._meta.object_name)
+
+        to_link = []
+        for project, label in zip(projects, labels):
+            if project.todo_id != todo_ids[label]:
+                project.todo_id = todo_ids[label]
+                to_link.append(project)
+        bulk_update(model, to_link, ['todo'], batch_size)
+        print 'Linked %d %s objects (%d already linked).' % (
+            len(to_link), model._meta.object_name,
+            len(projects) - len(to_link))
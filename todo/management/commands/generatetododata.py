@@ -0,0 +1,92 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Mozilla todo app.
+#
+# The Initial Developer of the Original Code is
+# Mozilla Foundation.
+# Portions created by the Initial Developer are Copyright (C) 2010
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#   Stas Malolepszy <stas@mozilla.com>
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+from django.core.management.base import BaseCommand, CommandError
+
+from optparse import make_option
+
+def _option(name, default, help):
+    return make_option('--%s' % name, action='store', type='int', 
+                       dest=name.replace('-', '_'), default=default,
+                       help='%s The default is %d.' % (help, default))
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        _option('locales', 10, 'The number of locales.'),
+        _option('projects', 5, 'The number of projects.'),
+        _option('depth', 2, 'The number of levels of trackers in the '
+                            'prototype graph.'),
+        _option('fanout', 3, 'The number of children of every prototype '
+                             'tracker.'),
+        _option('steps', 3, 'The number of steps of every prototype task.'),
+        _option('trees', 2, 'The number of trees spawned per locale.'),
+        make_option(
+            '--resolved',
+            action='store',
+            type='float',
+            dest='resolved',
+            default=0.5,
+            help="The ratio of the spawned tasks to resolve. The default is "
+                 "0.5."
+        ),
+        _option('seed', 0, 'The seed of the random choices.'),
+    )
+
+    help = 'Generates synthetic todo data for benchmarking (see ' \
+           'benchmarktodo).  Use a test database.'
+
+    def handle(self, *args, **options):
+        from todo.benchmark import generate_data
+
+        for name in ('locales', 'projects', 'depth', 'fanout', 'steps', 
+                     'trees'):
+            if options.get(name) < 1:
+                raise CommandError('--%s must be a positive integer.' % name)
+        if not 0 <= options.get('resolved') <= 1:
+            raise CommandError('--resolved must be between 0 and 1.')
+
+        counts = generate_data(locales=options.get('locales'),
+                               projects=options.get('projects'),
+                               depth=options.get('depth'),
+                               fanout=options.get('fanout'),
+                               steps=options.get('steps'),
+                               trees=options.get('trees'),
+                               resolved=options.get('resolved'),
+                               seed=options.get('seed'),
+                               verbose=True)
+        print 'Spawned %(trees)d trees with %(tasks)d tasks.' % counts
+        print 'done.'
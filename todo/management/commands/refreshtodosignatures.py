@@ -0,0 +1,72 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Mozilla todo app.
+#
+# The Initial Developer of the Original Code is
+# Mozilla Foundation.
+# Portions created by the Initial Developer are Copyright (C) 2010
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#   Stas Malolepszy <stas@mozilla.com>
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from optparse import make_option
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '-b',
+            '--batch-size',
+            action='store',
+            type='int',
+            dest='batch_size',
+            default=500,
+            help="The number of trackers to refresh at once. The default "
+                 "is 500."
+        ),
+    )
+
+    help = 'Recomputes the project signatures stored on all trackers.'
+
+    @transaction.commit_on_success
+    def handle(self, *args, **options):
+        from todo.models import Tracker, update_project_signatures
+
+        batch_size = options.get('batch_size')
+        if batch_size < 1:
+            raise CommandError('The batch size must be a positive integer.')
+
+        tracker_ids = list(Tracker.objects.values_list('pk', flat=True))
+        updated = 0
+        for i in range(0, len(tracker_ids), batch_size):
+            updated += update_project_signatures(tracker_ids[i:i + batch_size])
+        print 'Refreshed the project signatures of %d trackers.' % updated
+        print 'done.'
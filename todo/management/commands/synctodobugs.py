@@ -0,0 +1,175 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Mozilla todo app.
+#
+# The Initial Developer of the Original Code is
+# Mozilla Foundation.
+# Portions created by the Initial Developer are Copyright (C) 2010
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#   Stas Malolepszy <stas@mozilla.com>
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from optparse import make_option
+from datetime import datetime
+import Queue
+import threading
+
+from todo.db import chunked, bulk_insert
+from todo.workflow import NEW, ACTIVE, NEXT
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '-b',
+            '--batch-size',
+            action='store',
+            type='int',
+            dest='batch_size',
+            default=500,
+            help="The number of tasks to sync at once. The default is 500."
+        ),
+        make_option(
+            '-t',
+            '--threads',
+            action='store',
+            type='int',
+            dest='threads',
+            default=4,
+            help="The maximum number of concurrent requests to Bugzilla. "
+                 "The default is 4."
+        ),
+        make_option(
+            '-u',
+            '--url',
+            action='store',
+            dest='url',
+            default=None,
+            help="The base URL of BzAPI. The default is the value of the "
+                 "TODO_BZAPI_URL setting."
+        ),
+    )
+
+    help = 'Stores the times of the last changes of the bugs of open tasks ' \
+           'in the local bug metadata table.'
+
+    def handle(self, *args, **options):
+        from todo.models import Task
+
+        batch_size = options.get('batch_size')
+        threads = options.get('threads')
+        if batch_size < 1 or threads < 1:
+            raise CommandError('The batch size and the number of threads '
+                               'must be positive integers.')
+
+        last_id = 0
+        synced = 0
+        tasks = (Task.objects.filter(statuses__status__in=(NEW, ACTIVE, NEXT))
+                             .distinct().order_by('pk'))
+        while True:
+            rows = list(tasks.filter(pk__gt=last_id)
+                             .values_list('pk', 'bugid', 'alias')[:batch_size])
+            if not rows:
+                break
+            bugids = set(unicode(bugid or alias)
+                         for pk, bugid, alias in rows if bugid or alias)
+            bugs = self.fetch(bugids, options.get('url'), threads)
+            self.store(bugs)
+            last_id = rows[-1][0]
+            synced += len(bugs)
+            print 'Synced %d bugs.' % synced
+        print 'done.'
+
+    def fetch(self, bugids, url, threads):
+        """Fetch the bugs in batches, using at most `threads` concurrent
+        connections."""
+        from todo.bugzilla import BzAPI, BATCH_SIZE
+
+        batches = Queue.Queue()
+        for batch in chunked(sorted(bugids), BATCH_SIZE):
+            batches.put(batch)
+        bugs = []
+        errors = []
+
+        def work():
+            # every thread has its own client, as connections can't be shared
+            client = BzAPI(url)
+            try:
+                while True:
+                    try:
+                        batch = batches.get_nowait()
+                    except Queue.Empty:
+                        return
+                    try:
+                        bugs.extend(client.fetch_bugs(batch))
+                    except Exception, e:
+                        errors.append((batch, e))
+            finally:
+                client.close()
+
+        workers = [threading.Thread(target=work)
+                   for i in xrange(min(threads, batches.qsize()))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        for batch, e in errors:
+            print 'Failed to fetch bugs %s: %s' % (', '.join(batch), e)
+        return bugs
+
+    @transaction.commit_on_success
+    def store(self, bugs):
+        "Create or update the BugMetadata objects of the fetched bugs."
+        from todo.models import BugMetadata
+
+        now = datetime.now()
+        bugs = dict((bug['id'], bug) for bug in bugs if 'id' in bug)
+        existing = dict((meta.bugid, meta) for meta in
+                        BugMetadata.objects.filter(bugid__in=bugs.keys()))
+        unchanged = []
+        new = []
+        for bugid, bug in bugs.iteritems():
+            meta = existing.get(bugid)
+            if meta is None:
+                new.append(BugMetadata(bugid=bugid, alias=bug.get('alias'),
+                                       last_change_ts=bug['last_change_time'],
+                                       synced_ts=now))
+            elif (meta.last_change_ts != bug['last_change_time'] or
+                  meta.alias != bug.get('alias')):
+                BugMetadata.objects.filter(pk=meta.pk).update(
+                    alias=bug.get('alias'),
+                    last_change_ts=bug['last_change_time'],
+                    synced_ts=now)
+            else:
+                unchanged.append(meta.pk)
+        for pks in chunked(unchanged, 500):
+            BugMetadata.objects.filter(pk__in=pks).update(synced_ts=now)
+        bulk_insert(BugMetadata, new)
@@ -35,21 +35,35 @@
 #
 # ***** END LICENSE BLOCK *****
 
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models.signals import pre_delete, post_delete, post_save
 try:
     from django.dispatch import receiver
 except ImportError:
     from todo.signals import receiver
 
 from todo.workflow import RESOLVED
-from todo.signals import status_changed, todo_updated
+from todo.signals import (status_changed, todo_updated, todo_spawned,
+                          todos_updated)
+from todo.cache import (tree_cache, TREE_CACHE_TIMEOUT, matrix_cache,
+                        MATRIX_CACHE_TIMEOUT)
 
-from .action import Action
+from .action import Action, CREATED, NEXTED
+from .base import bump_versions
 from .project import Project
 from .actor import Actor
 from .proto import *
-from .tracker import Tracker, TrackerInProject
+from .tracker import (Tracker, TrackerInProject, get_tracker_chains,
+                      update_project_signatures)
 from .task import Task, TaskInProject
 from .step import Step
+from .facet import TaskFacet
+from .counter import TaskCounter
+from .bug import BugMetadata
+from .reprs import (refresh_actor_reprs, refresh_prototype_reprs,
+                    refresh_locale_reprs, refresh_project_reprs)
+
+from life.models import Locale
 
 @receiver(todo_updated)
 @receiver(status_changed)
@@ -74,3 +88,272 @@ def log_status_change(sender, user, flag, **kwargs):
         # step.
         sender.task.update(user, {'latest_resolution_ts': action.timestamp},
                            send_signal=False)
+
+@receiver(todo_spawned)
+@receiver(todo_updated)
+@receiver(status_changed)
+def update_facet_index(sender, signal, **kwargs):
+    """Keep the facet index of the affected tasks up-to-date.
+
+    Todo objects created while spawning a tree are not indexed one by one;
+    instead, the whole tree is indexed once the `todo_spawned` signal is sent
+    for its top-most object.
+
+    """
+    if signal is status_changed and kwargs.get('flag') == CREATED:
+        return
+    if isinstance(sender, Tracker):
+        if signal is not status_changed:
+            # the tracker's summary is one of the facets of the tasks under it
+            TaskFacet.objects.reindex_tracker(sender)
+    elif isinstance(sender, Task):
+        TaskFacet.objects.reindex([sender])
+    elif isinstance(sender, (Step, TaskInProject)):
+        TaskFacet.objects.reindex([sender.task])
+
+def _bump_todo_versions(todo, old_parent_id=None, deleted=False):
+    """Bump the versions of the task or tracker which displays the todo
+    object and of all the trackers above it (and above its old parent, if it
+    has been moved).
+
+    """
+    if isinstance(todo, (TaskInProject, Step)):
+        todo = todo.task
+    elif isinstance(todo, TrackerInProject):
+        todo = todo.tracker
+    parent_ids = set([old_parent_id])
+    if isinstance(todo, Task):
+        bump_versions(Task, [todo.pk])
+        parent_ids.add(todo.parent_id)
+    elif isinstance(todo, Tracker):
+        # a deleted tracker isn't displayed anymore; its parent is
+        parent_ids.add(todo.parent_id if deleted else todo.pk)
+    parent_ids.discard(None)
+    if parent_ids:
+        chains = get_tracker_chains(parent_ids)
+        bump_versions(Tracker, set(tracker.pk
+                                   for chain in chains.itervalues()
+                                   for tracker in chain))
+
+def _is_spawned(instance):
+    """Check if the object is being created as part of a spawned tree (see
+    Proto._spawn_instance), or is a status of such an object."""
+    return any(getattr(obj, '_spawned', False)
+               for obj in (instance,
+                           getattr(instance, '_task_cache', None),
+                           getattr(instance, '_tracker_cache', None)))
+
+@receiver(todo_spawned)
+@receiver(status_changed)
+def bump_todo_versions(sender, signal, **kwargs):
+    """Bump the versions when a tree of todo objects has been spawned or when
+    a step has been `nexted` again.
+
+    Todo objects created while spawning a tree are not handled one by one in
+    `bump_saved_todo_versions` below; like in `update_facet_index` above, the
+    whole tree is handled once it has been created.  Resetting the time of
+    a step doesn't save anything, but it changes when the step is overdue.
+
+    """
+    if signal is status_changed and kwargs.get('flag') != NEXTED:
+        # the changed object has been saved and handled below
+        return
+    _bump_todo_versions(sender)
+
+@receiver(post_save, sender=Task)
+@receiver(post_save, sender=Tracker)
+@receiver(post_save, sender=Step)
+@receiver(post_save, sender=TaskInProject)
+@receiver(post_save, sender=TrackerInProject)
+@receiver(post_delete, sender=Task)
+@receiver(post_delete, sender=Tracker)
+@receiver(post_delete, sender=Step)
+@receiver(post_delete, sender=TaskInProject)
+@receiver(post_delete, sender=TrackerInProject)
+def bump_saved_todo_versions(sender, instance, signal, **kwargs):
+    """Bump the versions of the task or tracker which displays the saved or
+    deleted todo object, no matter where the change comes from (e.g. the
+    admin).
+
+    Saves which don't write any changed fields (see DirtyFieldsMixin) don't
+    bump anything.
+
+    """
+    if _is_spawned(instance):
+        return
+    old_parent_id = None
+    if signal is post_save and not kwargs.get('created'):
+        # the saved values are recorded again after the signal is sent
+        if not instance.get_dirty_fields():
+            return
+        old_parent_id = getattr(instance, '_saved_values', {}).get(
+            'parent_id')
+    if not isinstance(instance, (Task, Tracker)):
+        old_parent_id = None
+    try:
+        _bump_todo_versions(instance, old_parent_id,
+                            deleted=signal is post_delete)
+    except ObjectDoesNotExist:
+        # the task or tracker of the object has been deleted as well
+        pass
+
+@receiver(todo_spawned)
+@receiver(todo_updated)
+@receiver(status_changed)
+def invalidate_tree_cache(sender, signal, **kwargs):
+    """Invalidate the cached trees which display the changed todo object.
+
+    Like in `update_facet_index` above, spawned todo objects are handled once
+    the whole tree has been created.
+
+    """
+    if not TREE_CACHE_TIMEOUT:
+        return
+    if signal is status_changed and kwargs.get('flag') == CREATED:
+        return
+    tree_cache.invalidate(sender)
+
+@receiver(todo_spawned)
+@receiver(status_changed)
+def invalidate_matrix_cache(sender, signal, **kwargs):
+    "Invalidate the cached completion matrices when the task counts change."
+    if not MATRIX_CACHE_TIMEOUT:
+        return
+    if signal is status_changed and kwargs.get('flag') == CREATED:
+        return
+    matrix_cache.invalidate()
+
+@receiver(todos_updated)
+def handle_bulk_update(sender, user, todos, flag, **kwargs):
+    """Do what the receivers of `todo_updated` above do, for many todo
+    objects at once.
+
+    The actions are logged and the versions are bumped with a fixed number of
+    queries; the facet index is updated in one go for all tasks.
+
+    """
+    Action.objects.log_many(user, todos, flag)
+    if sender is Task:
+        TaskFacet.objects.reindex(todos)
+        bump_versions(Task, [task.pk for task in todos])
+        parent_ids = set(task.parent_id for task in todos
+                         if task.parent_id is not None)
+    else:
+        for tracker in todos:
+            TaskFacet.objects.reindex_tracker(tracker)
+        parent_ids = set(tracker.pk for tracker in todos)
+    chains = get_tracker_chains(parent_ids)
+    bump_versions(Tracker, set(tracker.pk for chain in chains.itervalues()
+                               for tracker in chain))
+    if TREE_CACHE_TIMEOUT:
+        for todo in todos:
+            tree_cache.invalidate(todo)
+
+def _get_locale_ids(task_id, task=None):
+    """Get a list with the ID of the locale of the task, querying for it if
+    the task is not given.  The list is empty if the task doesn't exist.
+
+    """
+    if task is not None and task.pk == task_id:
+        return [task.locale_id]
+    return Task.objects.filter(pk=task_id).values_list('locale', flat=True)
+
+@receiver(post_save, sender=TaskInProject)
+@receiver(pre_delete, sender=TaskInProject)
+def update_task_counters(sender, instance, signal, **kwargs):
+    """Update the task counters when a task is assigned to a project, changes
+    its status or is removed from the project.
+
+    The old values of a changed status are the ones recorded by
+    DirtyFieldsMixin when it was last loaded or saved.
+
+    """
+    # the task might be being deleted as well; only rely on the instance's
+    # task if it has already been retrieved
+    task = getattr(instance, '_task_cache', None)
+    new = (instance.project_id, instance.task_id, instance.status)
+    if signal is pre_delete:
+        changes = [(new, None)]
+    elif kwargs.get('created'):
+        changes = [(None, new)]
+    else:
+        saved = getattr(instance, '_saved_values', {})
+        old = (saved.get('project_id'), saved.get('task_id'),
+               saved.get('status'))
+        if old == new:
+            # only the resolution has changed
+            return
+        if old[:2] == new[:2]:
+            # the task has only changed its status in the same project
+            changes = [(old, new)]
+        else:
+            changes = [(old, None), (None, new)]
+    for old, new in changes:
+        project_id, task_id = (old or new)[:2]
+        for locale_id in _get_locale_ids(task_id, task):
+            TaskCounter.objects.record(project_id, locale_id,
+                                       old and old[2], new and new[2])
+    if MATRIX_CACHE_TIMEOUT:
+        matrix_cache.invalidate()
+
+@receiver(post_save, sender=Task)
+def move_task_counters(sender, instance, created, **kwargs):
+    """Move the task's statuses to the counters of its new locale when the
+    locale of the task changes.
+
+    """
+    if created:
+        return
+    saved = getattr(instance, '_saved_values', {})
+    old_locale_id = saved.get('locale_id', instance.locale_id)
+    if old_locale_id == instance.locale_id:
+        return
+    for project_id, status in instance.statuses.values_list('project',
+                                                            'status'):
+        TaskCounter.objects.record(project_id, old_locale_id, status, None)
+        TaskCounter.objects.record(project_id, instance.locale_id, None,
+                                   status)
+    if MATRIX_CACHE_TIMEOUT:
+        matrix_cache.invalidate()
+
+@receiver(post_save, sender=TrackerInProject)
+@receiver(post_delete, sender=TrackerInProject)
+def update_tracker_signatures(sender, instance, signal, **kwargs):
+    """Update the project signatures of the trackers when they're added to or
+    removed from a project.
+
+    """
+    if getattr(instance, '_skip_signature', False):
+        # see Tracker.assign_to_projects
+        return
+    tracker_ids = set([instance.tracker_id])
+    if signal is post_save and not kwargs.get('created'):
+        saved = getattr(instance, '_saved_values', {})
+        if (saved.get('project_id') == instance.project_id and
+            saved.get('tracker_id') == instance.tracker_id):
+            # only the status or the resolution have changed
+            return
+        tracker_ids.add(saved.get('tracker_id'))
+    tracker_ids.discard(None)
+    update_project_signatures(tracker_ids)
+
+@receiver(post_save, sender=Actor)
+@receiver(post_save, sender=ProtoTask)
+@receiver(post_save, sender=Project)
+@receiver(post_save, sender=Locale)
+def refresh_related_reprs(sender, instance, created, **kwargs):
+    """Update the cached representations of the related objects stored on
+    todo objects.  See todo.models.reprs.
+
+    """
+    if created:
+        # no todo objects can be related to it yet
+        return
+    if sender is Actor:
+        refresh_actor_reprs(instance)
+    elif sender is ProtoTask:
+        refresh_prototype_reprs(instance)
+    elif sender is Project:
+        refresh_project_reprs(instance)
+    elif sender is Locale:
+        refresh_locale_reprs(instance)
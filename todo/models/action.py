@@ -45,6 +45,7 @@ try:
 except ImportError:
     LogEntry = None
 
+from todo.db import bulk_insert
 from todo.workflow import (NEW, ACTIVE, NEXT, ON_HOLD, RESOLVED, COMPLETED,
                            FAILED, INCOMPLETE)
 
@@ -131,11 +132,50 @@ class ActionManager(models.Manager):
 
         return action
 
+    def log_many(self, user, subjects, flag, message=None,
+                 create_logentry=True):
+        """Create log entries about the same action on many subjects.
+
+        The arguments are the same as the ones of `log` above, except for
+        `subjects`, which is a list of subjects.  The Actions (and the
+        LogEntries) are inserted with as few queries as possible.
+
+        """
+        if not subjects:
+            return
+        if message is None:
+            message = actions[flag]
+        objs = []
+        for subject in subjects:
+            objs.append(self.model(
+                timestamp=None,
+                user=user,
+                subject_content_type=ContentType.objects.get_for_model(
+                    subject),
+                subject_id=subject.pk,
+                flag=flag,
+                subject_repr=unicode(subject)[:200],
+                message=message
+            ))
+        bulk_insert(self.model, objs)
+
+        if (create_logentry and LogEntry and 
+            'django.contrib.admin' in settings.INSTALLED_APPS):
+            bulk_insert(LogEntry, [LogEntry(
+                user_id=user.pk,
+                content_type_id=action.subject_content_type_id,
+                object_id=unicode(action.subject_id),
+                object_repr=action.subject_repr,
+                action_flag=ADDITION if flag == NEW else CHANGE,
+                change_message=message
+            ) for action in objs])
+
 ACTION_CHOICES = tuple([(i, txt) for i, txt in actions.iteritems()])
 
 class Action(models.Model):
     "A log entry for an action that happened to an object."
-    timestamp = models.DateTimeField('timestamp', auto_now=True)
+    timestamp = models.DateTimeField('timestamp', auto_now=True,
+                                     db_index=True)
     user = models.ForeignKey(User, related_name='actions')
     subject_content_type = models.ForeignKey(ContentType)
     subject_id = models.PositiveIntegerField()
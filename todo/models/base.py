@@ -35,14 +35,17 @@
 #
 # ***** END LICENSE BLOCK *****
 
-from django.db import models
-from django.db.models import Q
+from django.db import models, DatabaseError
+from django.db.models import Q, F
+from django.db.models.signals import pre_save, post_save, post_init
 from django.contrib.contenttypes import generic
 
 from .action import Action, UPDATED
 from todo.workflow import NEW, ACTIVE, NEXT
 from todo.signals import todo_updated
 
+from datetime import datetime
+
 class TodoInterface(object):
     """An interface class for all todo objects."""
 
@@ -111,7 +114,13 @@ class Todo(TodoInterface, models.Model):
     def get_repr(self):
         if not self._repr:
             self._repr = self.format_repr()
-            self.save()
+            if self.pk is not None:
+                # store only the repr, don't save the whole object
+                type(self)._default_manager.filter(pk=self.pk).update(
+                    _repr=self._repr)
+                if hasattr(self, '_saved_values'):
+                    # see DirtyFieldsMixin below
+                    self._saved_values['_repr'] = self._repr
         return self._repr
 
     def set_repr(self, value):
@@ -119,6 +128,15 @@ class Todo(TodoInterface, models.Model):
 
     repr = property(get_repr, set_repr)
 
+    def get_reprs(self):
+        """Get the up-to-date values of all cached string representations
+        stored on the todo object, as a dict keyed by the names of the fields.
+
+        See todo.models.reprs for how they're kept up-to-date.
+
+        """
+        return {'_repr': self.format_repr()}
+
     # signals log actions using LogEntry
     actions = generic.GenericRelation(Action, object_id_field="subject_id",
                                     content_type_field="subject_content_type")
@@ -165,12 +183,93 @@ class Todo(TodoInterface, models.Model):
         """
         for prop, new_value in properties.iteritems():
             setattr(self, prop, new_value)
-        # if any of these properties change, we need to force the update of all 
-        # cached representation strings stored on the todo object
-        force_needed = ('summary', 'locale', 'prototype')
-        if any(prop in force_needed for prop in properties.keys()):
-            self.save(force=True)
-        else:
-            self.save()
+        # if any of these properties change, the cached representation strings 
+        # stored on the todo object need to be updated as well
+        repr_sources = ('summary', 'locale', 'prototype')
+        if any(prop in repr_sources for prop in properties.keys()):
+            for field, value in self.get_reprs().iteritems():
+                setattr(self, field, value)
+        self.save()
         if send_signal:
             todo_updated.send(sender=self, user=user, flag=flag)
+
+class Versioned(models.Model):
+    """A version stamp of a todo object and of everything displayed with it.
+
+    The version is bumped every time the object, its steps or statuses, or any
+    todo object under it is saved or deleted (see `bump_versions` and
+    todo.models.bump_saved_todo_versions).  Views can thus use it to tell if
+    anything has changed since the page was last requested, without
+    querying for the data displayed on the page (see todo.views.conditional).
+
+    The version is only ever written with `bump_versions`; `DirtyFieldsMixin`
+    makes sure saving a stale object doesn't overwrite it.
+
+    """
+    version = models.PositiveIntegerField(default=0, editable=False)
+    modified_ts = models.DateTimeField(default=datetime.now, editable=False)
+
+    class Meta:
+        abstract = True
+
+def bump_versions(model, pks):
+    "Bump the versions of the objects of the model with the given IDs."
+    if pks:
+        model._default_manager.filter(pk__in=pks).update(
+            version=F('version') + 1, modified_ts=datetime.now())
+
+class DirtyFieldsMixin(object):
+    """Save only the fields which have changed since the object was loaded.
+
+    The values of the fields are recorded when the object is initialized and
+    after every save.  Saving an object which already exists in the database
+    results in a single UPDATE of the changed columns (or no query at all if
+    nothing has changed), without the SELECT that Django runs to decide
+    between an INSERT and an UPDATE.  New objects, as well as saves with
+    `force_insert` or any other arguments but `force_update`, are handled by
+    Django as usual.
+
+    """
+    def _record_values(self):
+        # deferred fields are not in __dict__; don't load them
+        self._saved_values = dict((f.attname, self.__dict__[f.attname])
+                                  for f in self._meta.fields
+                                  if f.attname in self.__dict__)
+
+    def get_dirty_fields(self):
+        "Get the fields whose values have changed since the last save."
+        saved = getattr(self, '_saved_values', {})
+        return [f for f in self._meta.fields
+                if not f.primary_key and f.attname in saved and
+                   f.attname in self.__dict__ and
+                   self.__dict__[f.attname] != saved[f.attname]]
+
+    def save(self, force_insert=False, force_update=False, *args, **kwargs):
+        if self.pk is None or force_insert or args or kwargs:
+            super(DirtyFieldsMixin, self).save(force_insert, force_update,
+                                               *args, **kwargs)
+            self._record_values()
+            return
+        cls = type(self)
+        pre_save.send(sender=cls, instance=self, raw=False)
+        values = dict((f.name, f.pre_save(self, False))
+                      for f in self.get_dirty_fields())
+        created = False
+        if values:
+            updated = cls._default_manager.filter(pk=self.pk).update(**values)
+            if not updated:
+                if force_update:
+                    raise DatabaseError('Forced update did not affect any '
+                                        'rows.')
+                # the row doesn't exist (anymore); insert it without sending
+                # the signals again
+                self.save_base(cls=cls, force_insert=True)
+                created = True
+        post_save.send(sender=cls, instance=self, created=created, raw=False)
+        self._record_values()
+
+def _record_initial_values(sender, instance, **kwargs):
+    if isinstance(instance, DirtyFieldsMixin):
+        instance._record_values()
+
+post_init.connect(_record_initial_values)
@@ -0,0 +1,89 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Mozilla todo app.
+#
+# The Initial Developer of the Original Code is
+# Mozilla Foundation.
+# Portions created by the Initial Developer are Copyright (C) 2010
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#   Stas Malolepszy <stas@mozilla.com>
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+from django.db import connection, models
+
+from .task import Task
+
+class BugMetadataManager(models.Manager):
+    def stale_tasks(self, tasks=None):
+        """Get the tasks whose bug has changed since their snapshot.
+
+        The times of the last changes of the bugs are stored by the
+        `synctodobugs` management command.  Tasks whose bugs haven't been
+        synced yet are not included.
+
+        Arguments:
+            tasks -- a QuerySet of tasks to filter; all tasks by default
+
+        """
+        if tasks is None:
+            tasks = Task.objects.all()
+        qn = connection.ops.quote_name
+        tables = {'task': qn(Task._meta.db_table),
+                  'bug': qn(self.model._meta.db_table)}
+        tables['changed'] = ('(%(task)s.snapshot_ts IS NULL OR '
+                             'b.last_change_ts > %(task)s.snapshot_ts)' %
+                             tables)
+        # two EXISTS subqueries, so that each of them can use its own index
+        where = ('(EXISTS (SELECT 1 FROM %(bug)s b '
+                 'WHERE b.bugid = %(task)s.bugid AND %(changed)s) OR '
+                 'EXISTS (SELECT 1 FROM %(bug)s b '
+                 'WHERE %(task)s.bugid IS NULL AND '
+                 'b.alias = %(task)s.alias AND %(changed)s))' % tables)
+        return tasks.extra(where=[where])
+
+class BugMetadata(models.Model):
+    """Data about a bug retrieved from Bugzilla.
+
+    Kept up-to-date by the `synctodobugs` management command.
+
+    """
+    bugid = models.PositiveIntegerField(unique=True)
+    alias = models.CharField(max_length=200, null=True, blank=True,
+                             db_index=True)
+    last_change_ts = models.DateTimeField(db_index=True)
+    # when the data was last retrieved from Bugzilla
+    synced_ts = models.DateTimeField()
+
+    objects = BugMetadataManager()
+
+    class Meta:
+        app_label = 'todo'
+
+    def __unicode__(self):
+        return 'bug %d' % self.bugid
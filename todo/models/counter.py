@@ -0,0 +1,161 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Mozilla todo app.
+#
+# The Initial Developer of the Original Code is
+# Mozilla Foundation.
+# Portions created by the Initial Developer are Copyright (C) 2010
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#   Stas Malolepszy <stas@mozilla.com>
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+from django.db import models
+from django.db.models import Count, F, Sum
+
+from life.models import Locale
+
+from .project import Project
+from todo.db import bulk_insert
+from todo.workflow import ON_HOLD, RESOLVED
+
+def _is_open(status):
+    return status is not None and status < ON_HOLD
+
+def _is_resolved(status):
+    return status == RESOLVED
+
+class TaskCounterManager(models.Manager):
+    def record(self, project_id, locale_id, old_status, new_status):
+        """Update the counters after a status of a task has changed.
+
+        Arguments:
+            project_id -- the ID of the project of the TaskInProject object
+            locale_id -- the ID of the locale of the task (or None)
+            old_status -- the status before the change; None if the task has
+                          just been assigned to the project
+            new_status -- the status after the change; None if the task has
+                          just been removed from the project
+
+        """
+        total = int(new_status is not None) - int(old_status is not None)
+        open = int(_is_open(new_status)) - int(_is_open(old_status))
+        resolved = (int(_is_resolved(new_status)) -
+                    int(_is_resolved(old_status)))
+        if not (total or open or resolved):
+            return
+        counters = self.filter(project=project_id, locale=locale_id)
+        updated = counters.update(total=F('total') + total,
+                                  open=F('open') + open,
+                                  resolved=F('resolved') + resolved)
+        if not updated:
+            self.create(project_id=project_id, locale_id=locale_id,
+                        total=total, open=open, resolved=resolved)
+
+    def matrix(self, projects=None, locales=None):
+        """Get the task counts of all (project, locale) pairs at once.
+
+        The counts are computed with a single grouped query.  Returns a list
+        of dicts with the following keys: project (the ID of the project),
+        locale (the code of the locale, or None for tasks without a locale),
+        all, open and completion (the same as in `Project.task_count`).
+
+        Arguments:
+            projects -- a list of todo.models.Project objects or IDs to limit
+                        the matrix to
+            locales -- a list of life.models.Locale objects or IDs to limit
+                       the matrix to
+
+        """
+        counters = self.all()
+        if projects is not None:
+            counters = counters.filter(project__in=projects)
+        if locales is not None:
+            counters = counters.filter(locale__in=locales)
+        rows = (counters.values('project', 'locale__code')
+                        .annotate(all=Sum('total'), open=Sum('open'))
+                        .order_by('project', 'locale__code'))
+        matrix = []
+        for row in rows:
+            all, open = row['all'] or 0, row['open'] or 0
+            matrix.append({
+                'project': row['project'],
+                'locale': row['locale__code'],
+                'all': all,
+                'open': open,
+                'completion': 100 * (all - open) / all if all != 0 else 0,
+            })
+        return matrix
+
+    def rebuild(self):
+        """Recompute all counters from the TaskInProject objects.
+
+        The counters are computed with three grouped queries, regardless of
+        the number of projects and locales.  Run it in a transaction.
+
+        """
+        from todo.models import TaskInProject
+        statuses = TaskInProject.objects.values('project', 'task__locale')
+        counters = {}
+        for key, rows in (('total', statuses),
+                          ('open', statuses.filter(status__lt=ON_HOLD)),
+                          ('resolved', statuses.filter(status=RESOLVED))):
+            for row in rows.annotate(count=Count('pk')).order_by():
+                pair = (row['project'], row['task__locale'])
+                counter = counters.setdefault(pair, self.model(
+                    project_id=pair[0], locale_id=pair[1]))
+                setattr(counter, key, row['count'])
+        self.all().delete()
+        bulk_insert(self.model, counters.values())
+        return len(counters)
+
+class TaskCounter(models.Model):
+    """Numbers of tasks in a project for a locale.
+
+    The counters are updated every time a task is assigned to a project,
+    changes its status or is removed from the project (see `record` above).
+    They allow to get the task counts (see `Project.task_count`) without
+    querying the tasks themselves.
+
+    """
+    project = models.ForeignKey(Project, related_name='task_counters')
+    locale = models.ForeignKey(Locale, related_name='task_counters',
+                               null=True, blank=True)
+    total = models.PositiveIntegerField(default=0)
+    open = models.PositiveIntegerField(default=0)
+    resolved = models.PositiveIntegerField(default=0)
+
+    objects = TaskCounterManager()
+
+    class Meta:
+        app_label = 'todo'
+        unique_together = ('project', 'locale')
+
+    def __unicode__(self):
+        return '%s/%s: %d of %d open' % (self.project_id, self.locale_id,
+                                         self.open, self.total)
@@ -0,0 +1,170 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Mozilla todo app.
+#
+# The Initial Developer of the Original Code is
+# Mozilla Foundation.
+# Portions created by the Initial Developer are Copyright (C) 2010
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#   Stas Malolepszy <stas@mozilla.com>
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+from django.db import models
+from django.db.models import Count
+
+from .step import Step
+from .task import Task, TaskInProject
+from .tracker import Tracker, get_tracker_chains
+from todo.db import bulk_insert
+from todo.workflow import NEXT
+
+# the facets of tasks, as used by the tracker tree (see todo.views.snippets)
+FACETS = ('projects', 'locales', 'statuses', 'prototypes', 'bugs', 'trackers',
+          'next_steps_owners', 'next_steps')
+# an internal facet storing the IDs of the trackers above the task; used to
+# narrow the index down to a subtree of a tracker
+TRACKER_IDS = 'tracker_ids'
+
+class TaskFacetManager(models.Manager):
+    def reindex(self, tasks):
+        """Rebuild the facet index for the given tasks.
+
+        The data needed to index the tasks is retrieved with a constant number
+        of queries (plus one query per level of trackers above the tasks), no
+        matter how many tasks are passed.
+
+        Arguments:
+            tasks -- an iterable of todo.models.Task instances
+
+        """
+        tasks = list(tasks)
+        if not tasks:
+            return
+        task_ids = [task.pk for task in tasks]
+        statuses = dict((task_id, []) for task_id in task_ids)
+        next_steps = dict((task_id, []) for task_id in task_ids)
+        status_objects = TaskInProject.objects.select_related('project')
+        for status in status_objects.filter(task__in=task_ids):
+            statuses[status.task_id].append(status)
+        for step in Step.objects.filter(task__in=task_ids, status=NEXT):
+            next_steps[step.task_id].append(step)
+        chains = get_tracker_chains(set(task.parent_id for task in tasks
+                                        if task.parent_id is not None))
+
+        facets = []
+        for task in tasks:
+            chain = chains.get(task.parent_id, [])
+            properties = task.get_facet_data(statuses[task.pk],
+                                             next_steps[task.pk], chain)
+            properties[TRACKER_IDS] = [tracker.pk for tracker in chain]
+            for facet, values in properties.iteritems():
+                for value in set(values):
+                    if value is None or value == '':
+                        continue
+                    facets.append(self.model(task_id=task.pk, facet=facet,
+                                             value=unicode(value)[:250]))
+        self.filter(task__in=task_ids).delete()
+        bulk_insert(self.model, facets)
+
+    def reindex_tracker(self, tracker):
+        "Rebuild the facet index for all tasks under the tracker."
+        tasks = []
+        trackers = [tracker]
+        while trackers:
+            tasks.extend(Task.objects.filter(parent__in=trackers))
+            trackers = list(Tracker.objects.filter(parent__in=trackers))
+        self.reindex(tasks)
+
+    def search(self, tasks, criteria, after=None, limit=50):
+        """Filter the tasks using the facet index.
+
+        Values given for a single facet are ORed together; facets are ANDed.
+        This corresponds to the behavior of the client-side filter of the
+        tracker tree.
+
+        Arguments:
+            tasks -- a QuerySet of tasks to search in
+            criteria -- a dict mapping the names of the facets to lists of
+                        accepted values
+            after -- the ID of the last task on the previous page (optional)
+            limit -- the maximum number of tasks to return; must be positive
+
+        Returns:
+            a tuple of (tasks, counts, cursor) where `tasks` is a list of
+            matching tasks ordered by ID, `counts` is a dict mapping the
+            facets to dicts of {value: number of matching tasks} and `cursor`
+            is the value of `after` to pass to get the next page (or None if
+            there are no more tasks).
+
+        Raises ValueError if the limit is not positive.
+
+        """
+        if limit < 1:
+            raise ValueError('The limit must be a positive integer.')
+        for facet, values in criteria.iteritems():
+            tasks = tasks.filter(facets__facet=facet,
+                                 facets__value__in=values)
+        tasks = tasks.distinct()
+
+        counts = dict((facet, {}) for facet in FACETS)
+        facet_values = self.filter(task__in=tasks.values('pk'),
+                                   facet__in=FACETS)
+        facet_values = facet_values.values('facet', 'value')
+        for row in facet_values.annotate(count=Count('task')).order_by():
+            counts[row['facet']][row['value']] = row['count']
+
+        if after is not None:
+            tasks = tasks.filter(pk__gt=after)
+        page = list(tasks.order_by('pk')[:limit + 1])
+        cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            cursor = page[-1].pk
+        return page, counts, cursor
+
+class TaskFacet(models.Model):
+    """An entry in the index of tasks' facets.
+
+    Every task has one entry per value of each of its facets (see
+    `todo.models.Task.get_facet_data`).  The index allows to filter the tasks
+    of a tracker tree without retrieving and analyzing the whole tree.
+
+    """
+    task = models.ForeignKey(Task, related_name='facets')
+    facet = models.CharField(max_length=30)
+    value = models.CharField(max_length=250, db_index=True)
+
+    objects = TaskFacetManager()
+
+    class Meta:
+        app_label = 'todo'
+        unique_together = ('task', 'facet', 'value')
+
+    def __unicode__(self):
+        return '%s: %s' % (self.facet, self.value)
@@ -36,6 +36,7 @@
 # ***** END LICENSE BLOCK *****
 
 from django.db import models
+from django.db.models import Sum
 
 from todo.workflow import NEW, ACTIVE, NEXT, ON_HOLD
 
@@ -54,14 +55,14 @@ class Project(models.Model):
         return '%s' % self.label
 
     def task_count(self, locale=None):
+        # the counts are kept up-to-date in the `TaskCounter` model, one per
+        # locale; see `todo.models.counter`
+        counters = self.task_counters.all()
         if locale is not None:
-            tasks = self.tasks.filter(locale=locale)
-        else:
-            tasks = self.tasks
-        all = tasks.count()
-        # status and resolution are kept on the intermediary `TaskInProject`
-        # model
-        open = tasks.filter(statuses__status__lt=ON_HOLD).distinct().count()
+            counters = counters.filter(locale=locale)
+        counts = counters.aggregate(all=Sum('total'), open=Sum('open'))
+        all = counts['all'] or 0
+        open = counts['open'] or 0
         return {'all': all,
                 'open': open,
                 'completion': 100 * (all - open) / all if all != 0 else 0,
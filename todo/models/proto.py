@@ -40,8 +40,8 @@ from django.contrib.contenttypes.models import ContentType
 
 from .action import CREATED
 from .actor import Actor
-from todo.workflow import ACTIVE, NEXT
-from todo.signals import status_changed
+from todo.workflow import NEW, ACTIVE, NEXT
+from todo.signals import status_changed, todo_spawned
 
 TRACKER_TYPE, TASK_TYPE, STEP_TYPE = range(1,4)
 
@@ -62,7 +62,7 @@ class Proto(models.Model):
     Proto.get_related_model to go from Proto to a specific proto model.
     
     """
-    summary = models.CharField(max_length=200)
+    summary = models.CharField(max_length=200, db_index=True)
     type = models.PositiveIntegerField(choices=PROTO_TYPE_CHOICES)
 
     # The type of the Proto object represented by an integer from
@@ -146,6 +146,9 @@ class Proto(models.Model):
         # custom fields override fields from the proto
         fields.update(custom_fields)
         todo = related_model(prototype=self, **fields)
+        # the versions of the spawned tree are bumped once it's complete 
+        # (see todo.models.bump_todo_versions)
+        todo._spawned = True
         # store the string representation of the todo as its property before 
         # it is saved, in order to avoid a query made by todo.get_repr
         todo.repr = todo.format_repr(**fields)
@@ -163,7 +166,7 @@ class Proto(models.Model):
             # create required {Tracker,Task}InProject objects handling the 
             # many-to-many relation; set the status to 'active' is requested.
             todo.assign_to_projects(projects,
-                                    status=ACTIVE if activate else None)
+                                    status=ACTIVE if activate else NEW)
         status_changed.send(sender=todo, user=user, flag=CREATED)
         return todo
 
@@ -211,22 +214,24 @@ class Proto(models.Model):
             fields = custom_fields.copy()
             if activate and child.type == STEP_TYPE:
                 activate = nesting.should_be_activated()
+            # children are part of the tree spawned by the caller which will
+            # send the `todo_spawned` signal for the whole tree
             if cloning_allowed['locale'] and child.clone_per_locale:
                 spawned = child.spawn_per_locale(user, activate=activate,
-                                                 **fields)
+                                                 send_signal=False, **fields)
             elif cloning_allowed['project'] and child.clone_per_project:
                 spawned = child.spawn_per_project(user, activate=activate,
-                                                  **fields)
+                                                  send_signal=False, **fields)
             else:
                 # a tuple because it needs to be iterable in the next line
                 spawned = (child.spawn(user, activate=activate,
                                        cloning_allowed=cloning_allowed,
-                                       **fields),)
+                                       send_signal=False, **fields),)
             children.extend(spawned)
         return children
 
     def spawn(self, user, activate=True, cloning_allowed=None,
-              **custom_fields):
+              send_signal=True, **custom_fields):
         """Create an instance of the model related to the proto, with children.
         
         This method creates an instance of the model related to the current
@@ -250,6 +255,10 @@ class Proto(models.Model):
         The method always returns just one, top-level todo object, even if
         more were created as children.
 
+        If `send_signal` is True (default), a `todo_spawned` signal is sent
+        for the returned todo object once all of its children have been
+        created.
+
         """
         # `projects` is the only required argument (the values for all other
         # can be inherited from the prototype)
@@ -275,9 +284,14 @@ class Proto(models.Model):
             # INSERT or an UPDATE here. See <http://docs.djangoproject.com/en/ 
             # 1.1/ref/models/instances/#how-django-knows-to-update-vs-insert>.
             todo.save(force_update=True)
+        # saving the todo object from now on bumps the versions again
+        todo._spawned = False
+        if send_signal:
+            todo_spawned.send(sender=todo, user=user)
         return todo
 
-    def spawn_per_locale(self, user, activate=True, **fields):
+    def spawn_per_locale(self, user, activate=True, send_signal=True,
+                         **fields):
         """Create multiple todo objects from a single prototype per locale.
 
         If `locales` iterable is passed in `fields`, the prototype will be used
@@ -341,9 +355,11 @@ class Proto(models.Model):
             # purposes is too much for Python
             reset_queries()
             yield self.spawn(user, activate=activate, locale=loc,
-                             cloning_allowed=cloning_allowed, **fields)
+                             cloning_allowed=cloning_allowed,
+                             send_signal=send_signal, **fields)
 
-    def spawn_per_project(self, user, activate=True, **fields):
+    def spawn_per_project(self, user, activate=True, send_signal=True,
+                          **fields):
         """Create multiple todo objects from a single prototype per project.
 
         This method should only be used for steps (it will have no effect in
@@ -359,7 +375,8 @@ class Proto(models.Model):
             projects = [None]
         for project in projects:
             yield self.spawn(user, activate=activate, project=project,
-                             cloning_allowed=cloning_allowed, **fields)
+                             cloning_allowed=cloning_allowed,
+                             send_signal=send_signal, **fields)
 
 class ProtoTracker(Proto):
     """Proto Tracker model.
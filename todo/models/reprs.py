@@ -0,0 +1,181 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Mozilla todo app.
+#
+# The Initial Developer of the Original Code is
+# Mozilla Foundation.
+# Portions created by the Initial Developer are Copyright (C) 2010
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#   Stas Malolepszy <stas@mozilla.com>
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+"""Maintenance of the cached string representations of todo objects.
+
+Todo objects store the representations of themselves and of some related
+objects (e.g. `Task.locale_repr` or `Step.owner_repr`) so that they can be
+displayed without additional queries.  The functions below refresh them when
+the related objects change, writing only the repr columns of the rows whose
+values are out of date.  See todo.models for the receivers calling them and
+the `refreshtodoreprs` management command for a complete refresh.
+
+The reprs are written with queryset updates, which don't send any signals,
+so the functions bump the versions, invalidate the cached trees and reindex
+the facets of the changed todo objects themselves.
+
+"""
+
+from .base import bump_versions
+from .facet import TaskFacet
+from .step import Step
+from .task import Task, TaskInProject
+from .tracker import Tracker, get_tracker_chains
+from todo.cache import tree_cache, TREE_CACHE_TIMEOUT
+from todo.db import bulk_update, chunked
+
+# related objects used by `get_reprs` of each model
+_RELATED = {
+    Task: ('locale', 'prototype'),
+    Tracker: ('locale',),
+    Step: ('owner', 'project'),
+}
+
+def _todos_changed(task_ids=(), tracker_ids=(), batch_size=500):
+    """Bump the versions, invalidate the cached trees and reindex the facets
+    of the tasks and trackers with the given IDs, in batches."""
+    for model, ids in ((Task, task_ids), (Tracker, tracker_ids)):
+        for batch in chunked(sorted(set(ids)), batch_size):
+            todos = list(model.objects.filter(pk__in=batch))
+            if model is Task:
+                TaskFacet.objects.reindex(todos)
+                bump_versions(Task, batch)
+                parent_ids = set(task.parent_id for task in todos
+                                 if task.parent_id is not None)
+            else:
+                parent_ids = set(batch)
+            chains = get_tracker_chains(parent_ids)
+            bump_versions(Tracker, set(tracker.pk
+                                       for chain in chains.itervalues()
+                                       for tracker in chain))
+            if TREE_CACHE_TIMEOUT:
+                for todo in todos:
+                    tree_cache.invalidate(todo)
+
+def refresh_reprs(todos, batch_size=500):
+    """Recompute the reprs of the todo objects and store the changed ones.
+
+    The objects are retrieved in batches, together with their related
+    objects, and the changed reprs are saved with batched UPDATEs of only the
+    repr columns.  The tasks and trackers displaying the changed objects are
+    then refreshed (see `_todos_changed`).
+
+    Arguments:
+        todos -- a QuerySet of tasks, trackers or steps
+        batch_size -- the number of objects retrieved and updated at once
+
+    Returns the number of objects whose reprs have changed.
+
+    """
+    model = todos.model
+    todos = todos.select_related(*_RELATED[model]).order_by('pk')
+    last_id = 0
+    updated = 0
+    while True:
+        batch = list(todos.filter(pk__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        changed = []
+        for todo in batch:
+            reprs = todo.get_reprs()
+            if any(getattr(todo, field) != value
+                   for field, value in reprs.iteritems()):
+                for field, value in reprs.iteritems():
+                    setattr(todo, field, value)
+                changed.append(todo)
+        if changed:
+            bulk_update(model, changed, reprs.keys(), batch_size)
+            if model is Step:
+                _todos_changed(task_ids=[step.task_id for step in changed],
+                               batch_size=batch_size)
+            elif model is Task:
+                _todos_changed(task_ids=[task.pk for task in changed],
+                               batch_size=batch_size)
+            else:
+                _todos_changed(tracker_ids=[tracker.pk
+                                            for tracker in changed],
+                               batch_size=batch_size)
+        updated += len(changed)
+        last_id = batch[-1].pk
+    return updated
+
+def refresh_actor_reprs(actor):
+    "Update the reprs of the steps owned by the actor."
+    name = unicode(actor)
+    steps = Step.objects.filter(owner=actor).exclude(owner_repr=name)
+    task_ids = list(steps.values_list('task', flat=True))
+    updated = steps.update(owner_repr=name)
+    _todos_changed(task_ids=task_ids)
+    return updated
+
+def refresh_prototype_reprs(prototype):
+    "Update the reprs of the tasks created from the prototype."
+    tasks = (Task.objects.filter(prototype=prototype)
+                         .exclude(prototype_repr=prototype.summary))
+    task_ids = list(tasks.values_list('pk', flat=True))
+    updated = tasks.update(prototype_repr=prototype.summary)
+    _todos_changed(task_ids=task_ids)
+    return updated
+
+def refresh_locale_reprs(locale):
+    "Update the reprs of the tasks and trackers of the locale."
+    name = unicode(locale)
+    # the reprs of tasks and trackers start with the code of the locale; only
+    # the ones which don't start with it (or whose locale_repr is out of
+    # date) need to be recomputed
+    prefix = '[%s] ' % locale.code
+    tasks = Task.objects.filter(locale=locale)
+    updated = refresh_reprs(tasks.exclude(locale_repr=name,
+                                          _repr__startswith=prefix))
+    trackers = Tracker.objects.filter(locale=locale)
+    updated += refresh_reprs(trackers.exclude(_repr__startswith=prefix))
+    return updated
+
+def refresh_project_reprs(project):
+    """Update the reprs of the steps specific to the project and the facets
+    of the tasks in the project."""
+    suffix = ' %s' % project
+    updated = refresh_reprs(Step.objects.filter(project=project)
+                                        .exclude(_repr__endswith=suffix))
+    # the name of the project is one of the facets of its tasks; refresh the
+    # tasks which aren't indexed under the current name
+    indexed = TaskFacet.objects.filter(facet='projects',
+                                       value=unicode(project)[:250])
+    statuses = (TaskInProject.objects.filter(project=project)
+                                     .exclude(task__in=indexed.values('task')))
+    _todos_changed(task_ids=statuses.values_list('task', flat=True))
+    return updated
@@ -36,9 +36,11 @@
 # ***** END LICENSE BLOCK *****
 
 from django.db import models
+from django.db.models import Max
+from django.contrib.contenttypes.models import ContentType
 
-from .action import NEXTED
-from .base import Todo
+from .action import Action, NEXTED
+from .base import Todo, DirtyFieldsMixin
 from .actor import Actor
 from .project import Project
 from .proto import ProtoStep
@@ -51,7 +53,58 @@ from todo.signals import status_changed
     
 from datetime import datetime, timedelta
 
-class Step(Todo):
+def get_step_tree(task):
+    """Get all the steps of the task, grouped by their parents.
+
+    Returns a dict mapping the ID of the parent step (or None for the
+    top-level steps) to the list of its children, ordered.  The steps are
+    retrieved with one query and their `has_children` and `is_overdue` are
+    pre-computed with one more query for the timestamps of the NEXTED
+    actions, so that rendering the tree doesn't cause any further queries.
+
+    """
+    tree = {}
+    steps = list(task.steps.all())
+    for step in steps:
+        tree.setdefault(step.parent_id, []).append(step)
+
+    deadlines = get_deadlines([(step.pk, step.allowed_time)
+                               for step in steps if step.status == NEXT])
+    now = datetime.now()
+    for step in steps:
+        # don't use the `has_children` setter, it saves the step
+        step._has_children = step.pk in tree
+        if step.status == NEXT:
+            deadline = deadlines.get(step.pk)
+            step._overdue = deadline is not None and now > deadline
+    return tree
+
+def get_deadlines(steps):
+    """Get the times at which the next steps become overdue.
+
+    The times are computed with a single query for the latest NEXTED actions
+    of the steps.
+
+    Arguments:
+        steps -- a list of (ID, allowed_time) tuples of steps whose status is
+                 NEXT
+
+    Returns:
+        a dict mapping the IDs of the steps to datetimes; steps which have
+        never been nexted are omitted
+
+    """
+    if not steps:
+        return {}
+    allowed_times = dict(steps)
+    actions = Action.objects.filter(
+        subject_content_type=ContentType.objects.get_for_model(Step),
+        subject_id__in=allowed_times.keys(), flag=NEXTED)
+    nexted = actions.values_list('subject_id').annotate(Max('timestamp'))
+    return dict((step_id, ts + timedelta(days=allowed_times[step_id]))
+                for step_id, ts in nexted.order_by())
+
+class Step(DirtyFieldsMixin, Todo):
     prototype = models.ForeignKey(ProtoStep, related_name='steps', null=True,
                                   blank=True)
     summary = models.CharField(max_length=200, blank=True)
@@ -103,6 +156,11 @@ class Step(Todo):
             _repr = '%s %s' % (_repr, project)
         return _repr
 
+    def get_reprs(self):
+        reprs = super(Step, self).get_reprs()
+        reprs['owner_repr'] = unicode(self.owner) if self.owner_id else ''
+        return reprs
+
     def save(self, *args, **kwargs):
         if not self.id and not self.owner_repr and self.owner:
             # the step doesn't exist in the DB yet
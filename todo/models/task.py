@@ -40,7 +40,7 @@ from django.db import models
 from life.models import Locale
 
 from .action import ACTIVATED
-from .base import Todo
+from .base import Todo, Versioned, DirtyFieldsMixin
 from .project import Project
 from .proto import ProtoTask
 from .tracker import Tracker
@@ -50,7 +50,7 @@ from todo.workflow import (NEW, ACTIVE, NEXT, ON_HOLD, RESOLVED, COMPLETED,
                            RESOLUTION_CHOICES)
 from todo.signals import status_changed
     
-class TaskInProject(models.Model):
+class TaskInProject(DirtyFieldsMixin, models.Model):
     task = models.ForeignKey('Task', related_name="statuses")
     project = models.ForeignKey(Project, related_name="task_statuses")
     status = models.PositiveIntegerField(choices=STATUS_CHOICES, default=NEW)
@@ -64,12 +64,12 @@ class TaskInProject(models.Model):
     def __unicode__(self):
         return '%s for %s' % (self.task, self.project)
 
-class Task(Todo):
+class Task(DirtyFieldsMixin, Versioned, Todo):
     prototype = models.ForeignKey(ProtoTask, related_name='tasks', null=True,
                                   blank=True)
     parent = models.ForeignKey(Tracker, related_name='tasks', null=True,
                                blank=True)
-    summary = models.CharField(max_length=200, blank=True)
+    summary = models.CharField(max_length=200, blank=True, db_index=True)
     locale = models.ForeignKey(Locale, related_name='tasks', null=True,
                                blank=True)
     projects = models.ManyToManyField(Project, related_name='tasks',
@@ -134,6 +134,13 @@ class Task(Todo):
             _repr = '[%s] %s' % (locale.code, _repr)
         return _repr
 
+    def get_reprs(self):
+        reprs = super(Task, self).get_reprs()
+        reprs['prototype_repr'] = (self.prototype.summary
+                                   if self.prototype_id else '')
+        reprs['locale_repr'] = unicode(self.locale) if self.locale_id else ''
+        return reprs
+
     def save(self, force=False, *args, **kwargs):
         if not self.id or force:
             # the task doesn't exist in the DB yet
@@ -174,6 +181,32 @@ class Task(Todo):
                 self._is_resolved_all = True
         return self._is_resolved_all
 
+    def get_facet_data(self, statuses, next_steps, tracker_chain):
+        """Get a dict of properties describing the task in faceted views.
+
+        The keys of the dict are the names of the facets and the values are
+        lists of values of the facets for the task.
+
+        Arguments:
+            statuses -- a list of TaskInProject objects related to the task
+            next_steps -- a list of next steps of the task
+            tracker_chain -- a list of trackers above the task, starting with
+                             the top-most one
+
+        """
+        return {
+            'projects': [unicode(s.project) for s in statuses],
+            'locales': [self.locale_repr],
+            'statuses': ['%s for %s' %
+                         (s.get_status_display(), unicode(s.project))
+                         for s in statuses],
+            'prototypes': [self.prototype_repr],
+            'bugs': [self.bugid],
+            'trackers': [t.summary for t in tracker_chain],
+            'next_steps': [unicode(step) for step in next_steps],
+            'next_steps_owners': [step.owner_repr for step in next_steps],
+        }
+
     @property
     def code(self):
         return str(self.id)
@@ -231,6 +264,8 @@ class Task(Todo):
 
         self.activate_children(user)
         for status in self.statuses.all():
+            # the task counters are updated on save using the task's locale
+            status.task = self
             status.status = ACTIVE
             status.save()
             status_changed.send(sender=status, user=user, flag=ACTIVATED)
@@ -238,6 +273,7 @@ class Task(Todo):
     def resolve(self, user, project, resolution=COMPLETED):
         "Resolve the task."
         status = self.statuses.get(project=project)
+        status.task = self
         status.status = RESOLVED
         status.resolution = resolution
         status.save()
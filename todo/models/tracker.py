@@ -36,11 +36,12 @@
 # ***** END LICENSE BLOCK *****
 
 from django.db import models
+from django.utils.hashcompat import md5_constructor
 
 from life.models import Locale
 
 from .action import ACTIVATED
-from .base import Todo
+from .base import Todo, Versioned, DirtyFieldsMixin
 from .project import Project
 from .proto import ProtoTracker
 from todo.managers import StatusManager
@@ -49,7 +50,92 @@ from todo.workflow import (NEW, ACTIVE, NEXT, ON_HOLD, RESOLVED, COMPLETED,
                            RESOLUTION_CHOICES)
 from todo.signals import status_changed
 
-class TrackerInProject(models.Model):
+def get_project_signature(project_ids):
+    """Get the canonical signature of a set of projects.
+
+    The signature is a string with the sorted IDs of the projects, delimited
+    (and surrounded) by commas, e.g. ',1,4,'.  An empty set of projects has
+    an empty signature.  See `Tracker.project_signature`.
+
+    """
+    project_ids = sorted(set(int(pk) for pk in project_ids))
+    if not project_ids:
+        return ''
+    return ',%s,' % ','.join(str(pk) for pk in project_ids)
+
+def get_project_digest(signature):
+    """Get the MD5 digest of a project signature, used for exact lookups.
+
+    The digest of the empty signature is empty as well.  See
+    `Tracker.project_digest`.
+
+    """
+    if not signature:
+        return ''
+    return md5_constructor(signature).hexdigest()
+
+def parse_project_signature(signature):
+    "Get the set of IDs of projects from a project signature."
+    return set(int(pk) for pk in signature.split(',') if pk)
+
+def update_project_signatures(tracker_ids):
+    """Recompute the project signatures of the given trackers.
+
+    Returns the number of trackers whose signatures have changed.
+
+    """
+    tracker_ids = set(tracker_ids)
+    projects = dict((pk, []) for pk in tracker_ids)
+    statuses = TrackerInProject.objects.filter(tracker__in=tracker_ids)
+    for tracker_id, project_id in statuses.values_list('tracker', 'project'):
+        projects[tracker_id].append(project_id)
+    # group the trackers by the new signature to update them together
+    by_signature = {}
+    for tracker_id, project_ids in projects.iteritems():
+        signature = get_project_signature(project_ids)
+        by_signature.setdefault(signature, []).append(tracker_id)
+    updated = 0
+    for signature, ids in by_signature.iteritems():
+        digest = get_project_digest(signature)
+        updated += (Tracker.objects.filter(pk__in=ids)
+                                   .exclude(project_signature=signature,
+                                            project_digest=digest)
+                                   .update(project_signature=signature,
+                                           project_digest=digest))
+    return updated
+
+def get_tracker_chains(tracker_ids):
+    """Get the chains of ancestors for the given trackers.
+
+    The trackers are retrieved level by level, so the number of queries
+    depends on the depth of the tree, not on the number of trackers.
+
+    Arguments:
+        tracker_ids -- an iterable of IDs of trackers
+
+    Returns:
+        a dict mapping the IDs to lists of trackers, starting with the
+        top-most one and ending with the tracker itself.
+
+    """
+    cache = {}
+    to_fetch = set(tracker_ids)
+    while to_fetch:
+        fetched = Tracker.objects.in_bulk(list(to_fetch))
+        cache.update(fetched)
+        to_fetch = set(t.parent_id for t in fetched.itervalues()
+                       if t.parent_id is not None and t.parent_id not in cache)
+    chains = {}
+    for tracker_id in tracker_ids:
+        chain = []
+        tracker = cache.get(tracker_id, None)
+        while tracker is not None:
+            chain.insert(0, tracker)
+            tracker = cache.get(tracker.parent_id, None)
+        chains[tracker_id] = chain
+    return chains
+
+class TrackerInProject(DirtyFieldsMixin, models.Model):
     tracker = models.ForeignKey('Tracker', related_name="statuses")
     project = models.ForeignKey(Project, related_name="tracker_statuses")
     status = models.PositiveIntegerField(choices=STATUS_CHOICES, default=NEW)
@@ -63,12 +149,43 @@ class TrackerInProject(models.Model):
     def __unicode__(self):
         return '%s for %s' % (self.tracker, self.project)
 
-class Tracker(Todo):
+class TrackerManager(StatusManager):
+    def for_projects(self, projects, exact=True):
+        """Get trackers related to the given projects.
+
+        Only the exact lookup is a lookup of a single indexed column (the
+        digest of the project signature).  The "at least" lookup narrows the
+        trackers down to the ones related to the first of the projects, using
+        the index of TrackerInProject, and then checks the unindexed project
+        signatures of these trackers for the other projects, so it needs
+        a single JOIN no matter how many projects are given.
+
+        Arguments:
+            projects -- an iterable of projects or their IDs
+            exact -- if True (default), only return trackers related to exactly
+                     these projects; if False, return trackers related to at
+                     least these projects.
+
+        """
+        project_ids = [getattr(p, 'pk', p) for p in projects]
+        if exact:
+            return self.filter(project_digest=get_project_digest(
+                get_project_signature(project_ids)))
+        project_ids = sorted(set(int(pk) for pk in project_ids))
+        if not project_ids:
+            return self.all()
+        trackers = self.filter(statuses__project=project_ids[0])
+        for project_id in project_ids[1:]:
+            trackers = trackers.filter(
+                project_signature__contains=',%d,' % project_id)
+        return trackers
+
+class Tracker(DirtyFieldsMixin, Versioned, Todo):
     prototype = models.ForeignKey(ProtoTracker, related_name='trackers',
                                   null=True, blank=True)
     parent = models.ForeignKey('self', related_name='children', null=True,
                                blank=True)
-    summary = models.CharField(max_length=200)
+    summary = models.CharField(max_length=200, db_index=True)
     locale = models.ForeignKey(Locale, related_name='trackers', null=True,
                                blank=True)
     projects = models.ManyToManyField(Project, related_name='trackers',
@@ -77,8 +194,16 @@ class Tracker(Todo):
     alias = models.SlugField(max_length=200, null=True, blank=True)
     # a cached string representation of the tracker
     _repr = models.CharField(max_length=250, blank=True)
+    # a canonical signature of the set of the projects the tracker is related
+    # to (see `get_project_signature`), kept up-to-date by `assign_to_projects`
+    # and when TrackerInProject objects are saved or deleted; it's not limited
+    # in length, so it's not indexed -- the MD5 digest of it is (see
+    # `get_project_digest`)
+    project_signature = models.TextField(blank=True, editable=False)
+    project_digest = models.CharField(max_length=32, blank=True,
+                                      db_index=True, editable=False)
 
-    objects = StatusManager()
+    objects = TrackerManager()
 
     class Meta:
         app_label = 'todo'
@@ -124,9 +249,24 @@ class Tracker(Todo):
         super(Tracker, self).save(*args, **kwargs)
 
     def assign_to_projects(self, projects, status=NEW):
+        project_ids = parse_project_signature(self.project_signature)
         for project in projects:
-            TrackerInProject.objects.create(tracker=self, project=project,
-                                            status=status)
+            status_obj = TrackerInProject(tracker=self, project=project,
+                                          status=status)
+            # the signature is updated once for all projects below
+            status_obj._skip_signature = True
+            status_obj.save()
+            project_ids.add(project.pk)
+        signature = get_project_signature(project_ids)
+        if signature != self.project_signature:
+            self.project_signature = signature
+            self.project_digest = get_project_digest(signature)
+            # store only the signature, don't save the whole object
+            Tracker.objects.filter(pk=self.pk).update(
+                project_signature=signature,
+                project_digest=self.project_digest)
+            self._saved_values['project_signature'] = signature
+            self._saved_values['project_digest'] = self.project_digest
     
     @property
     def code(self):
@@ -51,6 +51,23 @@ todo_updated = django.dispatch.Signal(providing_args=[
     'action',
 ])
 
+# Signal used by `spawn` in todo.models.proto.  It is sent once a whole tree of
+# todo objects has been created from a prototype, with the top-most spawned
+# object as the sender.
+todo_spawned = django.dispatch.Signal(providing_args=[
+    'user',
+])
+
+# Signal used by `bulk_update` in todo.views.api.  It is sent once for many
+# todo objects of the same model which have been updated in the same way, with
+# the model as the sender.  The receivers of `todo_updated` are expected to
+# handle it too, preferably in batches.
+todos_updated = django.dispatch.Signal(providing_args=[
+    'user',
+    'todos',
+    'flag',
+])
+
 def receiver(signal, **kwargs):
     """A decorator for connecting receivers to signals. 
     
@@ -0,0 +1,583 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Mozilla todo app.
+#
+# The Initial Developer of the Original Code is
+# Mozilla Foundation.
+# Portions created by the Initial Developer are Copyright (C) 2010
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#   Stas Malolepszy <stas@mozilla.com>
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+"""Tests of the todo app.
+
+Most of them are query-count regression tests: every view in todo.urls and
+the main workflows (spawn, activate, resolve) are run on the same small
+synthetic dataset (see todo.benchmark.generate_data) and the number of their
+queries is compared with a budget recorded in query_budgets.json.  A test
+fails when the count goes over its budget, or when it has no budget.
+
+To record the budgets of new tests, or to re-record all of them on purpose
+(e.g. after an optimization, or after adding queries deliberately), run the
+tests with TODO_RECORD_BUDGETS=1 and commit query_budgets.json.  The file is
+only written in this mode.  Set TODO_RECORD_SQL=1 as well to store the
+normalized SQL of the queries, which is then shown as a diff when a budget is
+exceeded.
+
+The budgets assume that the tree and matrix caches are disabled (the
+default).
+
+"""
+
+from django.conf.urls.defaults import patterns, include, url
+from django.db import connection, DatabaseError
+from django.db.models.signals import pre_save, post_save
+from django.test import TestCase
+
+from todo.benchmark import (count_queries, generate_data, get_data,
+                            resolve_task_steps)
+from todo.workflow import NEW, ACTIVE, NEXT, RESOLVED
+
+import difflib
+import os
+import re
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+BUDGETS_FILE = os.path.join(os.path.dirname(__file__), 'query_budgets.json')
+RECORD = bool(os.environ.get('TODO_RECORD_BUDGETS'))
+RECORD_SQL = bool(os.environ.get('TODO_RECORD_SQL'))
+
+def _load_budgets():
+    if not os.path.exists(BUDGETS_FILE):
+        return {}
+    return json.load(open(BUDGETS_FILE))
+
+_budgets = _load_budgets()
+
+def _save_budgets():
+    output = open(BUDGETS_FILE, 'w')
+    json.dump(_budgets, output, indent=2, sort_keys=True,
+              separators=(',', ': '))
+    output.write('\n')
+    output.close()
+
+# The demo templates link to the `static` URL of the app using todo (see 
+# README.rst); the tests use todo.urls along with a stand-in for it.
+urlpatterns = patterns('',
+    (r'', include('todo.urls')),
+    url(r'^static/(?P<path>.*)$', 'django.views.static.serve', name='static'),
+)
+
+def normalize_sql(sql):
+    "Replace the literals in the SQL with placeholders."
+    sql = re.sub(r"'[^']*'", '%s', sql)
+    sql = re.sub(r'\b\d+\b', '%s', sql)
+    return ' '.join(sql.split())
+
+class QueryBudgetTestCase(TestCase):
+    urls = 'todo.tests'
+
+    def setUp(self):
+        generate_data(locales=2, projects=2, depth=2, fanout=2, steps=2,
+                      trees=1, resolved=0.5, seed=0)
+        self.data = get_data()
+        user = self.data['user']
+        user.is_superuser = True
+        user.set_password('test')
+        user.save()
+        self.client.login(username=user.username, password='test')
+
+    def assertWithinBudget(self, name, func, *args, **kwargs):
+        """Call the function and check the number of its queries against the 
+        budget recorded under the given name."""
+        result, queries = count_queries(func, *args, **kwargs)
+        if RECORD:
+            entry = {'queries': len(queries)}
+            if RECORD_SQL:
+                entry['sql'] = [normalize_sql(sql) for sql in queries]
+            _budgets[name] = entry
+            _save_budgets()
+            return result
+        budget = _budgets.get(name)
+        if budget is None:
+            self.fail('%s has no query budget; run the tests with '
+                      'TODO_RECORD_BUDGETS=1 to record it.' % name)
+        if len(queries) > budget['queries']:
+            message = ('%s ran %d queries, over its budget of %d.' % 
+                       (name, len(queries), budget['queries']))
+            if 'sql' in budget:
+                diff = difflib.unified_diff(
+                    budget['sql'], [normalize_sql(sql) for sql in queries],
+                    'budget', 'now', lineterm='')
+                message = '\n'.join([message] + list(diff))
+            self.fail(message)
+        return result
+
+    def get(self, url, data={}):
+        # the content is read in the counted function, so that the queries of 
+        # the streamed responses are counted too
+        response = self.client.get(url, data)
+        response.content
+        return response
+
+    def post(self, url, data={}, **extra):
+        response = self.client.post(url, data, **extra)
+        response.content
+        return response
+
+    def assertView(self, name, method, url, data={}, status=200, **extra):
+        response = self.assertWithinBudget('view:%s' % name, method, url, 
+                                           data, **extra)
+        self.assertEqual(response.status_code, status)
+
+    # demo views
+
+    def test_demo_task(self):
+        self.assertView('demo.task', self.get, 
+                        '/demo/task/%d' % self.data['task'].pk)
+
+    def test_demo_showcases(self):
+        pair = '%d:%s' % (self.data['project'].pk, self.data['locale'].code)
+        self.assertView('demo.showcases', self.get, '/demo/showcases',
+                        {'pair': pair})
+
+    # The demo `showcase` view looks the project up by the code of the app's 
+    # own project model, which todo.models.Project doesn't have.
+
+    def test_demo_tracker(self):
+        self.assertView('demo.tracker', self.get,
+                        '/demo/tracker/%d' % self.data['tracker'].pk)
+
+    def test_demo_subtree(self):
+        self.assertView('demo.subtree', self.get,
+                        '/demo/tracker/%d/subtree' % self.data['tracker'].pk)
+
+    def test_demo_trackers(self):
+        self.assertView('demo.trackers', self.get, '/demo/trackers',
+                        {'locale': self.data['locale'].code})
+
+    def test_demo_trackers_stream(self):
+        self.assertView('demo.trackers_stream', self.get,
+                        '/demo/trackers/stream',
+                        {'locale': self.data['locale'].code})
+
+    def test_demo_new_todo(self):
+        self.assertView('demo.new_todo', self.get, '/demo/new-todo')
+
+    # create-new wizard
+
+    def test_new(self):
+        self.assertView('new', self.get, '/new/')
+
+    def test_new_created(self):
+        self.assertView('new.created', self.get, '/new/created')
+
+    # actions
+
+    def test_resolve_task(self):
+        self.assertView('action.resolve_task', self.post,
+                        '/action/resolve/task/%d' % self.data['task'].pk,
+                        {'redirect_url': '/', 
+                         'project_id': self.data['project'].pk},
+                        status=302)
+
+    def test_resolve_step(self):
+        step = self.data['task'].steps.filter(status=NEXT)[0]
+        data = {'redirect_url': '/'}
+        if step.is_review:
+            data['success'] = 'on'
+        self.assertView('action.resolve_step', self.post,
+                        '/action/resolve/step/%d' % step.pk, data, 
+                        status=302)
+
+    # API
+
+    def test_api_reset_time(self):
+        step = self.data['task'].steps.filter(status=NEXT)[0]
+        self.assertView('api.reset_time', self.post,
+                        '/api/step/%d/reset-time' % step.pk)
+
+    def test_api_update_snapshot(self):
+        self.assertView('api.update_snapshot', self.post,
+                        '/api/task/%d/update-snapshot' % self.data['task'].pk,
+                        {'snapshot_ts': '2010-01-01T00:00:00Z'})
+
+    def test_api_update_bugid(self):
+        self.assertView('api.update_bugid', self.post,
+                        '/api/task/%d/update-bugid' % self.data['task'].pk,
+                        {'bugid': '123456'})
+
+    def test_api_update_task(self):
+        self.assertView('api.update_task', self.post,
+                        '/api/task/%d/update' % self.data['task'].pk,
+                        {'summary': 'Updated', 'bug': '123456'})
+
+    def test_api_update_tracker(self):
+        self.assertView('api.update_tracker', self.post,
+                        '/api/tracker/%d/update' % self.data['tracker'].pk,
+                        {'summary': 'Updated', 'bug': 'updated'})
+
+    def test_api_bulk_update(self):
+        tasks = self.data['tracker'].tasks.all()
+        trackers = self.data['tracker'].children.all()
+        changes = ([{'model': 'task', 'id': task.pk, 
+                     'fields': {'summary': 'Updated'}} for task in tasks] +
+                   [{'model': 'tracker', 'id': tracker.pk,
+                     'fields': {'summary': 'Updated'}} 
+                    for tracker in trackers])
+        self.assertView('api.bulk_update', self.post, '/api/bulk-update',
+                        json.dumps(changes), content_type='application/json')
+
+    def test_api_task_list(self):
+        self.assertView('api.task_list', self.get, '/api/tasks',
+                        {'project': self.data['project'].pk, 'limit': 10})
+
+    def test_api_step_list(self):
+        self.assertView('api.step_list', self.get, '/api/steps',
+                        {'task': self.data['task'].pk, 'limit': 10})
+
+    def test_api_filter_tree(self):
+        self.assertView('api.filter_tree', self.get, '/api/tree/filter',
+                        {'tracker': self.data['tracker'].pk})
+
+    def test_api_cache_stats(self):
+        self.assertView('api.cache_stats', self.get, '/api/tree/cache-stats')
+
+    def test_api_matrix(self):
+        self.assertView('api.matrix', self.get, '/api/matrix')
+
+    def test_api_autocomplete_trackers(self):
+        self.assertView('api.autocomplete_trackers', self.get,
+                        '/api/autocomplete/trackers',
+                        {'q': 'bench', 'project': self.data['project'].pk,
+                         'locale': self.data['locale'].code})
+
+    def test_api_autocomplete_prototypes(self):
+        self.assertView('api.autocomplete_prototypes', self.get,
+                        '/api/autocomplete/prototypes',
+                        {'q': 'bench', 'type': 'tracker'})
+
+    # workflows
+
+    def test_spawn(self):
+        proto = self.data['proto']
+        self.assertWithinBudget('workflow:spawn', proto.spawn, 
+                                self.data['user'], 
+                                locale=self.data['locale'],
+                                projects=[self.data['project']])
+
+    def test_spawn_per_locale(self):
+        proto = self.data['proto']
+        self.assertWithinBudget('workflow:spawn_per_locale', 
+                                lambda: list(proto.spawn_per_locale(
+                                    self.data['user'], 
+                                    locales=self.data['locales'],
+                                    projects=[self.data['project']])))
+
+    def test_activate(self):
+        tracker = self.data['proto'].spawn(self.data['user'], activate=False,
+                                           locale=self.data['locale'],
+                                           projects=[self.data['project']])
+        self.assertWithinBudget('workflow:activate', tracker.activate,
+                                self.data['user'])
+
+    def test_resolve_task_workflow(self):
+        self.assertWithinBudget('workflow:task.resolve',
+                                self.data['task'].resolve, self.data['user'],
+                                self.data['project'])
+
+    def test_resolve_steps_workflow(self):
+        self.assertWithinBudget('workflow:step.resolve', resolve_task_steps,
+                                self.data)
+
+class TaskCounterTestCase(TestCase):
+    def setUp(self):
+        generate_data(locales=2, projects=2, depth=1, fanout=2, steps=1,
+                      trees=1, resolved=0.5, seed=0)
+        self.data = get_data()
+
+    def create_project(self):
+        from todo.models import Project
+        return Project.objects.create(
+            label='bench-new', model_ct_id=self.data['project'].model_ct_id)
+
+    def assertCountersUpToDate(self):
+        from todo.models import TaskCounter
+        fields = ('project', 'locale', 'total', 'open', 'resolved')
+        counters = sorted(row for row in
+                          TaskCounter.objects.values_list(*fields)
+                          if any(row[2:]))
+        TaskCounter.objects.rebuild()
+        self.assertEqual(counters,
+                         sorted(TaskCounter.objects.values_list(*fields)))
+
+    def test_status_changed(self):
+        # e.g. in the admin
+        status = self.data['task'].statuses.all()[0]
+        status.status = RESOLVED if status.status != RESOLVED else ACTIVE
+        status.save()
+        self.assertCountersUpToDate()
+
+    def test_project_changed(self):
+        status = self.data['task'].statuses.all()[0]
+        status.project = self.create_project()
+        status.save()
+        self.assertCountersUpToDate()
+
+    def test_status_added_and_deleted(self):
+        from todo.models import TaskInProject
+        TaskInProject.objects.create(task=self.data['task'],
+                                     project=self.create_project(),
+                                     status=NEW)
+        self.assertCountersUpToDate()
+        self.data['task'].statuses.all()[0].delete()
+        self.assertCountersUpToDate()
+
+    def test_locale_changed(self):
+        task = self.data['task']
+        task.locale = [locale for locale in self.data['locales']
+                       if locale != task.locale][0]
+        task.save()
+        self.assertCountersUpToDate()
+
+    def test_workflows(self):
+        task = self.data['task']
+        task.activate(self.data['user'])
+        self.assertCountersUpToDate()
+        task.resolve(self.data['user'], self.data['project'])
+        self.assertCountersUpToDate()
+
+class DirtyFieldsTestCase(TestCase):
+    def setUp(self):
+        generate_data(locales=1, projects=1, depth=1, fanout=1, steps=1,
+                      trees=1, resolved=0, seed=0)
+        self.task_id = get_data()['task'].pk
+        self.task = self.get_task()
+        self.signals = []
+        pre_save.connect(self.record_signal, sender=type(self.task))
+        post_save.connect(self.record_signal, sender=type(self.task))
+
+    def tearDown(self):
+        pre_save.disconnect(self.record_signal, sender=type(self.task))
+        post_save.disconnect(self.record_signal, sender=type(self.task))
+
+    def get_task(self):
+        from todo.models import Task
+        return Task.objects.get(pk=self.task_id)
+
+    def record_signal(self, signal, **kwargs):
+        self.signals.append((signal, kwargs.get('created')))
+
+    def test_unchanged(self):
+        result, queries = count_queries(self.task.save)
+        self.assertEqual(queries, [])
+        self.assertEqual(self.signals, [(pre_save, None), 
+                                        (post_save, False)])
+
+    def test_changed(self):
+        qn = connection.ops.quote_name
+        self.task.summary = 'changed'
+        result, queries = count_queries(self.task.save)
+        # the other queries bump the versions
+        self.assert_(queries[0].startswith('UPDATE'))
+        self.assert_(qn('summary') in queries[0])
+        self.assert_(qn('version') not in queries[0])
+        self.assertEqual(self.get_task().summary, 'changed')
+        self.assertEqual(self.signals, [(pre_save, None), 
+                                        (post_save, False)])
+        # the saved values are recorded again
+        result, queries = count_queries(self.task.save)
+        self.assertEqual(queries, [])
+
+    def test_stale_version(self):
+        from todo.models.base import bump_versions
+        version = self.task.version
+        bump_versions(type(self.task), [self.task.pk])
+        self.task.summary = 'changed'
+        self.task.save()
+        # bumped once more by the save
+        self.assertEqual(self.get_task().version, version + 2)
+
+    def test_force_update(self):
+        self.task.summary = 'changed'
+        result, queries = count_queries(self.task.save, force_update=True)
+        self.assert_(queries[0].startswith('UPDATE'))
+        self.assert_(connection.ops.quote_name('version') not in queries[0])
+        self.assertEqual(self.get_task().summary, 'changed')
+        type(self.task).objects.filter(pk=self.task.pk).delete()
+        self.task.summary = 'changed again'
+        self.assertRaises(DatabaseError, self.task.save, force_update=True)
+
+    def test_deleted(self):
+        type(self.task).objects.filter(pk=self.task.pk).delete()
+        self.signals = []
+        self.task.summary = 'changed'
+        self.task.save()
+        self.assertEqual(self.get_task().summary, 'changed')
+        self.assertEqual(self.signals, [(pre_save, None), 
+                                        (post_save, True)])
+
+class TrackerSignatureTestCase(TestCase):
+    def setUp(self):
+        from todo.models import Project, Tracker
+        self.projects = [Project.objects.create(label='bench-%d' % i, 
+                                                model_ct_id=1)
+                         for i in range(3)]
+        self.tracker = Tracker.objects.create(summary='bench tracker')
+
+    def assertProjects(self, projects):
+        from todo.models import Tracker
+        from todo.models.tracker import parse_project_signature
+        tracker = Tracker.objects.get(pk=self.tracker.pk)
+        self.assertEqual(parse_project_signature(tracker.project_signature),
+                         set(project.pk for project in projects))
+        self.assertEqual(list(Tracker.objects.for_projects(projects)),
+                         [tracker])
+        for project in projects:
+            self.assert_(tracker in 
+                         Tracker.objects.for_projects([project], exact=False))
+
+    def test_saved_and_deleted(self):
+        from todo.models import TrackerInProject
+        first, second, third = self.projects
+        status = TrackerInProject.objects.create(tracker=self.tracker,
+                                                 project=first)
+        self.assertProjects([first])
+        TrackerInProject.objects.create(tracker=self.tracker, project=second)
+        self.assertProjects([first, second])
+        status.project = third
+        status.save()
+        self.assertProjects([second, third])
+        status.delete()
+        self.assertProjects([second])
+        self.tracker.statuses.all().delete()
+        self.assertProjects([])
+
+    def test_unsigned(self):
+        # e.g. in a database which has just been upgraded
+        from life.models import Locale
+        from todo.forms.new import get_possible_parents
+        from todo.management import backfill_project_signatures
+        from todo.models import Tracker, TrackerInProject
+        generic = Tracker.objects.create(summary='bench generic')
+        TrackerInProject.objects.create(tracker=self.tracker,
+                                        project=self.projects[0])
+        Tracker.objects.filter(pk=self.tracker.pk).update(
+            project_signature='', project_digest='')
+        locale = Locale.objects.create(code='bench-unsigned')
+        parents = get_possible_parents(self.projects[1:2], [locale])
+        self.assertEqual(list(parents), [generic])
+        backfill_project_signatures(sender=None, verbosity=0)
+        self.assertProjects(self.projects[:1])
+
+    def test_many_projects(self):
+        from todo.models import Project
+        projects = self.projects + [
+            Project.objects.create(label='bench-%d' % i, model_ct_id=1)
+            for i in range(3, 100)]
+        self.tracker.assign_to_projects(projects)
+        self.assert_(len(self.tracker.project_signature) > 250)
+        self.assertProjects(projects)
+
+class VersionTestCase(TestCase):
+    def setUp(self):
+        generate_data(locales=1, projects=1, depth=2, fanout=1, steps=2,
+                      trees=1, resolved=0, seed=0)
+        self.task = get_data()['task']
+
+    def get_versions(self):
+        from todo.models import Task, Tracker
+        task = Task.objects.get(pk=self.task.pk)
+        return task.version, Tracker.objects.get(pk=task.parent_id).version
+
+    def assertBumped(self, func, bumped=True):
+        task_version, tracker_version = self.get_versions()
+        func()
+        expected = ((task_version + 1, tracker_version + 1) if bumped
+                    else (task_version, tracker_version))
+        self.assertEqual(self.get_versions(), expected)
+
+    def test_step_saved(self):
+        # e.g. in the admin
+        step = self.task.steps.all()[0]
+        self.assertBumped(step.save, bumped=False)
+        step.summary = 'changed'
+        self.assertBumped(step.save)
+
+    def test_step_deleted(self):
+        self.assertBumped(self.task.steps.all()[0].delete)
+
+    def test_status_saved(self):
+        status = self.task.statuses.all()[0]
+        status.resolution = 1
+        self.assertBumped(status.save)
+
+    def test_task_saved(self):
+        from todo.models import Task
+        task = Task.objects.get(pk=self.task.pk)
+        task.summary = 'changed'
+        self.assertBumped(task.save)
+
+class ReprsTestCase(TestCase):
+    def setUp(self):
+        generate_data(locales=1, projects=1, depth=1, fanout=1, steps=1,
+                      trees=1, resolved=0, seed=0)
+        self.task = get_data()['task']
+
+    def assertRefreshed(self, obj, facet, old, new):
+        from todo.models import Task, TaskFacet
+        version = Task.objects.get(pk=self.task.pk).version
+        obj.save()
+        self.assertEqual(Task.objects.get(pk=self.task.pk).version,
+                         version + 1)
+        values = TaskFacet.objects.filter(task=self.task, facet=facet)
+        values = values.values_list('value', flat=True)
+        self.assert_(new in values)
+        self.assert_(old not in values)
+
+    def test_actor_renamed(self):
+        actor = self.task.steps.filter(status=NEXT)[0].owner
+        old = actor.name
+        actor.name = 'renamed owner'
+        self.assertRefreshed(actor, 'next_steps_owners', old, actor.name)
+
+    def test_locale_renamed(self):
+        locale = self.task.locale
+        old = unicode(locale)
+        locale.code = 'renamed'
+        self.assertRefreshed(locale, 'locales', old, unicode(locale))
+
+    def test_project_renamed(self):
+        project = self.task.statuses.all()[0].project
+        old = unicode(project)
+        project.label = 'renamed'
+        self.assertRefreshed(project, 'projects', old, unicode(project))
@@ -51,6 +51,14 @@ api_patterns = patterns('todo.views.api',
      'todo-api-update-task'),
     (r'^tracker/(?P<obj_id>\d+)/update$', 'update', {'obj': 'tracker'},
      'todo-api-update-tracker'),
+    (r'^bulk-update$', 'bulk_update'),
+    (r'^tasks$', 'task_list'),
+    (r'^steps$', 'step_list'),
+    (r'^tree/filter$', 'filter_tree'),
+    (r'^tree/cache-stats$', 'cache_stats'),
+    (r'^matrix$', 'matrix'),
+    (r'^autocomplete/trackers$', 'autocomplete_trackers'),
+    (r'^autocomplete/prototypes$', 'autocomplete_prototypes'),
 )
 
 # the generic create-new wizard views;  apps implementing todo should provide 
@@ -65,8 +73,11 @@ new_patterns = patterns('',
 demo_patterns = patterns('todo.views.demo',
     (r'^task/(?P<task_id>\d+)$', 'task'),
     (r'^showcase$', 'showcase'),
+    (r'^showcases$', 'showcases'),
     (r'^tracker/(?P<tracker_id>\d+)$', 'tracker'),
+    (r'^tracker/(?P<tracker_id>\d+)/subtree$', 'subtree'),
     (r'^trackers$', 'trackers'),
+    (r'^trackers/stream$', 'trackers_stream'),
     (r'^new-todo$', 'new_todo'), 
 )
 
@@ -35,46 +35,36 @@
 #
 # ***** END LICENSE BLOCK *****
 
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_POST, require_GET
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
-from django.core.serializers import serialize
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db import transaction
 
-from todo.models import Step, Task, Tracker
+from todo.models import (Step, Task, Tracker, Project, TaskFacet,
+                         TaskCounter)
 from todo.models.action import SNAPSHOT_UPDATED, BUGID_UPDATED
+from todo.models.facet import FACETS, TRACKER_IDS
+from todo.models.tracker import get_tracker_chains
 from todo.forms import UpdateTodoForm
+from todo.views.serializers import get_fields, serialize_todo, serialize_todos
+from todo.workflow import NEXT, STATUS_CHOICES
+from todo.cache import tree_cache, matrix_cache, MATRIX_CACHE_TIMEOUT
+from todo.bugzilla import BzAPI
 
-import urllib2
 from datetime import datetime
 try:
     import json
 except ImportError:
     from django.utils import simplejson as json
 
-class BzAPI(object):
-    _baseurl = "https://api-dev.bugzilla.mozilla.org/latest/"
-    time_format = r'%Y-%m-%dT%H:%M:%SZ'
-    
-    def __init__(self):
-        self._bugs = {}
-    
-    def last_modified(self, bugid):
-        if self._bugs.has_key(bugid):
-            return self._bugs[bugid]
-        req = urllib2.Request("%s/bug/%s" % (self._baseurl, bugid))
-        bugdata = json.load(urllib2.urlopen(req))
-        last_modified_time = datetime.strptime(bugdata['last_change_time'],
-                                               self.time_format)
-        self._bugs.update({bugid: last_modified_time})
-        return last_modified_time
-
 def _status_response(status, message, data=None):
     response = {'status': status,
                 'message': message,
                 'data': data}
-    return HttpResponse(json.dumps(response, indent=2, cls=DjangoJSONEncoder),
+    # compact encoding;  the responses are meant for scripts, not humans
+    return HttpResponse(json.dumps(response, separators=(',', ':'),
+                                   cls=DjangoJSONEncoder),
                         mimetype='application/javascript')
 
 @require_POST
@@ -103,7 +93,9 @@ def update(request, obj, obj_id):
 
     This method expects all the values to be in the `request.POST`. More 
     specifically, `todo.forms.UpdateTodoForm` defines which properties
-    are accepted and which are required.
+    are accepted and which are required.  The fields of the updated object
+    included in the response can be chosen with `fields` (see
+    todo.views.serializers).
 
     Arguments:
     obj -- the model of the todo object to be changed
@@ -114,6 +106,10 @@ def update(request, obj, obj_id):
         return _status_response('error', "You don't have permissions to "
                                 "update this %s." % obj)
     model = Task if obj == 'task' else Tracker
+    try:
+        fields = get_fields(obj, request.REQUEST.get('fields'))
+    except ValueError, e:
+        return _status_response('error', str(e))
     form = UpdateTodoForm(request.POST)
     if not form.is_valid():
         message = 'There were problems with the following fields:\n'
@@ -122,9 +118,147 @@ def update(request, obj, obj_id):
         return _status_response('error', message)
     todo = get_object_or_404(model, pk=obj_id)
     todo.update(request.user, form.cleaned_data)
-    changed_objs = serialize('python', (todo,))
+    changed_objs = serialize_todos((todo,), fields)
     return _status_response('ok', '%s updated.' % obj, changed_objs)
 
+# the fields which can be changed with `bulk_update` and the columns which
+# are written for each model
+BULK_FIELDS = {
+    'task': ('summary', 'bug', 'snapshot_ts'),
+    'tracker': ('summary', 'bug'),
+}
+BULK_COLUMNS = {
+    'task': ('summary', 'bugid', 'alias', '_repr', 'snapshot_ts'),
+    'tracker': ('summary', 'bugid', 'alias', '_repr'),
+}
+
+@require_POST
+@transaction.commit_on_success
+def bulk_update(request):
+    """Update properties of many tasks and trackers at once.
+
+    The body of the request is a JSON list of changes, each of them being an
+    object like this one:
+
+        {"model": "task", "id": 1, "fields": {"summary": "...", "bug": 123}}
+
+    The accepted fields are `summary` and `bug` (validated like in `update`
+    above) and, for tasks, `snapshot_ts` (like in `update_snapshot` below).
+    All targets are retrieved with one query per model and the changes are
+    saved and logged in batches, in a single transaction.  Invalid changes
+    are skipped; the response contains a result for every change, in order.
+    The fields of the updated objects included in the results can be chosen
+    with the `task_fields` and `tracker_fields` query arguments (see
+    todo.views.serializers).
+
+    """
+    from todo.db import bulk_update as save_in_bulk
+    from todo.models.action import UPDATED
+    from todo.signals import todos_updated
+
+    models = {'task': Task, 'tracker': Tracker}
+    try:
+        changes = json.loads(request.raw_post_data)
+    except ValueError:
+        return _status_response('error', 'The body is not valid JSON.')
+    if not isinstance(changes, list):
+        return _status_response('error', 'Pass a list of changes.')
+    try:
+        # e.g. task_fields=summary,snapshot_ts
+        fields_shown = dict(
+            (name, get_fields(name, request.GET.get('%s_fields' % name)))
+            for name in models)
+    except ValueError, e:
+        return _status_response('error', str(e))
+
+    results = []
+    # (result, model name, ID, fields) of the changes which passed the initial
+    # checks
+    valid = []
+    ids = dict((name, set()) for name in models)
+    for change in changes:
+        if not isinstance(change, dict):
+            change = {}
+        name, pk = change.get('model'), change.get('id')
+        fields = change.get('fields')
+        result = {'model': name, 'id': pk, 'status': 'error'}
+        results.append(result)
+        if name not in models:
+            result['message'] = 'Unknown model (%s).' % name
+        elif not request.user.has_perm('todo.change_%s' % name):
+            result['message'] = ("You don't have permissions to update this "
+                                 "%s." % name)
+        elif not isinstance(pk, int):
+            result['message'] = 'Incorrect ID (%s).' % pk
+        elif (not isinstance(fields, dict) or not fields or
+              not set(fields).issubset(BULK_FIELDS[name])):
+            result['message'] = ('Pass some of the following fields: %s.' %
+                                 ', '.join(BULK_FIELDS[name]))
+        else:
+            valid.append((result, name, pk, fields))
+            ids[name].add(pk)
+
+    todos = dict((name, models[name].objects.select_related('locale')
+                                            .in_bulk(list(ids[name])))
+                 for name in models if ids[name])
+    # the changed todo objects grouped by model and by the flag of the action
+    changed = {}
+    for result, name, pk, fields in valid:
+        todo = todos[name].get(pk)
+        if todo is None:
+            result['message'] = '%s %d not found.' % (name, pk)
+            continue
+        data = {'summary': todo.summary, 'bug': todo.bug or ''}
+        data.update((field, value) for field, value in fields.iteritems()
+                    if field in data)
+        form = UpdateTodoForm(data)
+        if not form.is_valid():
+            message = 'There were problems with the following fields:\n'
+            for field, errorlist in form.errors.iteritems():
+                message += '%s: %s' % (field, errorlist.as_text())
+            result['message'] = message
+            continue
+        snapshot_ts = None
+        if 'snapshot_ts' in fields:
+            try:
+                snapshot_ts = datetime.strptime(unicode(fields['snapshot_ts']),
+                                                BzAPI.time_format)
+            except ValueError:
+                result['message'] = ('Unknown timestamp (%s)' %
+                                     fields['snapshot_ts'])
+                continue
+            todo.snapshot_ts = snapshot_ts
+        if 'bug' in fields:
+            todo.bug = form.cleaned_data['bug']
+        if 'summary' in fields:
+            todo.summary = form.cleaned_data['summary']
+            todo.repr = todo.format_repr()
+        if set(fields) == set(['bug']):
+            flag = BUGID_UPDATED
+        elif set(fields) == set(['snapshot_ts']):
+            flag = SNAPSHOT_UPDATED
+        else:
+            flag = UPDATED
+        changed.setdefault((name, flag), set()).add(todo)
+        result.update({
+            'status': 'ok',
+            'message': '%s updated.' % name,
+            'data': serialize_todo(todo, fields_shown[name]),
+        })
+
+    for name in models:
+        objs = set()
+        for (model_name, flag), group in changed.iteritems():
+            if model_name == name:
+                objs.update(group)
+        save_in_bulk(models[name], objs, BULK_COLUMNS[name])
+    for (name, flag), group in changed.iteritems():
+        todos_updated.send(sender=models[name], user=request.user,
+                           todos=list(group), flag=flag)
+    updated = len([r for r in results if r['status'] == 'ok'])
+    return _status_response('ok', '%d of %d changes applied.' %
+                            (updated, len(results)), results)
+
 @require_POST
 @transaction.autocommit
 def update_snapshot(request, task_id):
@@ -161,3 +295,360 @@ def update_bugid(request, task_id):
     task = get_object_or_404(Task, pk=task_id)
     task.update(request.user, {'bug': new_bugid}, flag=BUGID_UPDATED)
     return _status_response('ok', 'Bug ID updated (%s)' % task.bugid)
+
+# the maximum number of objects returned by the list views at once
+MAX_PAGE_SIZE = 200
+
+def _get_page_args(request):
+    """Get the keyset pagination arguments of a list view.
+
+    Returns the ID after which the page starts and the size of the page.
+    Raises ValueError if the arguments are incorrect.
+
+    """
+    after = int(request.GET.get('after', 0))
+    limit = int(request.GET.get('limit', 50))
+    if after < 0 or limit < 1:
+        raise ValueError('Incorrect value of after or limit.')
+    return after, min(limit, MAX_PAGE_SIZE)
+
+@require_GET
+def filter_tree(request):
+    """Filter the tasks of a tracker tree using the facet index.
+
+    The scope of the tree is defined in the same way as in
+    `todo.views.snippets.tree`, with the following query arguments:
+
+        tracker -- the ID of a tracker; if given, project and locale are
+                   ignored
+        project -- the ID of a todo.models.Project
+        locale -- the code of a life.models.Locale
+
+    Additionally, the names of the facets (see `todo.models.facet.FACETS`) can
+    be passed (multiple times) to filter the tasks by the values of the
+    facets.  The results are paginated; pass `after` (the value of `next`
+    from the previous response) to get the next page and `limit` to change
+    the size of the page.  Pass `fields` to include the given fields of the
+    tasks in the results (see todo.views.serializers).
+
+    """
+    from life.models import Locale
+    tasks = Task.objects.all()
+    if 'tracker' in request.GET:
+        try:
+            tracker_id = int(request.GET['tracker'])
+        except ValueError:
+            return _status_response('error', 'Incorrect value of tracker.')
+        tracker = get_object_or_404(Tracker, pk=tracker_id)
+        tasks = tasks.filter(facets__facet=TRACKER_IDS,
+                             facets__value=unicode(tracker.pk))
+    else:
+        if 'project' not in request.GET and 'locale' not in request.GET:
+            return _status_response('error', 'Pass a tracker, a project '
+                                    'and/or a locale.')
+        if 'project' in request.GET:
+            try:
+                project_id = int(request.GET['project'])
+            except ValueError:
+                return _status_response('error', 'Incorrect value of '
+                                        'project.')
+            project = get_object_or_404(Project, pk=project_id)
+            tasks = tasks.filter(projects=project)
+        if 'locale' in request.GET:
+            locale = get_object_or_404(Locale, code=request.GET['locale'])
+            tasks = tasks.filter(locale=locale)
+    criteria = dict((facet, request.GET.getlist(facet)) for facet in FACETS
+                    if facet in request.GET)
+    try:
+        after, limit = _get_page_args(request)
+    except ValueError, e:
+        return _status_response('error', str(e))
+    fields = None
+    if request.GET.get('fields'):
+        try:
+            fields = get_fields('task', request.GET['fields'])
+        except ValueError, e:
+            return _status_response('error', str(e))
+
+    page, counts, cursor = TaskFacet.objects.search(tasks, criteria,
+                                                    after or None, limit)
+    chains = get_tracker_chains(set(task.parent_id for task in page
+                                    if task.parent_id is not None))
+    results = []
+    for task in page:
+        result = {'id': task.pk,
+                  'repr': task.repr,
+                  'path': [{'id': tracker.pk, 'summary': tracker.summary}
+                           for tracker in chains.get(task.parent_id, [])]}
+        if fields:
+            result['fields'] = serialize_todo(task, fields)['fields']
+        results.append(result)
+    data = {
+        'tasks': results,
+        'facets': counts,
+        'next': cursor,
+    }
+    return _status_response('ok', '%d tasks found.' % len(page), data)
+
+def _get_status(value):
+    "Get the status from its number or its name (see todo.workflow)."
+    for status, name in STATUS_CHOICES:
+        if value in (str(status), name):
+            return status
+    raise ValueError('Unknown status (%s).' % value)
+
+@require_GET
+def task_list(request):
+    """List the tasks, ordered by their IDs.
+
+    The tasks can be filtered with the following query arguments:
+
+        project -- the ID of a todo.models.Project
+        locale -- the code of a life.models.Locale
+        status -- the number or the name of a status (see todo.workflow); if
+                  project is given too, the status in that project
+        prototype -- the ID of a todo.models.ProtoTask
+        bug -- the ID or the alias of a bug
+        parent -- the ID of the parent tracker
+
+    Pass `after` (the value of `next` from the previous response) to get the
+    next page and `limit` (at most MAX_PAGE_SIZE) to change the size of the
+    page.  The fields of the tasks can be chosen with `fields` (see
+    todo.views.serializers).  The statuses of the tasks in their projects are
+    always included.  Each page is retrieved with two queries.
+
+    """
+    from todo.models import TaskInProject
+    try:
+        after, limit = _get_page_args(request)
+        fields = get_fields('task', request.GET.get('fields'))
+        tasks = Task.objects.all()
+        statuses = {}
+        if 'project' in request.GET:
+            statuses['statuses__project'] = int(request.GET['project'])
+        if 'status' in request.GET:
+            statuses['statuses__status'] = _get_status(request.GET['status'])
+        if statuses:
+            # in one `filter` call, so that both conditions apply to the same
+            # TaskInProject
+            tasks = tasks.filter(**statuses).distinct()
+        if 'locale' in request.GET:
+            tasks = tasks.filter(locale__code=request.GET['locale'])
+        if 'prototype' in request.GET:
+            tasks = tasks.filter(prototype=int(request.GET['prototype']))
+        if 'parent' in request.GET:
+            tasks = tasks.filter(parent=int(request.GET['parent']))
+        if 'bug' in request.GET:
+            bug = request.GET['bug']
+            if bug.isdigit():
+                tasks = tasks.filter(bugid=int(bug))
+            else:
+                tasks = tasks.filter(alias=bug)
+    except ValueError, e:
+        return _status_response('error', str(e))
+
+    page = list(tasks.filter(pk__gt=after).order_by('pk')[:limit])
+    task_statuses = {}
+    rows = (TaskInProject.objects.filter(task__in=[task.pk for task in page])
+                                 .values('task', 'project', 'status',
+                                         'resolution'))
+    for row in rows:
+        task_statuses.setdefault(row.pop('task'), []).append(row)
+    results = []
+    for task in page:
+        result = serialize_todo(task, fields)
+        result['statuses'] = task_statuses.get(task.pk, [])
+        results.append(result)
+    data = {
+        'tasks': results,
+        'next': page[-1].pk if len(page) == limit else None,
+    }
+    return _status_response('ok', '%d tasks found.' % len(page), data)
+
+@require_GET
+def step_list(request):
+    """List the steps, ordered by their IDs.
+
+    The steps can be filtered with the following query arguments:
+
+        task -- the ID of a todo.models.Task
+        owner -- the slug of a todo.models.Actor
+        status -- the number or the name of a status (see todo.workflow)
+        overdue -- if 1, only the next steps which are overdue are listed
+
+    The pagination and the choice of fields work like in `task_list` above.
+    Every step has an `overdue` flag.  Overdue steps can't be filtered in the
+    database, so when `overdue` is given, the steps are scanned in batches
+    and a page may be shorter than `limit` even if it's not the last one;
+    continue with `next` until it's null.
+
+    """
+    from todo.models.step import get_deadlines
+    try:
+        after, limit = _get_page_args(request)
+        fields = get_fields('step', request.GET.get('fields'))
+        steps = Step.objects.all()
+        if 'task' in request.GET:
+            steps = steps.filter(task=int(request.GET['task']))
+        if 'owner' in request.GET:
+            steps = steps.filter(owner__slug=request.GET['owner'])
+        if 'status' in request.GET:
+            steps = steps.filter(status=_get_status(request.GET['status']))
+    except ValueError, e:
+        return _status_response('error', str(e))
+    only_overdue = request.GET.get('overdue') == '1'
+    if only_overdue:
+        steps = steps.filter(status=NEXT)
+    steps = steps.order_by('pk')
+
+    now = datetime.now()
+    page = []
+    # the ID of the last scanned step
+    cursor = after
+    exhausted = False
+    # at most 5 batches are scanned, so that the number of queries is bounded
+    for i in xrange(5 if only_overdue else 1):
+        batch = list(steps.filter(pk__gt=cursor)[:limit])
+        deadlines = get_deadlines([(step.pk, step.allowed_time)
+                                   for step in batch if step.status == NEXT])
+        for step in batch:
+            cursor = step.pk
+            deadline = deadlines.get(step.pk)
+            step._overdue = deadline is not None and now > deadline
+            if not only_overdue or step._overdue:
+                page.append(step)
+            if len(page) == limit:
+                break
+        else:
+            # the whole batch has been scanned
+            if len(batch) < limit:
+                exhausted = True
+                break
+            continue
+        # the page is full
+        break
+
+    results = []
+    for step in page:
+        result = serialize_todo(step, fields)
+        result['overdue'] = step._overdue
+        results.append(result)
+    data = {
+        'steps': results,
+        'next': None if exhausted else cursor,
+    }
+    return _status_response('ok', '%d steps found.' % len(page), data)
+
+@require_GET
+def matrix(request):
+    """Get the completion of tasks for every project and locale.
+
+    Pass `project` (the ID of a todo.models.Project) and/or `locale` (the code
+    of a life.models.Locale), possibly multiple times, to limit the matrix to
+    the given projects and locales.  Each cell of the matrix has the same
+    counts as returned by `todo.models.Project.task_count`.
+
+    """
+    from life.models import Locale
+    try:
+        project_ids = sorted(set(int(p) for p in
+                                 request.GET.getlist('project'))) or None
+    except ValueError:
+        return _status_response('error', 'Incorrect value of project.')
+    locale_ids = None
+    if 'locale' in request.GET:
+        locale_ids = sorted(Locale.objects.filter(
+            code__in=request.GET.getlist('locale')).values_list('pk',
+                                                               flat=True))
+    if MATRIX_CACHE_TIMEOUT:
+        key = matrix_cache.get_key(project_ids, locale_ids)
+        cells = matrix_cache.get(key)
+        if cells is None:
+            cells = TaskCounter.objects.matrix(project_ids, locale_ids)
+            matrix_cache.set(key, cells)
+    else:
+        cells = TaskCounter.objects.matrix(project_ids, locale_ids)
+    return _status_response('ok', '%d cells found.' % len(cells), cells)
+
+MAX_AUTOCOMPLETE_RESULTS = 50
+
+def _autocomplete(request, queryset, fields, get_label):
+    """Search the queryset for objects whose fields start with the query.
+
+    The query is taken from `q`; if it's a number, the object with this ID is
+    returned first.  At most `limit` (20 by default, MAX_AUTOCOMPLETE_RESULTS
+    at most) results are returned.
+
+    The fields, which should be indexed, are searched one after another, each
+    with a single query ordered by the field, until there are enough results.
+    The match is case-sensitive (a plain LIKE 'query%'), so that the indexes
+    can be used; on PostgreSQL, they need to be created with 
+    varchar_pattern_ops unless the database uses the C locale.
+
+    """
+    q = request.GET.get('q', '').strip()
+    try:
+        limit = min(int(request.GET.get('limit', 20)),
+                    MAX_AUTOCOMPLETE_RESULTS)
+    except ValueError:
+        return _status_response('error', 'Incorrect value of limit.')
+    if not q or limit < 1:
+        return _status_response('ok', '0 results found.', [])
+    results = []
+    if q.isdigit():
+        results.extend(queryset.filter(pk=int(q)))
+    for field in fields:
+        if len(results) >= limit:
+            break
+        matches = (queryset.filter(**{'%s__startswith' % field: q})
+                           .exclude(pk__in=[obj.pk for obj in results])
+                           .order_by(field, 'pk'))
+        results.extend(matches[:limit - len(results)])
+    data = [{'id': obj.pk, 'label': get_label(obj)} for obj in results]
+    return _status_response('ok', '%d results found.' % len(data), data)
+
+@require_GET
+def autocomplete_trackers(request):
+    """Search the trackers which can be parents of new todo objects.
+
+    Pass the query in `q`, which is matched against the beginning of the
+    summaries and then the aliases of the trackers (case-sensitively), as
+    well as against their IDs.
+    Pass `project` (the ID of a todo.models.Project), possibly multiple times,
+    and `locale` (the code of a life.models.Locale) to search the trackers
+    offered by ChooseParentForm for these projects and locale.
+
+    """
+    from life.models import Locale
+    from todo.forms.new import get_possible_parents, tracker_label
+    try:
+        project_ids = set(int(p) for p in request.GET.getlist('project'))
+    except ValueError:
+        return _status_response('error', 'Incorrect value of project.')
+    locales = list(Locale.objects.filter(code=request.GET.get('locale')))
+    trackers = get_possible_parents(project_ids, locales)
+    return _autocomplete(request, trackers, ('summary', 'alias'),
+                         tracker_label)
+
+@require_GET
+def autocomplete_prototypes(request):
+    """Search the prototypes of trackers or tasks.
+
+    Pass the query in `q`, which is matched against the beginning of the
+    summaries of the prototypes (case-sensitively), as well as against their
+    IDs, and `type` (either 'tracker' or 'task'; 'task' by default).
+
+    """
+    from todo.models import ProtoTask, ProtoTracker
+    from todo.forms.new import proto_label
+    model = (ProtoTracker if request.GET.get('type') == 'tracker'
+             else ProtoTask)
+    return _autocomplete(request, model.objects.all(), ('summary',),
+                         proto_label)
+
+@require_GET
+def cache_stats(request):
+    "Get the hit and miss counters of the caches of trees and matrices."
+    stats = tree_cache.stats()
+    stats.update(matrix_cache.stats())
+    return _status_response('ok', 'Cache counters.', stats)
@@ -0,0 +1,128 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Mozilla todo app.
+#
+# The Initial Developer of the Original Code is
+# Mozilla Foundation.
+# Portions created by the Initial Developer are Copyright (C) 2010
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#   Stas Malolepszy <stas@mozilla.com>
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+"""Functions for conditional GET support in views displaying todo objects.
+
+They're meant to be used with `django.views.decorators.http.condition` on
+views which take the ID of a task or a tracker as the only argument:
+
+    @condition(etag_func=task_etag, last_modified_func=task_last_modified)
+    def task(request, task_id):
+        ...
+
+See todo.views.demo for examples.  Only the version stamps of the todo
+objects are queried (see todo.models.base.Versioned), so answering with
+304 Not Modified is much cheaper than rendering the page.
+
+"""
+
+from django.utils.hashcompat import md5_constructor
+
+from todo.workflow import NEXT
+
+from datetime import datetime
+
+# permissions that change the markup of the task and tracker pages
+PAGE_PERMS = ('todo.change_tracker', 'todo.change_task', 'todo.change_step')
+
+def _get_etag(request, kind, pk, *stamps):
+    perms = [perm for perm in PAGE_PERMS if request.user.has_perm(perm)]
+    key = '%s:%s:%s:%s' % (kind, pk, ':'.join([str(s) for s in stamps]),
+                           ','.join(perms))
+    return md5_constructor(key).hexdigest()
+
+def task_state(request, task_id):
+    """Get the ETag and the last modification time of a task page.
+
+    Besides the version of the task, the steps which have become overdue
+    since the last change are taken into account, as they're displayed
+    differently.  Returns (None, None) if the task doesn't exist.
+
+    """
+    from todo.models import Task, Step
+    from todo.models.step import get_deadlines
+
+    cache = request.__dict__.setdefault('_todo_states', {})
+    if ('task', task_id) not in cache:
+        stamps = list(Task.objects.filter(pk=task_id)
+                                  .values_list('version', 'modified_ts'))
+        if not stamps:
+            cache[('task', task_id)] = None, None
+        else:
+            version, modified_ts = stamps[0]
+            next_steps = (Step.objects.filter(task=task_id, status=NEXT)
+                                      .values_list('pk', 'allowed_time'))
+            now = datetime.now()
+            passed = [deadline for deadline
+                      in get_deadlines(list(next_steps)).itervalues()
+                      if deadline <= now]
+            last_modified = max([modified_ts] + passed)
+            etag = _get_etag(request, 'task', task_id, version, len(passed))
+            cache[('task', task_id)] = etag, last_modified
+    return cache[('task', task_id)]
+
+def tracker_state(request, tracker_id):
+    """Get the ETag and the last modification time of a tracker page.
+
+    Returns (None, None) if the tracker doesn't exist.
+
+    """
+    from todo.models import Tracker
+
+    cache = request.__dict__.setdefault('_todo_states', {})
+    if ('tracker', tracker_id) not in cache:
+        stamps = list(Tracker.objects.filter(pk=tracker_id)
+                                     .values_list('version', 'modified_ts'))
+        if not stamps:
+            cache[('tracker', tracker_id)] = None, None
+        else:
+            version, modified_ts = stamps[0]
+            etag = _get_etag(request, 'tracker', tracker_id, version)
+            cache[('tracker', tracker_id)] = etag, modified_ts
+    return cache[('tracker', tracker_id)]
+
+def task_etag(request, task_id, *args, **kwargs):
+    return task_state(request, task_id)[0]
+
+def task_last_modified(request, task_id, *args, **kwargs):
+    return task_state(request, task_id)[1]
+
+def tracker_etag(request, tracker_id, *args, **kwargs):
+    return tracker_state(request, tracker_id)[0]
+
+def tracker_last_modified(request, tracker_id, *args, **kwargs):
+    return tracker_state(request, tracker_id)[1]
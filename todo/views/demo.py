@@ -36,11 +36,16 @@
 # ***** END LICENSE BLOCK *****
 
 from django.shortcuts import get_object_or_404, render_to_response
+from django.http import HttpResponse
 from django.utils.safestring import mark_safe
+from django.views.decorators.http import condition
 
 from todo.views import snippets
 from todo.views import new as create_new_wizard
+from todo.views.conditional import (task_etag, task_last_modified,
+                                    tracker_etag, tracker_last_modified)
 
+@condition(etag_func=task_etag, last_modified_func=task_last_modified)
 def task(request, task_id):
     from todo.models import Task
     task = get_object_or_404(Task, pk=task_id)
@@ -62,6 +67,22 @@ def showcase(request):
     return render_to_response('todo/demo_showcase.html',
                               {'open_tasks': open_tasks,})
 
+def showcases(request):
+    from todo.models import Project
+    from life.models import Locale
+    # pairs are passed as `pair=<project ID>:<locale code>` query args
+    pairs = []
+    for pair in request.GET.getlist('pair'):
+        project_id, sep, locale_code = pair.partition(':')
+        project = get_object_or_404(Project, pk=project_id)
+        locale = get_object_or_404(Locale, code=locale_code)
+        pairs.append((project, locale))
+    showcases = snippets.showcases(request, pairs,
+                                   task_view='todo.views.demo.task')
+    return render_to_response('todo/demo_showcases.html',
+                              {'showcases': zip(pairs, showcases),})
+
+@condition(etag_func=tracker_etag, last_modified_func=tracker_last_modified)
 def tracker(request, tracker_id):
     from todo.models import Tracker
     tracker = get_object_or_404(Tracker, pk=tracker_id)
@@ -72,6 +93,19 @@ def tracker(request, tracker_id):
     return render_to_response('todo/demo_tree.html',
                               {'tree': tree,})
 
+def subtree(request, tracker_id):
+    from todo.models import Tracker
+    from todo.views.api import _status_response
+    tracker = get_object_or_404(Tracker, pk=tracker_id)
+    children = snippets.subtree(request, tracker,
+                                task_view='todo.views.demo.task',
+                                tracker_view='todo.views.demo.tracker',
+                                subtree_view='todo.views.demo.subtree')
+    if request.GET.get('format', None) == 'json':
+        return _status_response('ok', 'Subtree of tracker %d.' % tracker.pk,
+                                children['data'])
+    return HttpResponse(children['div'])
+
 def trackers(request):
     from todo.models import Project
     from life.models import Locale
@@ -83,13 +117,38 @@ def trackers(request):
         project = get_object_or_404(Project, code=request.GET['project'])
     if 'locale' in request.GET:
         locale = get_object_or_404(Locale, code=request.GET['locale'])
+    # project-wide trees can be huge;  render only the top-most levels
     tree = snippets.tree(request, tracker=None,
                          project=project, locale=locale,
                          task_view='todo.views.demo.task',
-                         tracker_view='todo.views.demo.tracker')
+                         tracker_view='todo.views.demo.tracker',
+                         lazy_depth=2,
+                         subtree_view='todo.views.demo.subtree')
     return render_to_response('todo/demo_tree.html',
                               {'tree': tree,})
 
+def trackers_stream(request):
+    from todo.models import Project
+    from life.models import Locale
+    if ('project' not in request.GET and
+        'locale' not in request.GET):
+        raise Exception("No project and/or locale passed as query args.")
+    project = locale = None
+    if 'project' in request.GET:
+        project = get_object_or_404(Project, code=request.GET['project'])
+    if 'locale' in request.GET:
+        locale = get_object_or_404(Locale, code=request.GET['locale'])
+    chunks = snippets.tree_stream(request, tracker=None,
+                                  project=project, locale=locale,
+                                  task_view='todo.views.demo.task',
+                                  tracker_view='todo.views.demo.tracker')
+    def page():
+        yield '<div class="todo">'
+        for chunk in chunks:
+            yield chunk
+        yield '</div>'
+    return HttpResponse(page())
+
 def new_todo(request):
     from todo.models import Project
     from life.models import Locale
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Mozilla todo app.
+#
+# The Initial Developer of the Original Code is
+# Mozilla Foundation.
+# Portions created by the Initial Developer are Copyright (C) 2010
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#   Stas Malolepszy <stas@mozilla.com>
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+from django.core.urlresolvers import reverse
+from django.utils.encoding import force_unicode
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from todo.workflow import RESOLVED, FAILED
+
+# an ID which is substituted with real IDs in the URLs built by `url_builder`
+_SENTINEL = '999999999'
+
+def url_builder(view):
+    """Get a function building URLs of the view for given IDs.
+
+    `reverse` is only called once, with a sentinel ID.  The returned function
+    replaces it with the real ID.  This only works for views which take
+    a single numeric positional argument, which is the case for all views
+    linked from the snippets.
+
+    """
+    url = reverse(view, args=[_SENTINEL])
+    prefix, suffix = url.rsplit(_SENTINEL, 1)
+    return lambda pk: u'%s%d%s' % (prefix, pk, suffix)
+
+class Renderer(object):
+    "Base class for renderers with lazily created URL builders."
+
+    def __init__(self, request):
+        self.user = request.user
+        self._builders = {}
+
+    def url(self, view, pk):
+        if view not in self._builders:
+            self._builders[view] = url_builder(view)
+        return self._builders[view](pk)
+
+class TreeRenderer(Renderer):
+    """Render the nodes of a tracker tree without the template engine.
+
+    The markup is the same as the one which used to be rendered by
+    `{% recurse %}` in todo/snippet_tree.html.  The tree is a structure of
+    dicts as returned by `todo.views.snippets._get_tree`.
+
+    """
+    def __init__(self, request, task_view, tracker_view, subtree_view=None):
+        super(TreeRenderer, self).__init__(request)
+        self.task_view = task_view
+        self.tracker_view = tracker_view
+        self.subtree_view = subtree_view
+        self.can_change_tracker = self.user.has_perm('todo.change_tracker')
+        self.can_change_task = self.user.has_perm('todo.change_task')
+
+    def render(self, tree):
+        return mark_safe(u''.join(self.iter_tree(tree)))
+
+    def iter_tree(self, tree):
+        "Yield the markup of the tree piece by piece."
+        for tracker, subtree in tree['trackers'].iteritems():
+            for piece in self.iter_tracker(tracker, subtree):
+                yield piece
+        yield u'<div class="tasks">'
+        for task, properties in tree['tasks'].iteritems():
+            yield self.task(task, properties)
+        yield u'</div>'
+
+    def iter_tracker(self, tracker, subtree):
+        bug = tracker.bug
+        yield (u'<div class="tracker"><div class="todo_obj summary">'
+               u'<span class="noneditable">'
+               u'<span class="replace-_repr">%s</span>%s</span>'
+               u'<span class="editable">'
+               u'<form action="%s" method="post">'
+               u'<input type="text" name="summary" data-default="%s"/>'
+               u'<input type="text" name="bug" data-default="%s"/>'
+               u'<input type="submit" value="OK"/> '
+               u'<span class="cancel">Cancel</span>'
+               u'</form></span>'
+               u'<a class="permalink" href="%s">#</a></div>' % (
+                   escape(tracker),
+                   (u'<small class="quickedit">✎</small>'
+                    if self.can_change_tracker else u''),
+                   self.url('todo-api-update-tracker', tracker.pk),
+                   escape(tracker.summary),
+                   escape(bug) if bug is not None else u'',
+                   self.url(self.tracker_view, tracker.pk)))
+        if 'lazy' in subtree:
+            yield self.lazy_children(tracker, subtree['lazy'])
+        else:
+            yield u'<div class="children">'
+            for piece in self.iter_tree(subtree):
+                yield piece
+            yield u'</div>'
+        yield u'</div>'
+
+    def lazy_children(self, tracker, summary):
+        expand = u''
+        if summary['trackers'] or summary['tasks']:
+            expand = (u'<span class="expand">▸ %d trackers, %d tasks '
+                      u'(%d%% done)</span>' % (summary['trackers'],
+                                               summary['tasks'],
+                                               summary['progress']))
+        return u'<div class="children lazy" data-url="%s">%s</div>' % (
+            self.url(self.subtree_view, tracker.pk), expand)
+
+    def task(self, task, properties):
+        resolved = task.is_resolved_all()
+        data = u''.join([u' data-%s="%s"' % (prop, u'|'.join(
+                             [escape(force_unicode(val)) for val in vals]))
+                         for prop, vals in properties.iteritems()])
+        url = self.url(self.task_view, task.pk)
+        if resolved:
+            return (u'<div class="todo_obj task resolved"%s>'
+                    u'<div class="summary">%s '
+                    u'<a class="permalink" href="%s">#</a></div></div>' % (
+                        data, escape(task), url))
+        bug = task.bug
+        next_steps = u''.join([u'<small class="next_step">%s: %s</small>' %
+                               (escape(step.owner_repr), escape(step))
+                               for step in task.next_steps])
+        return (u'<div class="todo_obj task"%s><span class="summary">'
+                u'<span class="noneditable">'
+                u'<a href="%s" class="replace-_repr">%s</a>%s</span>'
+                u'<span class="editable">'
+                u'<form action="%s" method="post">'
+                u'<input type="text" name="summary" data-default="%s"/>'
+                u'<input type="text" name="bug" data-default="%s"/>'
+                u'<input type="submit" value="OK"/> '
+                u'<span class="cancel">Cancel</span>'
+                u'</form></span></span>%s</div>' % (
+                    data, url, escape(task),
+                    (u'<span class="quickedit">✎</span>'
+                     if self.can_change_task else u''),
+                    self.url('todo-api-update-task', task.pk),
+                    escape(task.summary),
+                    escape(bug) if bug is not None else u'',
+                    next_steps))
+
+class StepsRenderer(Renderer):
+    """Render the tree of steps of a task without the template engine.
+
+    The markup is the same as the one which used to be rendered by
+    `{% recurse %}` in todo/snippet_task.html.
+
+    Arguments:
+        request -- the current request object
+        task -- the task whose steps are rendered
+        redirect_url -- the URL the forms redirect to after a POST
+        get_children -- a function returning the children of a step; by
+                        default, `children_all` is called on the step
+
+    """
+    def __init__(self, request, task, redirect_url, get_children=None):
+        super(StepsRenderer, self).__init__(request)
+        self.task = task
+        self.redirect_url = escape(redirect_url)
+        self.can_change_step = self.user.has_perm('todo.change_step')
+        self.get_children = get_children or (lambda s: s.children_all())
+
+    def render(self, steps):
+        return mark_safe(u''.join(self.iter_steps(steps)))
+
+    def iter_steps(self, steps):
+        task_resolved = self.task.is_resolved_all()
+        for step in steps:
+            has_children = step.has_children
+            overdue = step.is_overdue()
+            yield u'<div class="step %s%s%s">' % (
+                step.get_status_display(),
+                u' has_children' if has_children else u'',
+                u' overdue' if overdue else u'')
+            owner = (u'<em>%s:</em> ' % escape(step.owner_repr)
+                     if step.owner_repr else u'')
+            if (not task_resolved and step.is_next() and
+                self.can_change_step):
+                if not step.is_review:
+                    checkboxes = (u'<input type="checkbox" '
+                                  u'onclick="this.form.submit()"/>')
+                else:
+                    checkboxes = (u'<input type="checkbox" name="success" '
+                                  u'onclick="this.form.submit()"/>'
+                                  u'<input type="checkbox" name="failure" '
+                                  u'onclick="this.form.submit()"/>')
+                reset = u''
+                if overdue:
+                    reset = (u' <span class="quickedit" data-url="%s">'
+                             u'↺</span>' %
+                             self.url('todo.views.api.reset_time', step.pk))
+                yield (u'<form action="%s" method="post">'
+                       u'<input type="hidden" name="redirect_url" '
+                       u'value="%s"/>%s'
+                       u'<span class="summary">%s%s%s</span></form>' % (
+                           self.url('todo.views.actions.resolve_step',
+                                    step.pk),
+                           self.redirect_url, checkboxes, owner,
+                           escape(step), reset))
+            else:
+                if step.status == RESOLVED:
+                    checkbox = (u'<input type="checkbox" disabled="disabled" '
+                                u'checked="checked"/>')
+                else:
+                    checkbox = u'<input type="checkbox" disabled="disabled"/>'
+                failed = (u' <strong>(failed)</strong>'
+                          if step.resolution == FAILED else u'')
+                yield u'%s<span>%s%s%s</span>' % (checkbox, owner,
+                                                  escape(step), failed)
+            if has_children:
+                for piece in self.iter_steps(self.get_children(step)):
+                    yield piece
+            yield u'</div>'
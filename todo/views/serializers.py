@@ -0,0 +1,108 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Mozilla todo app.
+#
+# The Initial Developer of the Original Code is
+# Mozilla Foundation.
+# Portions created by the Initial Developer are Copyright (C) 2010
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#   Stas Malolepszy <stas@mozilla.com>
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+"""Serialization of todo objects for the JSON API.
+
+Only the fields listed in ALLOWED_FIELDS can be serialized; the clients can
+choose a subset of them with the `fields` query argument (a comma-separated
+list), otherwise DEFAULT_FIELDS are used.  The output has the same structure
+as the one of Django's `python` serializer, so the clients can use it in the
+same way:
+
+    {"model": "todo.task", "pk": 1, "fields": {"summary": "..."}}
+
+"""
+
+# the fields which can be requested by the clients
+ALLOWED_FIELDS = {
+    'task': ('summary', 'bugid', 'alias', '_repr', 'locale', 'parent',
+             'snapshot_ts', 'latest_resolution_ts', 'version'),
+    'tracker': ('summary', 'bugid', 'alias', '_repr', 'locale', 'parent',
+                'version'),
+    'step': ('summary', 'task', 'parent', 'owner_repr', 'order', 'status',
+             'resolution', 'allowed_time'),
+}
+# the fields serialized if the client doesn't ask for specific ones;  the
+# quick editor in todo/snippet_tree.html needs all of them for trackers and
+# tasks
+DEFAULT_FIELDS = {
+    'task': ('summary', 'bugid', 'alias', '_repr'),
+    'tracker': ('summary', 'bugid', 'alias', '_repr'),
+    'step': ('summary', 'owner_repr', 'status', 'resolution'),
+}
+
+# model fields, keyed by (model, field name)
+_model_fields = {}
+
+def get_fields(model_name, selection=None):
+    """Get the names of the fields to serialize.
+
+    Arguments:
+        model_name -- 'task', 'tracker' or 'step'
+        selection -- a comma-separated list of field names requested by the
+                     client; if empty, the defaults are used
+
+    Raises ValueError if any of the requested fields is not allowed.
+
+    """
+    if not selection:
+        return DEFAULT_FIELDS[model_name]
+    fields = tuple(field.strip() for field in selection.split(',')
+                   if field.strip())
+    not_allowed = [field for field in fields
+                   if field not in ALLOWED_FIELDS[model_name]]
+    if not_allowed:
+        raise ValueError('Unknown fields: %s.' % ', '.join(not_allowed))
+    return fields
+
+def serialize_todo(obj, fields):
+    "Serialize the fields of a todo object into a dict."
+    model = type(obj)
+    values = {}
+    for name in fields:
+        if (model, name) not in _model_fields:
+            _model_fields[(model, name)] = model._meta.get_field(name)
+        # foreign keys are serialized as IDs, without retrieving the objects
+        values[name] = _model_fields[(model, name)].value_from_object(obj)
+    return {
+        'model': unicode(obj._meta),
+        'pk': obj.pk,
+        'fields': values,
+    }
+
+def serialize_todos(objs, fields):
+    return [serialize_todo(obj, fields) for obj in objs]
@@ -35,15 +35,23 @@
 #
 # ***** END LICENSE BLOCK *****
 
-from django.template.loader import render_to_string
+from django.template.loader import render_to_string, get_template
 from django.utils.safestring import mark_safe
-from django.template import RequestContext
+from django.template import RequestContext, Context
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models import Count
 
 from todo.models import Tracker, Task, Step, TaskInProject
-from todo.workflow import NEXT
+from todo.models.step import get_step_tree
+from todo.workflow import NEW, ACTIVE, NEXT, RESOLVED
+from todo.db import chunked
+from todo.cache import tree_cache, TREE_CACHE_TIMEOUT
+from todo.views.render import TreeRenderer, StepsRenderer
+from todo.views.conditional import task_state, tracker_state
 
 from itertools import groupby
+import uuid
 
 def task(request, task, redirect_view='todo.views.demo.task'):
     """A single task view snippet.
@@ -58,16 +66,34 @@ def task(request, task, redirect_view='todo.views.demo.task'):
 
     See todo.views.demo.task for an example of how to use this snippet.
 
+    The returned `etag` and `last_modified` describe the version of the task
+    and can be used to answer conditional GET requests (see
+    todo.views.conditional).
+
     """
+    etag, last_modified = task_state(request, task.pk)
     redirect_url = reverse(redirect_view, args=[task.pk])
+    # Retrieve all the data displayed in the snippet upfront: the statuses of
+    # the task and the whole tree of steps with the timestamps needed to tell
+    # if they're overdue.  The number of queries doesn't depend on the number
+    # of steps.
+    statuses = list(task.statuses.select_related('project'))
+    task.is_resolved_all(statuses)
+    step_tree = get_step_tree(task)
+    steps = StepsRenderer(request, task, redirect_url,
+                          get_children=lambda s: step_tree.get(s.pk, []))
     div = render_to_string('todo/snippet_task.html',
                            {'task': task,
+                            'statuses': statuses,
+                            'steps': steps.render(step_tree.get(None, [])),
                             'redirect_url': redirect_url,},
                            # RequestContext is needed for checking 
                            # the permissions of the user.
                            context_instance=RequestContext(request))
     return {
         'div': mark_safe(div),
+        'etag': etag,
+        'last_modified': last_modified,
     }
 
 def showcase(request, project, locale, tasks_shown=5,
@@ -91,18 +117,7 @@ def showcase(request, project, locale, tasks_shown=5,
     # This is needed because MySQL 5.1 doesn't support LIMIT and IN in one 
     # query.
     tasks = list(tasks[:tasks_shown])
-    # instead of querying for next steps for every tasks separately, get all 
-    # next steps for the current tasks and group them by task
-    next_steps = {}
-    step_objects = Step.objects.select_related('task').order_by('task')
-    flat_next_steps = step_objects.filter(task__in=tasks, status=NEXT)
-    for task, steps in groupby(flat_next_steps, lambda s: s.task):
-        next_steps[task] = list(steps)
-    for task in tasks:
-        try:
-            task.next_steps = next_steps[task]
-        except KeyError:
-            task.next_steps = []
+    _attach_next_steps(tasks)
     div = render_to_string('todo/snippet_showcase.html',
                            {'tasks': tasks,
                             'task_view': task_view})
@@ -111,9 +126,112 @@ def showcase(request, project, locale, tasks_shown=5,
         'div': mark_safe(div),
     }
 
+# the maximum number of project+locale pairs whose tasks are retrieved by 
+# `showcases` in a single query
+SHOWCASES_BATCH = 100
+
+def showcases(request, pairs, tasks_shown=5,
+              task_view='todo.views.demo.task'):
+    """Showcase snippets for many project+locale combinations at once.
+
+    Returns a list of dicts like the ones returned by `showcase`, one for each
+    pair, in the same order.  The tasks of up to SHOWCASES_BATCH pairs are 
+    retrieved with three queries in total.
+
+    Arguments:
+    pairs -- a list of (project, locale) tuples, where project is an instance
+             of todo.models.Project and locale of life.models.Locale
+    tasks_shown -- a number of tasks to show for each pair
+    task_view -- a string with the name of the `single task` view
+
+    """
+    if not pairs:
+        return []
+    wanted = set((project.pk, locale.pk) for project, locale in pairs)
+    task_ids = dict((pair, []) for pair in wanted)
+    for batch in chunked(list(wanted), SHOWCASES_BATCH):
+        for row in _get_showcased_ids(batch, tasks_shown):
+            project_id, locale_id, task_id = row[:3]
+            task_ids[(project_id, locale_id)].append(task_id)
+    tasks = Task.objects.in_bulk(set(task_id for ids in task_ids.values()
+                                     for task_id in ids))
+    _attach_next_steps(tasks.values())
+
+    template = get_template('todo/snippet_showcase.html')
+    results = []
+    for project, locale in pairs:
+        pair_tasks = [tasks[task_id]
+                      for task_id in task_ids[(project.pk, locale.pk)]]
+        div = template.render(Context({'tasks': pair_tasks,
+                                       'task_view': task_view}))
+        results.append({
+            'empty': not bool(pair_tasks),
+            'div': mark_safe(div),
+        })
+    return results
+
+def _get_showcased_ids(pairs, tasks_shown):
+    """Get the IDs of the latest open tasks of the given project+locale pairs 
+    with a single query.
+
+    The query is a UNION ALL of one subquery per pair, each of them limited to
+    `tasks_shown` rows, so only the rows which are shown are read.  The 
+    subqueries are derived tables rather than parenthesized SELECTs, which
+    makes it work with SQLite as well as with MySQL and PostgreSQL.
+
+    The rows of a UNION ALL come in no particular order, so the combined 
+    result is ordered again by the pair and like in `showcase` within it.
+
+    Returns a list of (project ID, locale ID, task ID, latest resolution 
+    time) tuples.
+
+    """
+    qn = connection.ops.quote_name
+    tables = {
+        'status': qn(TaskInProject._meta.db_table),
+        'task': qn(Task._meta.db_table),
+        'task_pk': qn(Task._meta.pk.column),
+        'statuses': ', '.join(['%d' % status 
+                               for status in (NEW, ACTIVE, NEXT)]),
+        'limit': int(tasks_shown),
+    }
+    subqueries = []
+    params = []
+    for i, (project_id, locale_id) in enumerate(pairs):
+        params.extend([project_id, locale_id])
+        subqueries.append(
+            'SELECT * FROM (SELECT s.project_id, t.locale_id, s.task_id, '
+            't.latest_resolution_ts '
+            'FROM %(status)s s INNER JOIN %(task)s t '
+            'ON t.%(task_pk)s = s.task_id '
+            'WHERE s.project_id = %%s AND t.locale_id = %%s '
+            'AND s.status IN (%(statuses)s) '
+            'ORDER BY t.latest_resolution_ts DESC, s.task_id '
+            'LIMIT %(limit)d) pair%(i)d' % dict(tables, i=i))
+    cursor = connection.cursor()
+    cursor.execute(' UNION ALL '.join(subqueries) + 
+                   ' ORDER BY project_id, locale_id, '
+                   'latest_resolution_ts DESC, task_id', params)
+    return cursor.fetchall()
+
+def _attach_next_steps(tasks):
+    """Set the next_steps attribute of the tasks to the list of their NEXT
+    steps, using a single query."""
+    # instead of querying for next steps for every tasks separately, get all 
+    # next steps for the current tasks and group them by task
+    next_steps = {}
+    step_objects = Step.objects.order_by('task')
+    flat_next_steps = step_objects.filter(task__in=[task.pk for task in tasks],
+                                          status=NEXT)
+    for task_id, steps in groupby(flat_next_steps, lambda s: s.task_id):
+        next_steps[task_id] = list(steps)
+    for task in tasks:
+        task.next_steps = next_steps.get(task.pk, [])
+
 def tree(request, tracker=None, project=None, locale=None,
          task_view='todo.views.demo.task',
-         tracker_view='todo.views.demo.tracker'):
+         tracker_view='todo.views.demo.tracker',
+         lazy_depth=None, subtree_view='todo.views.demo.subtree'):
     """A snippet to be included on a single tracker page.
 
     Arguments:
@@ -123,48 +241,283 @@ def tree(request, tracker=None, project=None, locale=None,
     locale -- an instance of life.models.Locale. ANDed with project.
     task_view -- a string with the name of the `single task` view
     tracker_view -- a string with the name of the `single tracker` view
+    lazy_depth -- an integer. If given, only this many levels of the tree are
+                  retrieved and rendered.  The trackers on the last level
+                  show the number of their children and the progress of their
+                  tasks instead, and their subtrees are loaded on demand from
+                  `subtree_view`.
+    subtree_view -- a string with the name of the view returning the subtree
+                    of a single tracker (see `subtree` below)
 
     See todo.views.demo.tracker and todo.views.demo.trackers for examples of 
     how to use this snippet.
 
+    If the TODO_TREE_CACHE_TIMEOUT setting is set, the rendered tree is cached
+    and reused until a todo object in it changes.  See todo.cache for details.
+
+    For trees of a tracker, the returned `etag` and `last_modified` describe
+    the version of the tracker (see todo.views.conditional); they're None for
+    project and locale trees.
+
     """
-    tracker_objects = Tracker.objects.select_related('parent')
-    task_objects = Task.objects.select_related('parent')
-    step_objects = Step.objects.select_related('task').order_by('task')
-    status_objects = TaskInProject.objects.select_related('task', 'project')
-    status_objects = status_objects.order_by('task')
+    etag = last_modified = None
+    if tracker is not None:
+        etag, last_modified = tracker_state(request, tracker.pk)
+    if TREE_CACHE_TIMEOUT:
+        cache_key = tree_cache.get_key(request, tracker, project, locale,
+                                       task_view, tracker_view, lazy_depth,
+                                       subtree_view)
+        cached = tree_cache.get(cache_key)
+        if cached is not None:
+            return {
+                'empty': cached['empty'],
+                'div': mark_safe(cached['div']),
+                'etag': etag,
+                'last_modified': last_modified,
+            }
+
+    tree, facets, empty = _get_tree(tracker, project, locale, lazy_depth)
+    renderer = TreeRenderer(request, task_view, tracker_view, subtree_view)
+    div = render_to_string('todo/snippet_tree.html',
+                           {'nodes': renderer.render(tree),
+                            'facets': facets},
+                           # the template is only the shell of the snippet; 
+                           # the nodes are rendered by TreeRenderer which 
+                           # checks the permissions of the user itself.
+                           context_instance=RequestContext(request))
+    if TREE_CACHE_TIMEOUT:
+        tree_cache.set(cache_key, {'empty': empty, 'div': div})
+    return {
+        'empty': empty,
+        'div': mark_safe(div),
+        'etag': etag,
+        'last_modified': last_modified,
+    }
+
+def tree_stream(request, tracker=None, project=None, locale=None,
+                task_view='todo.views.demo.task',
+                tracker_view='todo.views.demo.tracker',
+                lazy_depth=None, subtree_view='todo.views.demo.subtree',
+                chunk_size=8192):
+    """A streaming variant of the `tree` snippet.
+
+    Instead of rendering the whole tree at once, this snippet returns
+    a generator yielding the HTML of the tree in chunks of roughly
+    `chunk_size` characters, as the tree is walked.  The beginning of the
+    snippet is yielded before the tree is retrieved from the DB.  The
+    generator can be passed directly to an HttpResponse; make sure no
+    middleware consumes the content of the response (e.g. GZipMiddleware or
+    USE_ETAGS), or the benefits of streaming will be lost.
+
+    The subtrees of the top-most trackers (and the top-most tasks, in 
+    batches) are retrieved one after another, as they are rendered, so only 
+    one of them is kept in memory at a time.  This runs a few queries per 
+    top-most tracker.  A tree of a single tracker is still retrieved at once.
+
+    See `tree` above for the description of the arguments.  See
+    todo.views.demo.trackers_stream for an example of how to use this snippet.
+
+    """
+    renderer = TreeRenderer(request, task_view, tracker_view, subtree_view)
+    return _chunked(_stream_tree(request, renderer, tracker, project, locale,
+                                 lazy_depth), chunk_size)
+
+# a placeholder for the nodes of the tree in the template of the snippet
+_PLACEHOLDER = mark_safe('todo-stream-placeholder-%s' % uuid.uuid4().hex)
+
+def _chunked(pieces, chunk_size):
+    "Join small pieces of text into chunks of roughly `chunk_size` length."
+    buf = []
+    length = 0
+    for piece in pieces:
+        buf.append(piece)
+        length += len(piece)
+        if length >= chunk_size:
+            yield ''.join(buf)
+            buf = []
+            length = 0
+    if buf:
+        yield ''.join(buf)
+
+# the number of top-most tasks retrieved at once by `_stream_tree`
+STREAM_TASKS_BATCH = 100
+
+def _stream_tree(request, renderer, tracker, project, locale, lazy_depth):
+    shell = get_template('todo/snippet_tree.html')
+    context = RequestContext(request, {'nodes': _PLACEHOLDER, 'facets': {}})
+    yield shell.render(context).split(_PLACEHOLDER)[0]
+    facets = _empty_facets()
+    def _merge(subtree_facets):
+        for prop, values in subtree_facets.iteritems():
+            facets[prop] = list(set(facets[prop]) | set(values))
+    # Retrieve and render the subtrees of the top-most trackers one at 
+    # a time, so that only one of them is kept in memory.
+    root_trackers, root_tasks = _get_roots(tracker, project, locale)
+    # iterate over a dict to render the trackers in the same order as `tree`
+    for root in dict.fromkeys(root_trackers):
+        subtree, subtree_facets, empty = _get_tree(None, None, None, 
+                                                   lazy_depth,
+                                                   roots=([root], []))
+        _merge(subtree_facets)
+        for piece in renderer.iter_tracker(root, subtree['trackers'][root]):
+            yield piece
+    yield u'<div class="tasks">'
+    for i in range(0, len(root_tasks), STREAM_TASKS_BATCH):
+        batch = root_tasks[i:i + STREAM_TASKS_BATCH]
+        subtree, subtree_facets, empty = _get_tree(None, None, None,
+                                                   lazy_depth,
+                                                   roots=([], batch))
+        _merge(subtree_facets)
+        for task, properties in subtree['tasks'].iteritems():
+            yield renderer.task(task, properties)
+    yield u'</div>'
+    for prop, values in facets.iteritems():
+        facets[prop] = sorted(values)
+    context['facets'] = facets
+    yield shell.render(context).split(_PLACEHOLDER)[1]
+
+def subtree(request, tracker, lazy_depth=1,
+            task_view='todo.views.demo.task',
+            tracker_view='todo.views.demo.tracker',
+            subtree_view='todo.views.demo.subtree'):
+    """A snippet with the children of a single tracker.
+
+    This snippet is used to expand the trackers of a tree rendered with
+    `lazy_depth` (see `tree` above).  Apps using todo should wire it to
+    a view and pass the name of the view as `subtree_view` to `tree`.
+
+    Arguments:
+    tracker -- an instance of todo.models.Tracker
+    lazy_depth -- the number of levels below the tracker to render
+    task_view -- a string with the name of the `single task` view
+    tracker_view -- a string with the name of the `single tracker` view
+    subtree_view -- a string with the name of the view using this snippet
 
+    Returns a dict with the rendered children of the tracker in `div` and
+    a JSON-serializable description of them in `data`.
+
+    See todo.views.demo.subtree for an example of how to use this snippet.
+
+    """
+    tree, facets, empty = _get_tree(tracker, None, None, lazy_depth + 1)
+    children = tree['trackers'][tracker]
+    renderer = TreeRenderer(request, task_view, tracker_view, subtree_view)
+    div = renderer.render(children)
+    data = {
+        'trackers': [dict(id=child.pk, repr=child.repr,
+                          **subtree.get('lazy', {}))
+                     for child, subtree in children['trackers'].iteritems()],
+        'tasks': [{'id': task.pk,
+                   'repr': task.repr,
+                   'resolved': task.is_resolved_all()}
+                  for task in children['tasks']],
+    }
+    return {
+        'empty': not (children['trackers'] or children['tasks']),
+        'div': mark_safe(div),
+        'data': data,
+    }
+
+def _get_summaries(trackers):
+    """Get the number of children and the progress of the given trackers.
+
+    Used for the trackers whose subtrees are not retrieved in the lazy mode of
+    `tree`.  The progress is the percentage of resolved statuses of the tasks
+    directly under the tracker.
+
+    """
+    summaries = dict((tracker.pk, {'trackers': 0, 'tasks': 0, 'progress': 0})
+                     for tracker in trackers)
+    child_trackers = Tracker.objects.filter(parent__in=trackers)
+    for row in child_trackers.values('parent').annotate(count=Count('pk')):
+        summaries[row['parent']]['trackers'] = row['count']
+    child_tasks = Task.objects.filter(parent__in=trackers)
+    for row in child_tasks.values('parent').annotate(count=Count('pk')):
+        summaries[row['parent']]['tasks'] = row['count']
+    task_statuses = TaskInProject.objects.filter(task__parent__in=trackers)
+    all = dict((row['task__parent'], row['count']) for row in
+               task_statuses.values('task__parent').annotate(
+                   count=Count('pk')))
+    resolved = dict((row['task__parent'], row['count']) for row in
+                    task_statuses.filter(status=RESOLVED)
+                                 .values('task__parent').annotate(
+                                     count=Count('pk')))
+    for tracker_id, count in all.iteritems():
+        summaries[tracker_id]['progress'] = (100 * resolved.get(tracker_id, 0)
+                                             / count)
+    return summaries
+
+def _empty_facets():
+    "Get a dict of empty lists of values of the tasks' facets."
+    return {
+        'projects': [],
+        'locales': [],
+        'statuses': [],
+        'prototypes': [],
+        'bugs': [],
+        'trackers': [],
+        'next_steps_owners': [],
+        'next_steps': [],
+    }
+
+def _get_roots(tracker, project, locale):
+    """Get the lists of the top-most trackers and tasks of a tree.
+
+    See `tree` above for the description of the arguments.
+
+    """
     if tracker is not None:
-        trackers = (tracker,)
-        tasks = []
+        return [tracker], []
+    trackers = Tracker.objects.select_related('parent')
+    tasks = Task.objects.select_related('parent')
+    # trackers come in 3 types:
+    # 1. no projects, no locale -- so-called 'generic' trackers
+    # 2. projects, no locale
+    # 3. projects, locale
+    if project is not None:
+        # requesting type 2 or 3
+        trackers = trackers.filter(projects=project)
+        tasks = tasks.filter(projects=project)
+    if locale is not None:
+        # requesting type 3
+        # return top-most trackers/tasks for the locale
+        trackers = trackers.filter(locale=locale, parent__locale=None)
+        tasks = tasks.filter(locale=locale, parent__locale=None)
     else:
-        # call `all` to get a new queryset to work with
-        trackers = tracker_objects.all()
-        tasks = task_objects.all()
-        # trackers come in 3 types:
-        # 1. no projects, no locale -- so-called 'generic' trackers
-        # 2. projects, no locale
-        # 3. projects, locale
-        if project is not None:
-            # requesting type 2 or 3
-            trackers = trackers.filter(projects=project)
-            tasks = tasks.filter(projects=project)
-        if locale is not None:
-            # requesting type 3
-            # return top-most trackers/tasks for the locale
-            trackers = trackers.filter(locale=locale, parent__locale=None)
-            tasks = tasks.filter(locale=locale, parent__locale=None)
-        else:
-            # requesting type 2
-            # return top-most trackers/tasks for the project
-            trackers = trackers.filter(parent__projects=None)
-            tasks = tasks.filter(parent__projects=None)
+        # requesting type 2
+        # return top-most trackers/tasks for the project
+        trackers = trackers.filter(parent__projects=None)
+        tasks = tasks.filter(parent__projects=None)
     # force-evaluate the querysets to reduce queries' amount and complexity;
     # bool() and while are faster for lists and passing a list to a 
     # `filter(task__in=tasks` results in a simple WHERE ... IN (id1, id2, etc) 
     # instead of an extra JOIN.
-    trackers = list(trackers)
-    tasks = list(tasks)
+    return list(trackers), list(tasks)
+
+def _get_tree(tracker, project, locale, lazy_depth=None, roots=None):
+    """Retrieve a tree of trackers and tasks and the facets of the tasks.
+
+    See `tree` above for the description of the arguments.  If `roots` is 
+    given, it's a tuple of lists of the top-most trackers and tasks of the 
+    tree to retrieve (see `_get_roots`) and the other arguments but 
+    `lazy_depth` are ignored.
+
+    Returns:
+        a tuple of (tree, facets, empty) where `tree` is a tree-like structure
+        of dicts representing the hierarchy of trackers and tasks, `facets` is
+        a dict of values of all tasks' facets and `empty` is True if there are
+        no trackers nor tasks to show.
+
+    """
+    tracker_objects = Tracker.objects.select_related('parent')
+    task_objects = Task.objects.select_related('parent')
+    step_objects = Step.objects.select_related('task').order_by('task')
+    status_objects = TaskInProject.objects.select_related('task', 'project')
+    status_objects = status_objects.order_by('task')
+
+    if roots is None:
+        roots = _get_roots(tracker, project, locale)
+    trackers, tasks = roots
     # is there anything to show?
     empty = not (bool(trackers) or bool(tasks))
 
@@ -193,10 +546,17 @@ def tree(request, tracker=None, project=None, locale=None,
         flat_statuses = status_objects.filter(task__in=tasks)
         for task, task_statuses in groupby(flat_statuses, lambda s: s.task):
             statuses[task] = list(task_statuses)
+        depth += 1
+        if lazy_depth is not None and depth >= lazy_depth:
+            # don't retrieve the subtrees of the trackers on the last level;
+            # only summarize them
+            summaries = _get_summaries(trackers)
+            for tracker in trackers:
+                cache[tracker]['lazy'] = summaries[tracker.pk]
+            break
         # prepare for the loop's next run
         tasks = list(task_objects.filter(parent__in=trackers))
         trackers = list(tracker_objects.filter(parent__in=trackers))
-        depth += 1
 
     # 2. iterate over the cache a couple of times and group retrived trackers
     #    and tasks into a tree-like structure
@@ -233,16 +593,7 @@ def tree(request, tracker=None, project=None, locale=None,
 
     # 3. recurse into the tree to retrieve the meta data about the tasks and
     #    store it in the tree (in corresponding task dicts) and as the facets
-    facets = {
-        'projects': [],
-        'locales': [],
-        'statuses': [],
-        'prototypes': [],
-        'bugs': [],
-        'trackers': [],
-        'next_steps_owners': [],
-        'next_steps': [],
-    }
+    facets = _empty_facets()
 
     def _get_facet_data(tree, tracker_chain=[]):
         """Retrive meta data for every task in the tree.
@@ -272,19 +623,9 @@ def tree(request, tracker=None, project=None, locale=None,
                 # the task might be inactive or resolved, and thus might have 
                 # no next steps
                 task.next_steps = []
-            task_properties = {
-                'projects': [unicode(s.project) for s in statuses[task]],
-                'locales': [task.locale_repr],
-                'statuses': ['%s for %s' % 
-                             (s.get_status_display(), unicode(s.project))
-                             for s in statuses[task]],
-                'prototypes': [task.prototype_repr],
-                'bugs': [task.bugid],
-                'trackers': [t.summary for t in tracker_chain],
-                'next_steps': [unicode(step) for step in task.next_steps],
-                'next_steps_owners': [step.owner_repr
-                                      for step in task.next_steps],
-            }
+            task_properties = task.get_facet_data(statuses[task],
+                                                  task.next_steps,
+                                                  tracker_chain)
             # call this now so that when it's called from the template, the
             # cached value is used
             task.is_resolved_all(statuses[task])
@@ -299,16 +640,4 @@ def tree(request, tracker=None, project=None, locale=None,
     # sort the facets alphabetically
     for k, v in facets.iteritems():
         facets[k] = sorted(v)
-
-    div = render_to_string('todo/snippet_tree.html',
-                           {'tree': tree,
-                            'facets': facets,
-                            'task_view': task_view,
-                            'tracker_view': tracker_view},
-                           # RequestContext is needed for checking 
-                           # the permissions of the user.
-                           context_instance=RequestContext(request))
-    return {
-        'empty': empty,
-        'div': mark_safe(div),
-    }
+    return tree, facets, empty